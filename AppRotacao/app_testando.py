@@ -1,203 +1,108 @@
-import streamlit as st
+import time
+INICIO_SCRIPT = time.perf_counter()
+
 import os
-import tempfile
-import pyodbc
-import sqlite3
-import zipfile
-import numpy as np
+import streamlit as st
 import pandas as pd
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from banco_local import (inicializar_banco, versao_historico, reversoes_historico, carregar_rotacoes,
+                         carregar_vendedores, vendedores_por_tipo, cadastrar_vendedor, remover_vendedor,
+                         exportar_contas_rotacionadas, consultar_historico, opcoes_filtro_historico,
+                         atualizar_agregados_rotacao, registrar_conversao,
+                         versao_agregados, carregar_agregados)
+from painel import renderizar_figuras
+from rotacao import executar_rotacao_guardada
+from resultados import resumo_resultado, carregar_resultado, arquivo_excel
+from relatorios import gerar_pacote_relatorios, descartar_pacote
+from tarefas import submeter_tarefa, consultar_tarefa, tarefa_em_andamento
+from simulacao import simular_capacidade, resumir_simulacao
+from extracao import (CHAVES_CREDENCIAIS, carregar_extracao, ler_extracao_em_lotes,
+                      consultar_nomes_vendedores_empresa)
+from aquecimento import iniciar_aquecimento, registrar_etapa, tempos_inicializacao
+from execucoes import listar_execucoes, reverter_execucao
+from consultas import CONSULTAS, consultar
+from snapshots import (salvar_snapshot, salvar_snapshot_partes, listar_snapshots, carregar_snapshot,
+                       ler_snapshot_em_lotes, comparar_snapshots, resumir_diferencas)
+from pipeline import (MODO_LOTES_PADRAO, ORCAMENTO_MEMORIA_MB_PADRAO, COLUNAS_BASE_RELATORIO, MOTORES, MOTOR_PADRAO,
+                      datas_da_rodada, preparar_referencia, processar_extracao, processar_em_lotes, carregar_partes,
+                      nova_pasta_lotes, descartar_lotes, explicar_elegibilidade)
 
 import warnings
 warnings.filterwarnings('ignore')
 
-def connect_db():
-    conn = sqlite3.connect("vendedores.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS vendedores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome TEXT NOT NULL UNIQUE,
-            tipo TEXT NOT NULL CHECK(tipo IN ('Distribuição', 'Corporativo'))
-        )
-    """)
-    conn.commit()
-    return conn
-
-def carregar_vendedores():
-    conn = sqlite3.connect("vendedores.db")
-    df = pd.read_sql("SELECT nome, tipo FROM vendedores", conn)
-    return df
-
-def criar_tabela_historico():
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-        CREATE TABLE IF NOT EXISTS historico_rotacao (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nome_vendedor TEXT,
-            conta_id INTEGER,
-            tipo_rotacao TEXT,
-            data_rotacao TEXT
-        )
-        ''')
-        conn.commit()
-        conn.close()
+# pandas 2.x: liga o Copy-on-Write (já é o padrão no pandas 3) para que seleções e
+# assign não dupliquem o frame inteiro
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.set_option('mode.copy_on_write', True)
 
-criar_tabela_historico()
+inicializar_banco()
+# Só a primeira execução do processo conta: nas seguintes os módulos já estão em sys.modules
+registrar_etapa('importacoes', time.perf_counter() - INICIO_SCRIPT, uma_vez=True)
 
 # ---------- CONFIGURAÇÕES INICIAIS ----------
 st.set_page_config(page_title="Rotação de Carteiras", layout="wide")
 st.title("🔁 Sistema de Rotação de Carteiras")
+with st.sidebar.expander("⏱️ Inicialização do servidor"):
+    st.dataframe(tempos_inicializacao(), hide_index=True)
+with st.sidebar.expander("🧮 Bases muito grandes"):
+    modo_lotes = st.checkbox("Processar a extração em lotes (fora da memória)", value=MODO_LOTES_PADRAO)
+    orcamento_memoria_mb = st.number_input("Orçamento de memória (MB)", min_value=64,
+                                           value=ORCAMENTO_MEMORIA_MB_PADRAO, step=64)
+    motor = st.selectbox("Motor de processamento", MOTORES, index=MOTORES.index(MOTOR_PADRAO),
+                         help="polars usa todos os núcleos; o resultado é o mesmo do pandas")
+def descrever_snapshot(linha):
+    return f"{linha['momento']:%d/%m/%Y %H:%M} · {linha['tipo']} · {linha['rotulo']}"
+
+with st.sidebar.expander("📅 Data-base da rodada"):
+    # Uma data só para a rodada inteira: mudar de dia no meio não altera nada. Para refazer a rodada
+    # de um dia passado, a entrada pode ser a extração salva naquele dia (o histórico é lido como
+    # estava na data-base)
+    data_base = st.date_input("Data-base", value=datas_da_rodada()['data_rotacao'].date(), format="DD/MM/YYYY")
+    extracoes_entrada = listar_snapshots('extracao')
+    entrada_extracao = st.selectbox(
+        "Extração de entrada", [None] + list(range(len(extracoes_entrada))),
+        format_func=lambda i: "Extração atual do SQL Server" if i is None else descrever_snapshot(extracoes_entrada.loc[i])
+    )
+    snapshot_entrada = None if entrada_extracao is None else extracoes_entrada.at[entrada_extracao, 'caminho']
+datas = datas_da_rodada(data_base)
+data_limite = datas['data_limite']
+
+# ---------- TAREFAS EM SEGUNDO PLANO ----------
+@st.fragment(run_every=1)
+def acompanhar_tarefa(chave):
+    # Atualiza só a barra de progresso; ao terminar, roda o script inteiro para exibir o resultado
+    tarefa = consultar_tarefa(st.session_state[chave])
+    if tarefa is None:
+        return
+    if tarefa_em_andamento(tarefa['id']):
+        st.progress(tarefa['progresso'], text=f"{tarefa['descricao']}: {tarefa['mensagem']}")
+    elif not st.session_state.get(f"{chave}_exibida"):
+        st.session_state[f"{chave}_exibida"] = True
+        st.rerun()
+
+def iniciar_tarefa(chave, funcao, *args, descricao='', **kwargs):
+    st.session_state[chave] = submeter_tarefa(funcao, *args, descricao=descricao, **kwargs)
+    st.session_state[f"{chave}_exibida"] = False
 
 # ---------- CONEXÃO COM BANCO DE DADOS ----------
-@st.cache_data
-def carregar_dados_sql():
-    server = st.secrets["DB_SERVER"]
-    database = st.secrets["DB_NAME"]
-    username = st.secrets["DB_USER"]
-    password = st.secrets["DB_PASSWORD"]
-
-    connection_string = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={server};DATABASE={database};UID={username};PWD={password}"
-    )
+def credenciais_sql():
+    return {chave: st.secrets[chave] for chave in CHAVES_CREDENCIAIS}
 
-    conn = pyodbc.connect(connection_string)
-
-    query = """WITH Faturamento AS (
-    SELECT pessoa_id, SUM(valor_total) AS valor_total
-    FROM dbo.rel_faturamento
-    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
-    GROUP BY pessoa_id
-),
-Followups AS (
-    SELECT pessoa_id, COUNT(*) AS total_followups, MAX(data_cadastro) AS data_ultimo_followup
-    FROM dbo.pessoas_followup_anexos
-    GROUP BY pessoa_id
-),
-Contatos AS (
-    SELECT pessoa_id, COUNT(*) AS total_contatos, MAX(data_cadastro) AS data_ultimo_contato
-    FROM dbo.contatos
-    GROUP BY pessoa_id
-),
-Oportunidades AS (
-    SELECT
-        conta_id AS pessoa_id,
-        COUNT(*) AS total_oportunidades,
-        MAX(data_cadastro) AS data_ultima_oportunidade
-    FROM dbo.crm_oportunidades
-    GROUP BY conta_id
-),
-UltimaVendaPorRaizCNPJ AS (
-    SELECT LEFT(cpf_cnpj, 8) AS Raiz_CNPJ, MAX(data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ
-    FROM dbo.pessoas
-    WHERE data_ultima_venda IS NOT NULL
-    GROUP BY LEFT(cpf_cnpj, 8)
-),
-Pedidos AS (
-    SELECT
-        pessoa_id,
-        COUNT(*) AS total_pedidos
-    FROM dbo.rel_faturamento
-    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
-    GROUP BY pessoa_id
-),
-Orcamentos AS (
-    SELECT
-        pessoa_cliente_id,
-        COUNT(*) AS total_orcamentos,
-        MAX(data_emissao) AS data_ultimo_orcamento
-    FROM dbo.rel_crm_orcamentos
-    GROUP BY pessoa_cliente_id
-),
-PedidosPorRevenda AS (
-    SELECT
-        p.revenda_id AS pessoa_id,
-        COUNT(*) AS total_pedidos_revenda,
-        SUM(p.valor_total) AS valor_total_revenda,
-        MAX(p.data_faturamento) AS ultima_data_pedido_revenda
-    FROM dbo.rel_pedidos p
-    WHERE
-        p.revenda_id IS NOT NULL
-        AND p.data_faturamento >= DATEADD(MONTH, -6, GETDATE())
-    GROUP BY p.revenda_id
-)
+def carregar_dados_sql():
+    return carregar_extracao(credenciais_sql())
 
--- Query principal
-SELECT
-    a.id AS Conta_ID,
-    a.tipo_conta,
-    b.razao_social AS Razao_Social_Pessoas,
-    b.cpf_cnpj AS CNPJ,
-    LEFT(b.cpf_cnpj, 8) AS Raiz_CNPJ,
-    c.grupo_id AS Grupo_Econômico_ID,
-    c.grupo_nome AS Grupo_Econômico_Nome,
-    v.razao_social AS Nome_Vendedor,
-    b.data_ultima_venda AS Data_Ultima_Venda_Individual,
-
-    -- Soma do faturamento direto + indireto (como revenda)
-    COALESCE(f.valor_total, 0) + COALESCE(pr.valor_total_revenda, 0) AS Faturamento_6_Meses,
-
-    a.data_cadastro AS Data_Abertura_Conta,
-    COALESCE(p.total_pedidos, 0) + COALESCE(pr.total_pedidos_revenda, 0) AS Total_Pedidos,
-    COALESCE(g.Data_Ultima_Venda_Grupo_CNPJ, b.data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ,
-    COALESCE(fu.total_followups, 0) AS Total_Followups,
-    fu.data_ultimo_followup AS Data_Ultimo_Followup,
-    COALESCE(ct.total_contatos, 0) AS Total_Contatos,
-    ct.data_ultimo_contato AS Data_Ultimo_Contato,
-    COALESCE(o.total_oportunidades, 0) AS Total_Oportunidades,
-    o.data_ultima_oportunidade AS Data_Ultima_Oportunidade,
-    a.classificacao_id AS Classificacao_Conta,
-    b.classificacao_id AS Classificacao_Pessoa,
-    a.porte_id AS Porte_Empresa,
-
-    -- Orçamentos
-    (
-        SELECT COUNT(*)
-        FROM dbo.rel_crm_orcamentos d
-        WHERE d.pessoa_cliente_id = b.id
-    ) AS Total_Orcamentos,
-
-    (
-        SELECT MAX(data_emissao)
-        FROM dbo.rel_crm_orcamentos d
-        WHERE d.pessoa_cliente_id = b.id
-    ) AS Data_Ultimo_Orcamento
-
-FROM
-    grupofort.dbo.crm_contas a
-    INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
-    INNER JOIN dbo.rel_pessoas c ON b.id = c.id
-    INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
-    LEFT JOIN Faturamento f ON a.cliente_id = f.pessoa_id
-    LEFT JOIN Followups fu ON b.id = fu.pessoa_id
-    LEFT JOIN Contatos ct ON b.id = ct.pessoa_id
-    LEFT JOIN Oportunidades o ON a.id = o.pessoa_id
-    LEFT JOIN UltimaVendaPorRaizCNPJ g ON LEFT(b.cpf_cnpj, 8) = g.Raiz_CNPJ
-    LEFT JOIN Pedidos p ON a.cliente_id = p.pessoa_id
-    LEFT JOIN PedidosPorRevenda pr ON b.id = pr.pessoa_id
-
-WHERE
-    a.tipo_conta = 2
-    AND a.excluido = 0
-    AND a.status_conta = 0
-    AND b.classificacao_id <> 1
-    AND a.classificacao_id <> 1;
-"""
-    df = pd.read_sql(query, conn)
-    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
-    df['Faturamento_6_Meses'] = df['Faturamento_6_Meses'].round(2)
-    conn.close()
-    return df
+iniciar_aquecimento(credenciais_sql())
 
 # ---------- SELEÇÃO DE GRUPO DE VENDEDORES ----------
 
-conn = connect_db()
-cursor = conn.cursor()
 df_vendedores = carregar_vendedores()
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def carregar_nomes_vendedores_empresa():
+    return consultar_nomes_vendedores_empresa(credenciais_sql())
+
 st.markdown("#### 🛠️ **Gerencie o cadastro de seus vendedores ⬇️**")
 with st.expander("Clique aqui para expandir"):
     col1, col2 = st.columns(2)
@@ -205,25 +110,7 @@ with st.expander("Clique aqui para expandir"):
     with col1:
         st.markdown("### ➕ Cadastrar vendedor")
         
-        # Conexão e query para buscar os nomes dos vendedores da tabela dbo.pessoas
-        server = st.secrets["DB_SERVER"]
-        database = st.secrets["DB_NAME"]
-        username = st.secrets["DB_USER"]
-        password = st.secrets["DB_PASSWORD"]
-        connection_string = (
-            f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-            f"SERVER={server};DATABASE={database};UID={username};PWD={password}"
-        )
-        conn_vendedores = pyodbc.connect(connection_string)
-        query_vendedores = """
-        SELECT razao_social
-        FROM dbo.pessoas
-        WHERE vendedor = 1 AND ativo = 1
-        """
-        df_nomes_vendedores = pd.read_sql(query_vendedores, conn_vendedores)
-        conn_vendedores.close()
-
-        nomes_vendedores_empresa = sorted(df_nomes_vendedores['razao_social'].dropna().unique().tolist())
+        nomes_vendedores_empresa = carregar_nomes_vendedores_empresa()
         
         opcoes = [""] + nomes_vendedores_empresa + ["Outro (digitar manualmente)"]
 
@@ -244,8 +131,7 @@ with st.expander("Clique aqui para expandir"):
             elif nome in df_vendedores["nome"].values:
                 st.warning("Esse nome já está cadastrado.")
             else:
-                cursor.execute("INSERT INTO vendedores (nome, tipo) VALUES (?, ?)", (nome.strip(), tipo))
-                conn.commit()
+                cadastrar_vendedor(nome.strip(), tipo)
                 st.success(f"{nome} adicionado com sucesso!")
                 st.rerun()
 
@@ -255,9 +141,8 @@ with st.expander("Clique aqui para expandir"):
         distribuidores = df_vendedores[df_vendedores["tipo"] == "Distribuição"]["nome"].tolist()
         corporativos = df_vendedores[df_vendedores["tipo"] == "Corporativo"]["nome"].tolist()
 
-        def remover_vendedor(nome):
-            cursor.execute("DELETE FROM vendedores WHERE nome = ?", (nome,))
-            conn.commit()
+        def confirmar_remocao(nome):
+            remover_vendedor(nome)
             st.success(f"Vendedor '{nome}' removido com sucesso.")
             st.rerun()
 
@@ -279,7 +164,7 @@ with st.expander("Clique aqui para expandir"):
                     col_a, col_b = st.columns(2)
                     with col_a:
                         if st.button("✅ Confirmar remoção", key=f"confirmar_{nome}"):
-                            remover_vendedor(nome)
+                            confirmar_remocao(nome)
                     with col_b:
                         if st.button("❌ Cancelar", key=f"cancelar_{nome}"):
                             cancelar_remocao()
@@ -300,7 +185,7 @@ with st.expander("Clique aqui para expandir"):
                     col_a, col_b = st.columns(2)
                     with col_a:
                         if st.button("✅ Confirmar remoção", key=f"confirmar_{nome}"):
-                            remover_vendedor(nome)
+                            confirmar_remocao(nome)
                     with col_b:
                         if st.button("❌ Cancelar", key=f"cancelar_{nome}"):
                             cancelar_remocao()
@@ -313,20 +198,18 @@ with st.expander("Clique aqui para expandir"):
         else:
             st.write("_Nenhum vendedor cadastrado._")
 
-query = "SELECT nome FROM vendedores WHERE tipo = ?"
-cursor.execute(query, ('Distribuição',))
-vendedores_ativos_helder = [
-    row[0] for row in cursor.fetchall()
-]
+vendedores_cadastrados = vendedores_por_tipo()
+vendedores_ativos_helder = vendedores_cadastrados['Distribuição']
+vendedores_ativos_karen = vendedores_cadastrados['Corporativo']
 
-query = "SELECT nome FROM vendedores WHERE tipo = ?"
-cursor.execute(query, ('Corporativo',))
-vendedores_ativos_karen = [
-    row[0] for row in cursor.fetchall()
-]
+GRUPOS_VENDEDORES = {
+    "Distribuição (Helder)": vendedores_ativos_helder,
+    "Corporativo (Karen)": vendedores_ativos_karen,
+}
 
-opcao = st.selectbox("Escolha o grupo de vendedores:", ["Distribuição (Helder)", "Corporativo (Karen)"])
-vendedores_ativos = vendedores_ativos_helder if "Helder" in opcao else vendedores_ativos_karen
+opcao = st.selectbox("Escolha o grupo de vendedores:", list(GRUPOS_VENDEDORES) + ["Ambos os grupos"])
+grupos_selecionados = list(GRUPOS_VENDEDORES) if opcao == "Ambos os grupos" else [opcao]
+vendedores_ativos = [v for grupo in grupos_selecionados for v in GRUPOS_VENDEDORES[grupo]]
 pasta_relatorios = 'Relatorio_Vendedores_Helder' if "Helder" in opcao else 'Relatorio_Vendedores_Karen'
 
 st.markdown('------')
@@ -335,238 +218,291 @@ st.markdown('#### 1-Faça o upload do arquivo: historico de rotação com a data
 arquivo_referencia = st.file_uploader("📤 Clique em 'Drag and Drop' ou 'Browse files', selecione o arquivo com a data mais recente e envie o arquivo (histórico de rotação de carteiras):", type=["xlsx"])
 
 if arquivo_referencia:
-    df = carregar_dados_sql()
-    df = df.drop_duplicates(subset='Raiz_CNPJ')
-    referencia = pd.read_excel(arquivo_referencia, sheet_name='Planilha1')
-
-    # --- Carregar data de rotação por conta_id ---
-    conn = sqlite3.connect('historico_rotacao.db')
-    df_rotacao = pd.read_sql_query('''
-        SELECT conta_id, MAX(data_rotacao) as data_ultima_rotacao
-        FROM historico_rotacao
-        GROUP BY conta_id
-    ''', conn)
-    conn.close()
-
-    df_rotacao['data_ultima_rotacao'] = pd.to_datetime(df_rotacao['data_ultima_rotacao'])
-
-    df_rotacao['conta_id'] = df_rotacao['conta_id'].apply(
-    lambda x: int.from_bytes(x, byteorder='little') if isinstance(x, bytes) else int(x)
-    )
-
-
-    df['Raiz_CNPJ'] = df['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14)
-    referencia['Raiz_CNPJ'] = referencia['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14)
-    dict_transferencia = dict(zip(referencia['Raiz_CNPJ'], referencia['Nome_Vendedor']))
-
-    # Adiciona a coluna 'data_ultima_rotacao' com base no Conta_ID
-    df = df.merge(df_rotacao, how='left', left_on='Conta_ID', right_on='conta_id')
-
-    # Atualiza o Nome_Vendedor do df conforme a referência
-    df['Nome_Vendedor'] = df.apply(
-        lambda row: dict_transferencia[row['Raiz_CNPJ']] if row['Raiz_CNPJ'] in dict_transferencia else row['Nome_Vendedor'],
-        axis=1
-    )
-
-
-    # Agora você pode adicionar a data de entrada
-    df['Data_Entrou_Carteira'] = np.where(
-        df['Raiz_CNPJ'].isin(referencia['Raiz_CNPJ']),
-        pd.Timestamp('2025-03-20'),
-        pd.NaT
-    )
-
-    # Lógica de status
-    data_limite = datetime.today() - timedelta(days=6*30)
-
-    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
-
-    df['Status_Cliente'] = df.apply(
-        lambda row: 'Compra' if row['Faturamento_6_Meses'] > 0
-        else 'Compra' if pd.notna(row['Data_Ultima_Venda_Grupo_CNPJ']) and row['Data_Ultima_Venda_Grupo_CNPJ'] >= data_limite
-        else 'Nao Compra',
-        axis=1
-    )
-
-
-    # --- Garantir tipos corretos ---
-    df['Data_Ultimo_Contato'] = pd.to_datetime(df['Data_Ultimo_Contato'], errors='coerce')
-    df['Data_Ultimo_Followup'] = pd.to_datetime(df['Data_Ultimo_Followup'], errors='coerce')
-    df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
-    df['Data_Ultimo_Orcamento'] = pd.to_datetime(df['Data_Ultimo_Orcamento'], errors='coerce')
-
-    # --- Contatos e Follow-ups após rotação ---
-    df['Total_Contatos_Rotacao'] = df.apply(
-        lambda row: row['Total_Contatos'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                            pd.notna(row['Data_Ultimo_Contato']) and
-                                            pd.notna(row['data_ultima_rotacao']) and
-                                            row['Data_Ultimo_Contato'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-    df['Total_Followups_Rotacao'] = df.apply(
-        lambda row: row['Total_Followups'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                            pd.notna(row['Data_Ultimo_Followup']) and
-                                            pd.notna(row['data_ultima_rotacao']) and
-                                            row['Data_Ultimo_Followup'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-    df['Total_Orcamentos_Rotacao'] = df.apply(
-    lambda row: row['Total_Orcamentos'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                              pd.notna(row['Data_Ultimo_Orcamento']) and
-                                              pd.notna(row['data_ultima_rotacao']) and
-                                              row['Data_Ultimo_Orcamento'] >= row['Data_Entrou_Carteira']
-                else 0,
-    axis=1
-    )
-
-    df['Total_Oportunidades_Rotacao'] = df.apply(
-        lambda row: row['Total_Oportunidades'] if pd.notna(row['Data_Entrou_Carteira']) and
-                                                pd.notna(row['Data_Ultima_Oportunidade']) and
-                                                pd.notna(row['data_ultima_rotacao']) and
-                                                row['Data_Ultima_Oportunidade'] >= row['Data_Entrou_Carteira']
-                    else 0,
-        axis=1
-    )
-
-
-    df_historico = df[['Raiz_CNPJ', 'Nome_Vendedor']].dropna().drop_duplicates().reset_index(drop=True)
-
-    df_filtrado = df[df['Nome_Vendedor'].isin(vendedores_ativos_helder + vendedores_ativos_karen)].reset_index(drop=True)
-
-    contas_vao_rotacionar = df[
-        (df['Status_Cliente'] == 'Nao Compra') &
-        (df['Data_Abertura_Conta'] < data_limite) &
-        ((df['Data_Entrou_Carteira'] < data_limite) | (df['Data_Entrou_Carteira'].isnull())) &
-        ((df['Grupo_Econômico_ID'].isnull()) | (df['Grupo_Econômico_ID'] == ''))
-    ]
-
-    if "Helder" in opcao:
-        contas_filtradas = contas_vao_rotacionar[contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])]
+    referencia = preparar_referencia(pd.read_excel(arquivo_referencia, sheet_name='Planilha1'))
+
+    # --- Carregar rotações do histórico ---
+    # Versão do histórico lida junto com as datas; a gravação da rotação confere se alguma
+    # dessas contas foi rotacionada por outra sessão depois desta leitura.
+    versao_historico_lida = versao_historico()
+    rotacoes_historico = carregar_rotacoes(versao_historico_lida)
+
+    vendedores_cadastrados_todos = vendedores_ativos_helder + vendedores_ativos_karen
+
+    # Refeito só quando algo de entrada muda; nos outros reruns a sessão reaproveita o resultado
+    chave_extracao = (arquivo_referencia.file_id, versao_historico_lida, reversoes_historico(), motor,
+                      tuple(vendedores_cadastrados_todos), datas['data_referencia'], snapshot_entrada)
+    if modo_lotes:
+        # A extração sai do SQL Server (ou do snapshot) em lotes; cada lote enriquecido vai para Parquet
+        # em disco e só as candidatas e os contadores ficam na memória
+        chave_lotes = chave_extracao + (orcamento_memoria_mb,)
+        if st.session_state.get("lotes_chave") != chave_lotes:
+            descartar_lotes(st.session_state.get("lotes_pasta"))
+            st.session_state["lotes_pasta"] = nova_pasta_lotes()
+            aviso_lotes = st.empty()
+            if snapshot_entrada is None:
+                lotes = ler_extracao_em_lotes(credenciais_sql(), orcamento_memoria_mb * 1024 * 1024)
+            else:
+                lotes = ler_snapshot_em_lotes(snapshot_entrada)
+            st.session_state["lotes_resultado"] = processar_em_lotes(
+                lotes, referencia, rotacoes_historico, vendedores_cadastrados_todos,
+                datas['data_referencia'], data_limite, st.session_state["lotes_pasta"],
+                progresso=lambda feito, total, mensagem: aviso_lotes.caption(mensagem), motor=motor
+            )
+            aviso_lotes.empty()
+            st.session_state["lotes_chave"] = chave_lotes
+        resultado_extracao = st.session_state["lotes_resultado"]
     else:
-        contas_filtradas = contas_vao_rotacionar[~contas_vao_rotacionar['Classificacao_Conta'].isin([5, 7])]
-
-    def registrar_historico_rotacao(nome_vendedor, conta_id, tipo_rotacao, data_rotacao):
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-        INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao)
-        VALUES (?, ?, ?, ?)
-        ''', (nome_vendedor, conta_id, tipo_rotacao, data_rotacao))
-        conn.commit()
-        conn.close()
-
-    # ---------- FUNÇÃO DE ROTAÇÃO ----------
-    def rotacionar_contas(df_contas, lista_vendedores, df_historico, limite_por_vendedor=50):
-        contagem_vendedores = {v: 0 for v in lista_vendedores}
-        novos_nomes = []
-        indices_sobras = []
-
-        for idx, row in df_contas.iterrows():
-            cnpj = row['Raiz_CNPJ']
-            vendedores_antigos = df_historico[df_historico['Raiz_CNPJ'] == cnpj]['Nome_Vendedor'].tolist()
-            candidatos = [v for v in lista_vendedores if v not in vendedores_antigos and contagem_vendedores[v] < limite_por_vendedor]
-            if candidatos:
-                escolhido = np.random.choice(candidatos)
-                contagem_vendedores[escolhido] += 1
-                novos_nomes.append((idx, escolhido))
+        if st.session_state.get("extracao_chave") != chave_extracao:
+            if snapshot_entrada is None:
+                df = carregar_dados_sql()
+                registrar_etapa('primeira_extracao', time.perf_counter() - INICIO_SCRIPT, uma_vez=True)
             else:
-                indices_sobras.append(idx)
-
-        df_resultado = df_contas.copy()
-        data_hoje = pd.Timestamp.today().normalize()
-
-        for idx, novo_vendedor in novos_nomes:
-            df_resultado.at[idx, 'Nome_Vendedor'] = novo_vendedor
-            df_resultado.at[idx, 'Data_Entrou_Carteira'] = data_hoje
-
-            # Registrar histórico no banco
-        for idx, novo_vendedor in novos_nomes:
-            conta_id = df_contas.at[idx, 'Conta_ID']
-            registrar_historico_rotacao(
-                nome_vendedor=novo_vendedor,
-                conta_id=conta_id,
-                tipo_rotacao='Automática',
-                data_rotacao=data_hoje.strftime('%Y-%m-%d')
+                # A extração salva é a base já enriquecida: enriquecer de novo sobrescreve as mesmas colunas
+                df = carregar_snapshot(snapshot_entrada)
+            st.session_state["extracao_resultado"] = processar_extracao(
+                df, referencia, rotacoes_historico, vendedores_cadastrados_todos, datas['data_referencia'], data_limite,
+                motor=motor
             )
-
-        df_rotacionadas = df_resultado.loc[[idx for idx, _ in novos_nomes]].reset_index(drop=True)
-        df_sobras = df_resultado.loc[indices_sobras].reset_index(drop=True)
-
-        return df_rotacionadas, df_sobras
-    
-    def registrar_historico_rotacao(nome_vendedor, conta_id, tipo_rotacao, data_rotacao):
-        conn = sqlite3.connect('historico_rotacao.db')
-        c = conn.cursor()
-        c.execute('''
-            INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao)
-            VALUES (?, ?, ?, ?)
-        ''', (nome_vendedor, conta_id, tipo_rotacao, data_rotacao))
-        conn.commit()
-        conn.close()
-
+            st.session_state["extracao_chave"] = chave_extracao
+        resultado_extracao = st.session_state["extracao_resultado"]
+
+    # Retrato de conversão das contas rotacionadas para o painel e snapshot da extração
+    # enriquecida (uma vez por arquivo enviado e data-base; uma entrada que já é snapshot não é salva de novo)
+    chave_conversao = (arquivo_referencia.file_id, datas['data_referencia'])
+    if st.session_state.get("conversao_registrada") != chave_conversao:
+        registrar_conversao(resultado_extracao['conversao'], datas['data_referencia'].strftime('%Y-%m-%d'))
+        rotulo_snapshot = arquivo_referencia.name.rsplit('.', 1)[0]
+        if snapshot_entrada is None and resultado_extracao['partes'] is None:
+            salvar_snapshot(resultado_extracao['df'], 'extracao', rotulo=rotulo_snapshot,
+                            data_referencia=datas['data_referencia'])
+        elif snapshot_entrada is None and resultado_extracao['partes']:
+            salvar_snapshot_partes(resultado_extracao['partes'], 'extracao', rotulo=rotulo_snapshot,
+                                   data_referencia=datas['data_referencia'])
+        st.session_state["conversao_registrada"] = chave_conversao
+
+    df_historico = resultado_extracao['df_historico']
+    df_filtrado = resultado_extracao['df_filtrado']  # None no modo em lotes: lido das partes quando preciso
+    partes_extracao = resultado_extracao['partes']
+    contas_por_grupo = resultado_extracao['contas_por_grupo']
+    carga_por_vendedor = resultado_extracao['carga_atual']
+
+    # ---------- ELEGIBILIDADE (por que a conta não é candidata) ----------
+    with st.expander("❓ Por que uma conta não está entre as candidatas?"):
+        raiz_consultada = st.text_input("Raiz_CNPJ da conta").strip()
+        if raiz_consultada:
+            raiz_consultada = raiz_consultada.zfill(14)
+            elegibilidade = resultado_extracao['elegibilidade']
+            if raiz_consultada not in elegibilidade.index:
+                st.info("Raiz_CNPJ não encontrada na extração atual.")
+            elif motivos := explicar_elegibilidade(elegibilidade[raiz_consultada]):
+                st.warning("Fora da rotação: " + "; ".join(motivos))
+            else:
+                st.success("Conta candidata à rotação.")
+
+    # ---------- SIMULAÇÃO DE CAPACIDADE (não grava histórico) ----------
+    with st.expander("🎲 Simular capacidade antes de rotacionar"):
+        grupo_simulacao = st.selectbox("Grupo simulado", grupos_selecionados)
+        vendedores_grupo_simulacao = GRUPOS_VENDEDORES[grupo_simulacao]
+        limites_texto = st.text_input("Limites por vendedor a testar (separados por vírgula)", value="30, 40, 50, 60")
+        vendedores_simulacao = st.multiselect("Vendedores considerados", vendedores_grupo_simulacao,
+                                              default=vendedores_grupo_simulacao)
+        col_s1, col_s2, col_s3 = st.columns(3)
+        with col_s1:
+            n_rodadas = st.number_input("Rodadas por cenário", min_value=1, max_value=2000, value=200, step=50)
+        with col_s2:
+            fracao_candidatos = st.slider("Fração das contas candidatas por rodada", 0.1, 1.0, 1.0, 0.05)
+        with col_s3:
+            prob_ausencia = st.slider("Probabilidade de um vendedor estar ausente", 0.0, 0.5, 0.0, 0.05)
+
+        if st.button("▶️ Rodar simulação"):
+            limites = [int(x) for x in limites_texto.replace(';', ',').split(',') if x.strip().isdigit()]
+            grupos_simulacao = {'Selecionados': vendedores_simulacao}
+            if set(vendedores_simulacao) != set(vendedores_grupo_simulacao):
+                grupos_simulacao['Grupo completo'] = vendedores_grupo_simulacao
+            with st.spinner("Simulando rotações..."):
+                df_simulacao = simular_capacidade(
+                    contas_por_grupo[grupo_simulacao], grupos_simulacao, df_historico, limites,
+                    n_rodadas=int(n_rodadas),
+                    fracao_candidatos=fracao_candidatos,
+                    prob_ausencia=prob_ausencia
+                )
+            st.dataframe(resumir_simulacao(df_simulacao))
 
     # Botão de rotação
 st.markdown('#### 2-Clique no botão para rotacionar.')
-if st.button("🔁 Rodar contas agora"):
-    contas_rotacionadas, contas_sobras = rotacionar_contas(contas_filtradas, vendedores_ativos, df_historico)
-
-    st.success(f"Foram encontradas {len(contas_filtradas)} clientes disponiveis para rotação e {len(contas_rotacionadas)} foram rotacionados com sucesso.")
-    st.write("Contas rotacionadas:")
-    st.dataframe(contas_rotacionadas)
-    st.session_state["contas_rotacionadas"] = contas_rotacionadas
-    st.session_state["contas_sobras"] = contas_sobras
-
-    # Histórico
-    historico_path = "historico_rotacoes_completo.xlsx"
-    if os.path.exists(historico_path):
-        historico_existente = pd.read_excel(historico_path)
-        df_novos_historicos = pd.concat([historico_existente, contas_rotacionadas], ignore_index=True)
-    else:
-        df_novos_historicos = contas_rotacionadas.copy()
-
-    df_novos_historicos = df_novos_historicos.drop_duplicates(subset=["Raiz_CNPJ", "Data_Entrou_Carteira"], keep="last")
-    df_novos_historicos.to_excel(historico_path, index=False)
-
-    st.write("Contas sem rotação (sem vendedor disponível):")
-    st.dataframe(contas_sobras)
-
-# # VERIFICAÇÃO DE HISTORICO
-# st.subheader("📚 Histórico de Rotações Registradas")
+with st.expander("⚙️ Opções da rotação"):
+    balancear = st.checkbox("Balancear pelo tamanho atual da carteira", value=False)
+    seed_rotacao = st.number_input("Semente do sorteio (0 = aleatória)", min_value=0, value=0, step=1)
+if st.button("🔁 Rodar contas agora", disabled=tarefa_em_andamento(st.session_state.get("tarefa_rotacao"))):
+    carga_atual = carga_por_vendedor if balancear else None
+    # Os grupos escolhidos rodam juntos sobre a mesma base enriquecida, cada um com as suas candidatas
+    iniciar_tarefa(
+        "tarefa_rotacao", executar_rotacao_guardada,
+        {grupo: (contas_por_grupo[grupo], GRUPOS_VENDEDORES[grupo]) for grupo in grupos_selecionados},
+        df_historico,
+        versao_historico=versao_historico_lida,
+        carga_atual=carga_atual,
+        seed=int(seed_rotacao) or None,
+        data_rotacao=datas['data_rotacao'],
+        descricao="Rotação de contas"
+    )
 
-# if st.checkbox("🔍 Mostrar histórico de rotações"):
-#     conn = sqlite3.connect('historico_rotacao.db')
-#     df_historico = pd.read_sql_query("SELECT * FROM historico_rotacao ORDER BY data_rotacao DESC", conn)
-#     conn.close()
-#     st.dataframe(df_historico)
+if "tarefa_rotacao" in st.session_state:
+    acompanhar_tarefa("tarefa_rotacao")
+    tarefa = consultar_tarefa(st.session_state["tarefa_rotacao"])
+    if tarefa and tarefa['status'] == 'concluida':
+        # A sessão guarda só o id; as tabelas ficam no servidor e são lidas em fatias
+        st.session_state["resultado_rotacao"] = tarefa['resultado']
+    elif tarefa and tarefa['status'] == 'erro':
+        st.error(f"Erro na rotação: {tarefa['erro']}")
+
+def mostrar_resultado(id_resultado, nome, titulo, linhas_por_pagina=200):
+    total = resumo_resultado(id_resultado)['linhas'][nome]
+    st.write(f"{titulo} ({total})")
+    paginas = max((total - 1) // linhas_por_pagina + 1, 1)
+    pagina = 1
+    if paginas > 1:
+        pagina = st.number_input(f"Página (de {paginas})", min_value=1, max_value=paginas, value=1,
+                                 key=f"pagina_{nome}")
+    st.dataframe(carregar_resultado(id_resultado, nome, inicio=(pagina - 1) * linhas_por_pagina,
+                                    quantidade=linhas_por_pagina))
+
+resultado_rotacao = st.session_state.get("resultado_rotacao")
+if resultado_rotacao and resumo_resultado(resultado_rotacao) is None:
+    # Apagado pela limpeza do servidor (ou de outra réplica sem a mesma pasta)
+    del st.session_state["resultado_rotacao"]
+    resultado_rotacao = None
+if resultado_rotacao:
+    resumo_rotacao = resumo_resultado(resultado_rotacao)
+    st.success(f"Foram encontradas {resumo_rotacao['candidatas']} clientes disponiveis para rotação e "
+               f"{resumo_rotacao['linhas']['rotacionadas']} foram rotacionados com sucesso.")
+    for grupo, erro in resumo_rotacao.get('falhas', {}).items():
+        # Os outros grupos já foram gravados; este fica para uma nova rodada
+        st.error(f"O grupo {grupo} não foi rotacionado: {erro}")
+    mostrar_resultado(resultado_rotacao, 'rotacionadas', "Contas rotacionadas:")
+    mostrar_resultado(resultado_rotacao, 'sobras', "Contas sem rotação (sem vendedor disponível):")
+
+# VERIFICAÇÃO DE HISTORICO
+st.subheader("📚 Histórico de Rotações Registradas")
+
+if st.checkbox("🔍 Mostrar histórico de rotações"):
+    vendedores_hist, tipos_hist = opcoes_filtro_historico()
+    col_h1, col_h2, col_h3, col_h4 = st.columns(4)
+    with col_h1:
+        filtro_vendedor = st.selectbox("Vendedor", [""] + vendedores_hist)
+    with col_h2:
+        filtro_conta = st.text_input("Conta_ID")
+    with col_h3:
+        filtro_periodo = st.date_input("Período", value=[])
+    with col_h4:
+        filtro_tipo = st.selectbox("Tipo de rotação", [""] + tipos_hist)
+    tamanho_pagina = st.select_slider("Linhas por página", options=[25, 50, 100, 250], value=50)
+
+    filtros_historico = (filtro_vendedor, filtro_conta.strip(), tuple(filtro_periodo), filtro_tipo, tamanho_pagina)
+    if st.session_state.get("historico_filtros") != filtros_historico:
+        # Filtro novo: volta para a primeira página
+        st.session_state["historico_filtros"] = filtros_historico
+        st.session_state["historico_cursores"] = [None]
+    cursores = st.session_state["historico_cursores"]
+
+    linhas_historico = consultar_historico(
+        vendedor=filtro_vendedor or None,
+        conta_id=int(filtro_conta) if filtro_conta.strip().isdigit() else None,
+        data_inicio=filtro_periodo[0] if len(filtro_periodo) > 0 else None,
+        data_fim=filtro_periodo[1] if len(filtro_periodo) > 1 else None,
+        tipo_rotacao=filtro_tipo or None,
+        apos=cursores[-1],
+        tamanho_pagina=tamanho_pagina + 1
+    )
+    tem_proxima = len(linhas_historico) > tamanho_pagina
+    linhas_historico = linhas_historico[:tamanho_pagina]
+    st.dataframe(pd.DataFrame(linhas_historico, columns=['id', 'nome_vendedor', 'conta_id', 'tipo_rotacao', 'data_rotacao']))
+
+    col_p1, col_p2, col_p3 = st.columns([1, 1, 6])
+    with col_p1:
+        if st.button("⬅️ Anterior", disabled=len(cursores) == 1):
+            cursores.pop()
+            st.rerun()
+    with col_p2:
+        if st.button("Próxima ➡️", disabled=not tem_proxima):
+            ultima = linhas_historico[-1]
+            cursores.append((ultima[4], ultima[0]))
+            st.rerun()
+    with col_p3:
+        st.caption(f"Página {len(cursores)}")
+
+if st.checkbox("🦆 Consultas analíticas (histórico + snapshots)"):
+    # Rodam no DuckDB sobre o SQLite e os Parquet; só o resultado chega ao pandas
+    nome_consulta = st.selectbox("Consulta", list(CONSULTAS), format_func=lambda n: CONSULTAS[n]['descricao'])
+    parametros_consulta = {}
+    colunas_consulta = st.columns(max(len(CONSULTAS[nome_consulta]['parametros']), 1))
+    for coluna, (parametro, _, padrao) in zip(colunas_consulta, CONSULTAS[nome_consulta]['parametros']):
+        with coluna:
+            if parametro in ('inicio', 'fim'):
+                parametros_consulta[parametro] = st.date_input(parametro.capitalize(), value=None)
+            elif isinstance(padrao, int):
+                parametros_consulta[parametro] = st.number_input(parametro.capitalize(), min_value=1, value=padrao)
+            else:
+                parametros_consulta[parametro] = st.text_input(parametro) or None
+    try:
+        st.dataframe(consultar(nome_consulta, **parametros_consulta), hide_index=True)
+    except ValueError as e:
+        st.info(str(e))
+
+if st.checkbox("🧾 Mostrar execuções de rotação (tempos e contagens por rodada)"):
+    execucoes_recentes = listar_execucoes()
+    st.dataframe(execucoes_recentes, hide_index=True)
+
+    # Desfazer uma rodada (grupo ou arquivo de referência errado): remove o lote do histórico
+    # e das contas rotacionadas numa única transação
+    reversiveis = execucoes_recentes[
+        (execucoes_recentes['status'] == 'concluida') & execucoes_recentes['revertida_em'].isna()
+    ].set_index('id')
+    lote_reverter = st.selectbox(
+        "Desfazer rodada", [""] + reversiveis.index.tolist(),
+        format_func=lambda i: "" if not i else
+        f"{reversiveis.at[i, 'inicio'][:16]} · {reversiveis.at[i, 'grupo']} · {reversiveis.at[i, 'colocadas']} contas"
+    )
+    confirmar_reversao = st.checkbox("Confirmo que quero desfazer a rodada selecionada")
+    if st.button("↩️ Desfazer rodada", disabled=not (lote_reverter and confirmar_reversao)):
+        try:
+            contas_restauradas = reverter_execucao(lote_reverter)
+        except ValueError as e:
+            st.error(str(e))
+        else:
+            st.success(f"Rodada desfeita: {len(contas_restauradas)} contas voltaram à situação anterior.")
+            st.dataframe(contas_restauradas, hide_index=True)
 
 
 # Gerar downloads fora do if
 def gerar_excel_download(df):
-    from io import BytesIO
     output = BytesIO()
     with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
         df.to_excel(writer, index=False, sheet_name='Planilha1')
     return output.getvalue()
 
-if "contas_rotacionadas" in st.session_state:
+if resultado_rotacao:
+    # Os xlsx são gerados uma vez por rodada no servidor e servidos do disco a todas as sessões
     st.markdown('#### 3-Faça o Download das contas rotacionadas e armazene no servidor')
     st.markdown('👇 Clique no botão abaixo para fazer o download do historico de rotação.')
-    st.download_button(
-        "📥 Baixar contas rotacionadas",
-        data=gerar_excel_download(st.session_state["contas_rotacionadas"]),
-        file_name=f"historico_{datetime.now().strftime('%Y-%m-%d')}.xlsx"
-    )
-
-if "contas_sobras" in st.session_state:
-    st.download_button(
-        "📥 Baixar contas sem rotação",
-        data=gerar_excel_download(st.session_state["contas_sobras"]),
-        file_name="contas_sobras.xlsx"
-    )
+    with open(arquivo_excel(resultado_rotacao, 'rotacionadas'), 'rb') as arquivo:
+        st.download_button(
+            "📥 Baixar contas rotacionadas",
+            data=arquivo,
+            file_name=f"historico_{resumo_resultado(resultado_rotacao).get('data_rotacao', datetime.now().strftime('%Y-%m-%d'))}.xlsx"
+        )
+    with open(arquivo_excel(resultado_rotacao, 'sobras'), 'rb') as arquivo:
+        st.download_button(
+            "📥 Baixar contas sem rotação",
+            data=arquivo,
+            file_name="contas_sobras.xlsx"
+        )
+    if st.button("🗂️ Preparar histórico completo de contas rotacionadas"):
+        st.download_button(
+            "📥 Baixar histórico completo",
+            data=gerar_excel_download(exportar_contas_rotacionadas()),
+            file_name="historico_rotacoes_completo.xlsx"
+        )
 
 
 else:
@@ -574,143 +510,120 @@ else:
     
 st.markdown("---")
 
+# ---------- PAINEL DE ROTAÇÕES ----------
+@st.cache_data(show_spinner=False)
+def figuras_painel(versao):
+    # versao muda a cada atualização dos agregados; enquanto isso as figuras vêm do cache
+    return renderizar_figuras(carregar_agregados())
+
+st.subheader("📈 Painel de Rotações")
+if st.checkbox("Mostrar painel"):
+    atualizar_agregados_rotacao()
+    figuras = figuras_painel(versao_agregados())
+    if not figuras:
+        st.info("Ainda não há rotações registradas para o painel.")
+    col_g1, col_g2 = st.columns(2)
+    for i, nome_figura in enumerate(['rotacoes', 'sobras', 'conversao', 'faturamento']):
+        if nome_figura in figuras:
+            with (col_g1 if i % 2 == 0 else col_g2):
+                st.image(figuras[nome_figura])
+
+st.markdown("---")
+
+# ---------- SNAPSHOTS MENSAIS ----------
+st.subheader("🗃️ Comparar snapshots")
+snapshots_disponiveis = listar_snapshots()
+if st.checkbox("Mostrar comparação entre snapshots"):
+    if len(snapshots_disponiveis) < 2:
+        st.info("São necessários pelo menos dois snapshots salvos para comparar.")
+    else:
+        rotulos_snapshots = snapshots_disponiveis.apply(descrever_snapshot, axis=1).tolist()
+        col_d1, col_d2 = st.columns(2)
+        with col_d1:
+            snapshot_antigo = st.selectbox("Antes", range(len(rotulos_snapshots)), index=1,
+                                           format_func=rotulos_snapshots.__getitem__)
+        with col_d2:
+            snapshot_novo = st.selectbox("Depois", range(len(rotulos_snapshots)), index=0,
+                                         format_func=rotulos_snapshots.__getitem__)
+        diferencas = comparar_snapshots(
+            snapshots_disponiveis.at[snapshot_antigo, 'caminho'],
+            snapshots_disponiveis.at[snapshot_novo, 'caminho']
+        )
+        resumo_diferencas, trocas_por_vendedor = resumir_diferencas(diferencas)
+        col_r1, col_r2 = st.columns(2)
+        with col_r1:
+            st.dataframe(resumo_diferencas)
+        with col_r2:
+            st.dataframe(trocas_por_vendedor)
+        st.dataframe(diferencas)
+
+st.markdown("---")
+
 st.subheader("📊 Gerar Relatórios por Vendedor")
 
+# A base anterior pode ser a extração de hoje ou um snapshot salvo, para reproduzir meses passados
+extracoes_salvas = snapshots_disponiveis[snapshots_disponiveis['tipo'] == 'extracao'].reset_index(drop=True)
+base_anterior = st.selectbox(
+    "Comparar com",
+    [None] + list(range(len(extracoes_salvas))),
+    format_func=lambda i: "Extração atual do SQL Server" if i is None else descrever_snapshot(extracoes_salvas.loc[i])
+)
+
 st.markdown('👇 Clique no botão abaixo para fazer o download dos relatórios de rotação.')
 
-if st.button("📄 Gerar Relatório Completo e por Vendedor"):
+if st.button("📄 Gerar Relatório Completo e por Vendedor", disabled=tarefa_em_andamento(st.session_state.get("tarefa_relatorios"))):
+
+    if df_filtrado is None:
+        # Modo em lotes: só as colunas dos relatórios e os vendedores cadastrados saem das partes
+        df_filtrado = carregar_partes(partes_extracao, COLUNAS_BASE_RELATORIO,
+                                      vendedores_ativos_helder + vendedores_ativos_karen)
 
     # Define df_atual com base na existência de rotação
-    if "contas_rotacionadas" in st.session_state:
-        df_atual = st.session_state["contas_rotacionadas"].copy()
+    if st.session_state.get("resultado_rotacao"):
+        df_atual = carregar_resultado(st.session_state["resultado_rotacao"], 'rotacionadas')
         st.success("✅ Usando contas rotacionadas para o relatório.")
     else:
-        df_atual = df_filtrado.copy()
+        df_atual = df_filtrado
         st.warning("⚠️ Nenhuma rotação foi realizada. Usando base atual para gerar relatório.")
 
-    def gerar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, pasta_destino='Relatorio_Rotação'):
-        os.makedirs(pasta_destino, exist_ok=True)
-
-        data_rotacao = pd.to_datetime(data_rotacao).normalize()
-        data_limite = pd.to_datetime(data_limite).normalize()
-
-        for df in [df_atual, df_anterior]:
-            df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
-            df['Data_Ultima_Venda_Grupo_CNPJ'] = pd.to_datetime(df['Data_Ultima_Venda_Grupo_CNPJ'], errors='coerce')
-
-        vendedores = df_atual['Nome_Vendedor'].dropna().unique()
-        arquivos_por_vendedor = {}
-
-        writer = pd.ExcelWriter(f'{pasta_destino}/relatorio_mensal_completo.xlsx', engine='xlsxwriter')
-
-        for vendedor in vendedores:
-            atual_vend = df_atual[df_atual['Nome_Vendedor'] == vendedor].copy()
-            anterior_vend = df_anterior[df_anterior['Nome_Vendedor'] == vendedor].copy()
-
-            def montar_bloco(df, status):
-                bloco = df[[
-                    'Nome_Vendedor',
-                    'Razao_Social_Pessoas',
-                    'Conta_ID',
-                    'Raiz_CNPJ',
-                    'Faturamento_6_Meses',
-                    'Total_Pedidos',
-                    'Data_Ultima_Venda_Grupo_CNPJ',
-                    'Data_Entrou_Carteira',
-                    'data_ultima_rotacao',
-                    'Total_Contatos_Rotacao',
-                    'Data_Ultimo_Contato',
-                    'Total_Followups_Rotacao',
-                    'Data_Ultimo_Followup',
-                    'Total_Orcamentos_Rotacao',
-                    'Data_Ultimo_Orcamento'
-                ]].copy()
-                bloco.insert(0, 'Status', status)
-                return bloco
-
-            usados = set()
-            blocos = []
-
-            ativas = anterior_vend[
-                (
-                    (anterior_vend['Faturamento_6_Meses'] > 0) |
-                    (anterior_vend['Data_Ultima_Venda_Grupo_CNPJ'] >= data_limite) |
-                    (anterior_vend['Grupo_Econômico_ID'].notnull())
-                ) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(ativas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(ativas, 'Ativa'))
-
-            seis_meses_atras = data_rotacao - pd.DateOffset(months=6)
-            recentes = anterior_vend[
-                (anterior_vend['Data_Entrou_Carteira'] >= seis_meses_atras) &
-                (anterior_vend['Data_Entrou_Carteira'] != data_rotacao) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(recentes['Raiz_CNPJ'])
-            blocos.append(montar_bloco(recentes, 'Entraram Recentemente'))
-
-            novas = atual_vend[
-                (atual_vend['Data_Entrou_Carteira'] == data_rotacao) &
-                (~atual_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(novas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(novas, 'Novas Recebidas'))
-
-            cadastradas_recente = anterior_vend[
-                (anterior_vend['Data_Abertura_Conta'] >= seis_meses_atras) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            usados.update(cadastradas_recente['Raiz_CNPJ'])
-            blocos.append(montar_bloco(cadastradas_recente, 'Cadastrado Recentemente'))
-
-            # CNPJs que não estão mais com o vendedor atual
-            possiveis_retiradas = anterior_vend[
-                (~anterior_vend['Raiz_CNPJ'].isin(atual_vend['Raiz_CNPJ'])) &
-                (~anterior_vend['Raiz_CNPJ'].isin(usados))
-            ]
-            # Filtro extra: garantir que são contas sem faturamento e não migraram para outro vendedor
-            retiradas = possiveis_retiradas[possiveis_retiradas['Faturamento_6_Meses'] <= 0.01]
-            usados.update(retiradas['Raiz_CNPJ'])
-            blocos.append(montar_bloco(retiradas, 'Retiradas'))
-
-            df_relatorio = pd.concat(blocos, ignore_index=True)
-            df_relatorio = df_relatorio.drop_duplicates(subset='Raiz_CNPJ', keep='first')
-            df_relatorio = df_relatorio.sort_values(['Status', 'Razao_Social_Pessoas']).reset_index(drop=True)
-
-            if not df_relatorio.empty:
-                nome_arquivo_vendedor = f"{pasta_destino}/relatorio_{vendedor.replace(' ', '_')}_{data_rotacao.strftime('%Y-%m-%d')}.xlsx"
-                df_relatorio.to_excel(nome_arquivo_vendedor, index=False)
-                arquivos_por_vendedor[vendedor] = nome_arquivo_vendedor
-
-                aba = vendedor[:31]
-                df_relatorio.to_excel(writer, sheet_name=aba, index=False)
-
-        writer.close()
-        return arquivos_por_vendedor
-
-
-    arquivos_gerados = gerar_relatorios(
+    if base_anterior is None:
+        df_anterior = df_filtrado
+    else:
+        df_anterior = carregar_snapshot(
+            extracoes_salvas.at[base_anterior, 'caminho'],
+            filtros=[('Nome_Vendedor', 'in', vendedores_ativos_helder + vendedores_ativos_karen)]
+        )
+
+    # O ZIP anterior desta sessão não será mais baixado
+    tarefa_anterior = consultar_tarefa(st.session_state.get("tarefa_relatorios"))
+    if tarefa_anterior and tarefa_anterior['status'] == 'concluida':
+        descartar_pacote(tarefa_anterior['resultado'])
+
+    iniciar_tarefa(
+        "tarefa_relatorios", gerar_pacote_relatorios,
         df_atual=df_atual,
-        df_anterior=df_filtrado,
+        df_anterior=df_anterior,
         data_limite=data_limite,
-        data_rotacao=pd.Timestamp.today().normalize(),
-        pasta_destino='Relatorio_Rotação'
+        data_rotacao=datas['data_rotacao'],
+        pasta_destino='Relatorio_Rotação',
+        motor=motor,
+        descricao="Relatórios"
     )
 
-    st.success("✅ Relatórios gerados com sucesso!")
-
-    zip_file_path = os.path.join(tempfile.gettempdir(), "relatorios_rotacao.zip")
-    with zipfile.ZipFile(zip_file_path, 'w') as zipf:
-        zipf.write('Relatorio_Rotação/relatorio_mensal_completo.xlsx', 'relatorio_mensal_completo.xlsx')
-        for vendedor, arquivo in arquivos_gerados.items():
-            zipf.write(arquivo, arquivo.split('/')[-1])
-
-    with open(zip_file_path, 'rb') as f:
-        st.download_button(
-            label="📥 Baixar Todos os Relatórios",
-            data=f,
-            file_name="relatorios_rotacao.zip",
-            mime="application/zip"
-        )
\ No newline at end of file
+if "tarefa_relatorios" in st.session_state:
+    acompanhar_tarefa("tarefa_relatorios")
+    tarefa = consultar_tarefa(st.session_state["tarefa_relatorios"])
+    if tarefa and tarefa['status'] == 'concluida':
+        st.success("✅ Relatórios gerados com sucesso!")
+
+        if os.path.exists(tarefa['resultado']):
+            # O pacote fica no disco; só o download_button lê o arquivo para servi-lo
+            with open(tarefa['resultado'], 'rb') as f:
+                st.download_button(
+                    label="📥 Baixar Todos os Relatórios",
+                    data=f,
+                    file_name="relatorios_rotacao.zip",
+                    mime="application/zip"
+                )
+    elif tarefa and tarefa['status'] == 'erro':
+        st.error(f"Erro ao gerar relatórios: {tarefa['erro']}")
\ No newline at end of file
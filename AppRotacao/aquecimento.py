@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import traceback
+
+import pandas as pd
+
+from banco_local import registrar_medicao_inicializacao, carregar_medicoes_inicializacao
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+
+# O módulo fica em sys.modules entre os reruns: o aquecimento roda uma vez por processo
+_tempos = {}
+_lock = threading.Lock()
+_thread = None
+
+
+# ---------- MEDIÇÕES ----------
+def registrar_etapa(etapa, segundos, uma_vez=False):
+    with _lock:
+        if uma_vez and etapa in _tempos:
+            return
+        _tempos[etapa] = segundos
+    registrar_medicao_inicializacao(etapa, segundos)
+
+
+def _cronometrar(etapa, funcao):
+    inicio = time.perf_counter()
+    resultado = funcao()
+    registrar_etapa(etapa, time.perf_counter() - inicio)
+    return resultado
+
+
+def tempos_inicializacao(limite=30):
+    medicoes = carregar_medicoes_inicializacao(limite)
+    return pd.DataFrame(medicoes, columns=['momento', 'processo', 'etapa', 'segundos']).round({'segundos': 2})
+
+
+# ---------- AQUECIMENTO ----------
+def aquecer(credenciais):
+    from banco_local import inicializar_banco, carregar_vendedores
+    from extracao import carregar_extracao
+
+    inicio = time.perf_counter()
+    _cronometrar('banco_local', lambda: (inicializar_banco(), carregar_vendedores()))
+    _cronometrar('extracao_sql', lambda: carregar_extracao(credenciais))
+    registrar_etapa('aquecimento_total', time.perf_counter() - inicio)
+
+
+def _aquecer_em_segundo_plano(credenciais):
+    try:
+        aquecer(credenciais)
+    except Exception:
+        # Falhar aqui só significa que o primeiro usuário espera a extração como antes
+        traceback.print_exc()
+
+
+def iniciar_aquecimento(credenciais):
+    # Chamado a cada rerun, mas só a primeira chamada do processo dispara a thread
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+        _thread = threading.Thread(target=_aquecer_em_segundo_plano, args=(credenciais,),
+                                   name='aquecimento', daemon=True)
+        _thread.start()
+
+
+# ---------- PRÉ-AQUECIMENTO FORA DO STREAMLIT ----------
+def _credenciais_do_ambiente():
+    from extracao import CHAVES_CREDENCIAIS
+
+    if all(chave in os.environ for chave in CHAVES_CREDENCIAIS):
+        return {chave: os.environ[chave] for chave in CHAVES_CREDENCIAIS}
+    import tomllib
+
+    for pasta in (os.getcwd(), PASTA_APP):
+        caminho = os.path.join(pasta, '.streamlit', 'secrets.toml')
+        if os.path.exists(caminho):
+            with open(caminho, 'rb') as f:
+                segredos = tomllib.load(f)
+            return {chave: segredos[chave] for chave in CHAVES_CREDENCIAIS}
+    raise RuntimeError("Credenciais do SQL Server não encontradas (variáveis de ambiente ou .streamlit/secrets.toml).")
+
+
+if __name__ == '__main__':
+    # Uso no entrypoint do servidor, antes ou junto do `streamlit run`:
+    #   python aquecimento.py && streamlit run app_teste.py
+    # Preenche o cache compartilhado em disco; as réplicas já sobem com a extração pronta.
+    aquecer(_credenciais_do_ambiente())
+    for etapa, segundos in _tempos.items():
+        print(f"{etapa}: {segundos:.2f}s")
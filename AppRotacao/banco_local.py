@@ -0,0 +1,765 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+# Um único banco local para vendedores, histórico, agregados e contas rotacionadas.
+# O caminho não depende mais do diretório de onde o Streamlit foi iniciado.
+CAMINHO_BANCO = os.environ.get('ROTACAO_BANCO_LOCAL', os.path.join(PASTA_APP, 'historico_rotacao.db'))
+TIMEOUT_BANCO = 30  # segundos esperando o lock de escrita do SQLite
+DURACAO_LEASE = 15 * 60  # segundos; uma rodada travada libera o grupo sozinha depois disso
+
+TIPOS_VENDEDOR = ('Distribuição', 'Corporativo')
+
+
+class RotacaoEmAndamento(RuntimeError):
+    pass
+
+
+# ---------- CONEXÃO (uma por thread) ----------
+_conexoes = threading.local()
+_lock_escrita = threading.RLock()
+
+
+def _abrir_conexao():
+    # Autocommit: as transações são abertas explicitamente com BEGIN IMMEDIATE
+    conn = sqlite3.connect(CAMINHO_BANCO, timeout=TIMEOUT_BANCO, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute(f'PRAGMA busy_timeout={TIMEOUT_BANCO * 1000}')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+@contextmanager
+def conexao():
+    # Cada thread (sessão do Streamlit) tem a sua conexão: leituras não esperam umas pelas outras
+    # e, no WAL, leem o último commit mesmo durante a escrita de outra thread.
+    # A conexão é fechada quando a thread termina e o threading.local é liberado.
+    conn = getattr(_conexoes, 'conn', None)
+    if conn is None:
+        conn = _conexoes.conn = _abrir_conexao()
+    yield conn
+
+
+@contextmanager
+def transacao():
+    # O lock só serializa as escritas do processo, em vez de cada uma ficar no busy_timeout do SQLite
+    with _lock_escrita, conexao() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+
+@contextmanager
+def _na_transacao(conn=None):
+    # Grava na transação de quem chamou (várias gravações que precisam ir juntas) ou abre uma própria
+    if conn is not None:
+        yield conn
+    else:
+        with transacao() as conn:
+            yield conn
+
+
+def inicializar_banco():
+    # Cria tabelas e migra dados: escreve, então também passa pelo lock de escrita
+    with _lock_escrita, conexao() as conn:
+        conn.executescript('''
+        CREATE TABLE IF NOT EXISTS vendedores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL UNIQUE,
+            tipo TEXT NOT NULL CHECK(tipo IN ('Distribuição', 'Corporativo'))
+        );
+        CREATE TABLE IF NOT EXISTS historico_rotacao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome_vendedor TEXT,
+            conta_id INTEGER,
+            tipo_rotacao TEXT,
+            data_rotacao TEXT
+        );
+        DROP INDEX IF EXISTS idx_historico_conta;
+        CREATE INDEX IF NOT EXISTS idx_historico_conta_data ON historico_rotacao (conta_id, data_rotacao, id);
+        CREATE INDEX IF NOT EXISTS idx_historico_data ON historico_rotacao (data_rotacao, id);
+        CREATE INDEX IF NOT EXISTS idx_historico_vendedor ON historico_rotacao (nome_vendedor, data_rotacao, id);
+        CREATE INDEX IF NOT EXISTS idx_historico_tipo ON historico_rotacao (tipo_rotacao, data_rotacao, id);
+        CREATE TABLE IF NOT EXISTS contas_rotacionadas (
+            raiz_cnpj TEXT NOT NULL,
+            data_entrou_carteira TEXT NOT NULL,
+            conta_id INTEGER,
+            nome_vendedor TEXT,
+            dados TEXT NOT NULL,
+            PRIMARY KEY (raiz_cnpj, data_entrou_carteira)
+        );
+        CREATE TABLE IF NOT EXISTS rotacao_lease (
+            recurso TEXT PRIMARY KEY,
+            dono TEXT NOT NULL,
+            expira_em REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS agregados_estado (
+            chave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS agg_rotacoes_mes (
+            mes TEXT NOT NULL,
+            nome_vendedor TEXT NOT NULL,
+            rotacoes INTEGER NOT NULL,
+            PRIMARY KEY (mes, nome_vendedor)
+        );
+        CREATE TABLE IF NOT EXISTS agg_sobras_mes (
+            mes TEXT NOT NULL,
+            grupo TEXT NOT NULL,
+            rodadas INTEGER NOT NULL,
+            candidatas INTEGER NOT NULL,
+            colocadas INTEGER NOT NULL,
+            PRIMARY KEY (mes, grupo)
+        );
+        CREATE TABLE IF NOT EXISTS agg_conversao_mes (
+            mes_rotacao TEXT NOT NULL,
+            nome_vendedor TEXT NOT NULL,
+            contas INTEGER NOT NULL,
+            com_contato INTEGER NOT NULL,
+            com_orcamento INTEGER NOT NULL,
+            com_venda INTEGER NOT NULL,
+            faturamento REAL NOT NULL,
+            data_extracao TEXT NOT NULL,
+            PRIMARY KEY (mes_rotacao, nome_vendedor)
+        );
+        CREATE TABLE IF NOT EXISTS medicoes_inicializacao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            momento TEXT NOT NULL,
+            processo INTEGER NOT NULL,
+            etapa TEXT NOT NULL,
+            segundos REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS execucoes_rotacao (
+            id TEXT PRIMARY KEY,
+            grupo TEXT NOT NULL,
+            inicio TEXT NOT NULL,
+            fim TEXT NOT NULL,
+            status TEXT NOT NULL,
+            segundos REAL NOT NULL,
+            candidatas INTEGER NOT NULL,
+            colocadas INTEGER NOT NULL,
+            sobras INTEGER NOT NULL,
+            revertida_em TEXT,
+            dados TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_execucoes_inicio ON execucoes_rotacao (inicio);
+        CREATE TABLE IF NOT EXISTS historico_revertido (
+            id INTEGER PRIMARY KEY,
+            nome_vendedor TEXT,
+            conta_id INTEGER,
+            tipo_rotacao TEXT,
+            data_rotacao TEXT,
+            lote_id TEXT NOT NULL,
+            revertido_em TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS contas_rotacionadas_substituidas (
+            lote_id TEXT NOT NULL,
+            raiz_cnpj TEXT NOT NULL,
+            data_entrou_carteira TEXT NOT NULL,
+            conta_id INTEGER,
+            nome_vendedor TEXT,
+            dados TEXT NOT NULL,
+            lote_anterior TEXT,
+            PRIMARY KEY (lote_id, raiz_cnpj, data_entrou_carteira)
+        );
+        CREATE TABLE IF NOT EXISTS vendedores_historico (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS exclusoes_conta (
+            conta_id INTEGER NOT NULL,
+            vendedor_id INTEGER NOT NULL,
+            PRIMARY KEY (conta_id, vendedor_id)
+        ) WITHOUT ROWID;
+        ''')
+        _adicionar_lotes(conn)
+        _converter_contas_binarias(conn)
+        _importar_arquivos_antigos(conn)
+
+
+def _adicionar_lotes(conn):
+    # Bancos criados antes do lote_id ganham a coluna (nula nas linhas antigas, que não são revertidas)
+    for tabela in ('historico_rotacao', 'contas_rotacionadas', 'execucoes_rotacao'):
+        colunas = {linha[1] for linha in conn.execute(f'PRAGMA table_info({tabela})')}
+        if tabela == 'execucoes_rotacao':
+            if 'revertida_em' not in colunas:
+                conn.execute('ALTER TABLE execucoes_rotacao ADD COLUMN revertida_em TEXT')
+        elif 'lote_id' not in colunas:
+            conn.execute(f'ALTER TABLE {tabela} ADD COLUMN lote_id TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_historico_lote ON historico_rotacao (lote_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_contas_rotacionadas_lote ON contas_rotacionadas (lote_id)')
+
+
+def _converter_contas_binarias(conn):
+    # Rotações antigas gravaram o numpy.int64 como BLOB de 8 bytes; converte uma vez para INTEGER
+    # para que filtros e joins por conta_id usem o índice.
+    linhas = conn.execute(
+        "SELECT id, conta_id FROM historico_rotacao WHERE typeof(conta_id) = 'blob'"
+    ).fetchall()
+    if not linhas:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    conn.executemany(
+        'UPDATE historico_rotacao SET conta_id = ? WHERE id = ?',
+        [(int.from_bytes(conta_id, byteorder='little'), id_linha) for id_linha, conta_id in linhas]
+    )
+    conn.execute('COMMIT')
+
+
+def _arquivo_antigo(nome):
+    for pasta in (os.getcwd(), PASTA_APP):
+        caminho = os.path.join(pasta, nome)
+        if os.path.exists(caminho):
+            return caminho
+    return None
+
+
+def _importar_arquivos_antigos(conn):
+    # Migração única de vendedores.db e historico_rotacoes_completo.xlsx para o banco consolidado
+    if _ler_estado(conn, 'arquivos_antigos_importados'):
+        return
+    caminho_vendedores = _arquivo_antigo('vendedores.db')
+    caminho_excel = _arquivo_antigo('historico_rotacoes_completo.xlsx')
+
+    vendedores = []
+    if caminho_vendedores and os.path.abspath(caminho_vendedores) != os.path.abspath(CAMINHO_BANCO):
+        antigo = sqlite3.connect(caminho_vendedores)
+        try:
+            vendedores = antigo.execute('SELECT nome, tipo FROM vendedores').fetchall()
+        except sqlite3.OperationalError:
+            vendedores = []
+        antigo.close()
+    contas = pd.read_excel(caminho_excel) if caminho_excel else None
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.executemany('INSERT OR IGNORE INTO vendedores (nome, tipo) VALUES (?, ?)', vendedores)
+        if contas is not None and not contas.empty:
+            _inserir_contas_rotacionadas(conn, contas)
+        _gravar_estado(conn, 'arquivos_antigos_importados', 1)
+        _incrementar_estado(conn, 'vendedores_versao')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+# ---------- ESTADO (contadores e marcas) ----------
+def _ler_estado(conn, chave):
+    linha = conn.execute('SELECT valor FROM agregados_estado WHERE chave = ?', (chave,)).fetchone()
+    return linha[0] if linha else 0
+
+
+def _gravar_estado(conn, chave, valor):
+    conn.execute('INSERT OR REPLACE INTO agregados_estado (chave, valor) VALUES (?, ?)', (chave, valor))
+
+
+def _incrementar_estado(conn, chave):
+    conn.execute('''
+        INSERT INTO agregados_estado (chave, valor) VALUES (?, 1)
+        ON CONFLICT (chave) DO UPDATE SET valor = valor + 1
+    ''', (chave,))
+
+
+# ---------- VENDEDORES ----------
+_cache_vendedores = {'versao': None, 'df': None}
+
+
+def carregar_vendedores():
+    # Cache no processo; a versão é incrementada a cada cadastro/remoção (inclusive por outro processo)
+    with conexao() as conn:
+        versao = _ler_estado(conn, 'vendedores_versao')
+        if _cache_vendedores['versao'] != versao:
+            # Versão e dados trocados juntos: outras threads leem o cache sem lock
+            _cache_vendedores.update(
+                df=pd.read_sql('SELECT nome, tipo FROM vendedores ORDER BY id', conn), versao=versao
+            )
+        return _cache_vendedores['df']
+
+
+def vendedores_por_tipo():
+    df = carregar_vendedores()
+    return {tipo: df.loc[df['tipo'] == tipo, 'nome'].tolist() for tipo in TIPOS_VENDEDOR}
+
+
+def cadastrar_vendedor(nome, tipo):
+    with transacao() as conn:
+        conn.execute('INSERT INTO vendedores (nome, tipo) VALUES (?, ?)', (nome, tipo))
+        _incrementar_estado(conn, 'vendedores_versao')
+
+
+def remover_vendedor(nome):
+    with transacao() as conn:
+        conn.execute('DELETE FROM vendedores WHERE nome = ?', (nome,))
+        _incrementar_estado(conn, 'vendedores_versao')
+
+
+# ---------- HISTÓRICO ----------
+def versao_historico():
+    # Maior id gravado; serve de "versão" para a detecção otimista de conflitos
+    with conexao() as conn:
+        return conn.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0]
+
+
+def carregar_rotacoes(versao=None):
+    # Uma linha por (conta, vendedor, data); as datas de entrada saem daqui por as-of join
+    with conexao() as conn:
+        rotacoes = pd.read_sql_query('''
+            SELECT DISTINCT conta_id, nome_vendedor, data_rotacao
+            FROM historico_rotacao
+            WHERE id <= ? AND conta_id IS NOT NULL AND data_rotacao IS NOT NULL
+        ''', conn, params=(versao if versao is not None else versao_historico(),))
+    rotacoes['conta_id'] = rotacoes['conta_id'].astype('int64')
+    rotacoes['data_rotacao'] = pd.to_datetime(rotacoes['data_rotacao'], errors='coerce').astype('datetime64[ns]')
+    return rotacoes
+
+
+# ---------- LEASE POR RODADA ----------
+def _tentar_lease(recurso, dono, duracao):
+    agora = time.time()
+    with transacao() as conn:
+        atual = conn.execute(
+            'SELECT dono, expira_em FROM rotacao_lease WHERE recurso = ?', (recurso,)
+        ).fetchone()
+        if atual and atual[1] > agora and atual[0] != dono:
+            return False
+        conn.execute(
+            'INSERT OR REPLACE INTO rotacao_lease (recurso, dono, expira_em) VALUES (?, ?, ?)',
+            (recurso, dono, agora + duracao)
+        )
+        return True
+
+
+@contextmanager
+def lease(recurso, duracao=DURACAO_LEASE, espera=0):
+    # Só uma rodada por recurso (ex.: grupo de vendedores); recursos diferentes rodam em paralelo
+    dono = uuid.uuid4().hex
+    limite = time.time() + espera
+    while not _tentar_lease(recurso, dono, duracao):
+        if time.time() >= limite:
+            raise RotacaoEmAndamento(f"Já existe uma rotação em andamento para '{recurso}'. Tente novamente em instantes.")
+        time.sleep(0.2)
+    try:
+        yield dono
+    finally:
+        with conexao() as conn:
+            conn.execute('DELETE FROM rotacao_lease WHERE recurso = ? AND dono = ?', (recurso, dono))
+
+
+# ---------- GRAVAÇÃO TRANSACIONAL ----------
+def registrar_rotacoes(linhas, versao_lida=None, lote_id=None, conn=None):
+    # linhas: [(nome_vendedor, conta_id, tipo_rotacao, data_rotacao)]
+    # Contas que receberam rotação depois de versao_lida (outra sessão) não são gravadas
+    # e voltam como conflito; o restante entra numa única transação, marcado com o lote_id
+    # da rodada para que ela possa ser revertida (reverter_lote).
+    with _na_transacao(conn) as conn:
+        conflitos = set()
+        if versao_lida is not None and linhas:
+            conn.execute('CREATE TEMP TABLE IF NOT EXISTS contas_rodada (conta_id INTEGER PRIMARY KEY)')
+            conn.execute('DELETE FROM contas_rodada')
+            conn.executemany('INSERT OR IGNORE INTO contas_rodada (conta_id) VALUES (?)',
+                             [(linha[1],) for linha in linhas])
+            conflitos = {
+                row[0] for row in conn.execute('''
+                    SELECT DISTINCT h.conta_id
+                    FROM historico_rotacao h
+                    JOIN contas_rodada c ON c.conta_id = h.conta_id
+                    WHERE h.id > ?
+                ''', (versao_lida,))
+            }
+        conn.executemany('''
+            INSERT INTO historico_rotacao (nome_vendedor, conta_id, tipo_rotacao, data_rotacao, lote_id)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [tuple(linha) + (lote_id,) for linha in linhas if linha[1] not in conflitos])
+    return conflitos
+
+
+# ---------- CONTAS ROTACIONADAS (antigo historico_rotacoes_completo.xlsx) ----------
+def _inserir_contas_rotacionadas(conn, df, lote_id=None):
+    # Mesma regra do Excel: uma linha por (Raiz_CNPJ, Data_Entrou_Carteira), a mais recente vence
+    datas = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce').dt.strftime('%Y-%m-%d').fillna('')
+    dados = df.to_json(orient='records', lines=True, date_format='iso', force_ascii=False).splitlines()
+    linhas = [
+        (str(cnpj).strip().zfill(14), data, int(conta_id) if pd.notna(conta_id) else None, vendedor, linha, lote_id)
+        for cnpj, data, conta_id, vendedor, linha in zip(
+            df['Raiz_CNPJ'], datas, df['Conta_ID'], df['Nome_Vendedor'], dados
+        )
+    ]
+    if lote_id is not None:
+        # Guarda as linhas que este lote vai substituir, para a reversão devolvê-las
+        conn.executemany('''
+            INSERT OR IGNORE INTO contas_rotacionadas_substituidas
+                (lote_id, raiz_cnpj, data_entrou_carteira, conta_id, nome_vendedor, dados, lote_anterior)
+            SELECT ?, raiz_cnpj, data_entrou_carteira, conta_id, nome_vendedor, dados, lote_id
+            FROM contas_rotacionadas
+            WHERE raiz_cnpj = ? AND data_entrou_carteira = ?
+        ''', [(lote_id, linha[0], linha[1]) for linha in linhas])
+    conn.executemany('''
+        INSERT OR REPLACE INTO contas_rotacionadas (raiz_cnpj, data_entrou_carteira, conta_id, nome_vendedor, dados, lote_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', linhas)
+
+
+def registrar_contas_rotacionadas(df, lote_id=None, conn=None):
+    with _na_transacao(conn) as conn:
+        _inserir_contas_rotacionadas(conn, df, lote_id)
+
+
+def exportar_contas_rotacionadas():
+    with conexao() as conn:
+        dados = [linha[0] for linha in conn.execute(
+            'SELECT dados FROM contas_rotacionadas ORDER BY data_entrou_carteira, raiz_cnpj'
+        )]
+    if not dados:
+        return pd.DataFrame()
+    df = pd.read_json(StringIO('\n'.join(dados)), lines=True, dtype={'Raiz_CNPJ': str}, convert_dates=False)
+    for coluna in df.columns:
+        if coluna.lower().startswith('data_'):
+            df[coluna] = pd.to_datetime(df[coluna], errors='coerce')
+    return df
+
+
+# ---------- REVERSÃO DE LOTE ----------
+def reverter_lote(lote_id):
+    # Desfaz uma rodada numa única transação. Tudo sai pelo índice de lote_id e, para as contas
+    # afetadas, pelo índice (conta_id, data_rotacao): o histórico inteiro nunca é varrido.
+    momento = time.strftime('%Y-%m-%d %H:%M:%S')
+    with transacao() as conn:
+        linhas = conn.execute('''
+            SELECT id, nome_vendedor, conta_id, data_rotacao
+            FROM historico_rotacao
+            WHERE lote_id = ?
+        ''', (lote_id,)).fetchall()
+        if not linhas:
+            raise ValueError(f"Lote '{lote_id}' não encontrado no histórico (ou já revertido).")
+
+        # Painel: tira do agregado mensal só as linhas que ele já tinha somado
+        marca = _ler_estado(conn, 'rotacoes_ultimo_id')
+        conn.executemany('''
+            UPDATE agg_rotacoes_mes SET rotacoes = rotacoes - 1
+            WHERE mes = substr(?, 1, 7) AND nome_vendedor = ?
+        ''', [(data, vendedor) for id_linha, vendedor, _, data in linhas
+              if id_linha <= marca and vendedor is not None and data is not None])
+        conn.execute('DELETE FROM agg_rotacoes_mes WHERE rotacoes <= 0')
+        execucao = conn.execute(
+            'SELECT inicio, grupo, candidatas, colocadas FROM execucoes_rotacao WHERE id = ?', (lote_id,)
+        ).fetchone()
+        if execucao:
+            conn.execute('''
+                UPDATE agg_sobras_mes
+                SET rodadas = rodadas - 1, candidatas = candidatas - ?, colocadas = colocadas - ?
+                WHERE mes = substr(?, 1, 7) AND grupo = ?
+            ''', (execucao[2], execucao[3], execucao[0], execucao[1]))
+            conn.execute('DELETE FROM agg_sobras_mes WHERE rodadas <= 0')
+            conn.execute('UPDATE execucoes_rotacao SET revertida_em = ? WHERE id = ?', (momento, lote_id))
+
+        # Exclusões: o par (conta, vendedor) só sai se nenhuma outra rotação da conta foi para ele
+        marca_exclusoes = _ler_estado(conn, 'exclusoes_ultimo_id')
+        conn.executemany('''
+            DELETE FROM exclusoes_conta
+            WHERE conta_id = ?
+              AND vendedor_id = (SELECT id FROM vendedores_historico WHERE nome = ?)
+              AND NOT EXISTS (
+                  SELECT 1 FROM historico_rotacao h
+                  WHERE h.conta_id = ? AND h.nome_vendedor = ? AND h.lote_id IS NOT ?
+              )
+        ''', sorted({(conta_id, vendedor, conta_id, vendedor, lote_id) for id_linha, vendedor, conta_id, _ in linhas
+                     if id_linha <= marca_exclusoes and vendedor is not None and conta_id is not None}))
+        _incrementar_estado(conn, 'exclusoes_versao')
+
+        # Histórico: as linhas do lote vão para historico_revertido (auditoria) e saem da tabela
+        conn.execute('''
+            INSERT INTO historico_revertido (id, nome_vendedor, conta_id, tipo_rotacao, data_rotacao, lote_id, revertido_em)
+            SELECT id, nome_vendedor, conta_id, tipo_rotacao, data_rotacao, lote_id, ?
+            FROM historico_rotacao
+            WHERE lote_id = ?
+        ''', (momento, lote_id))
+        conn.execute('DELETE FROM historico_rotacao WHERE lote_id = ?', (lote_id,))
+
+        # Contas rotacionadas: remove as do lote e devolve as que ele tinha substituído,
+        # a não ser que um lote posterior já tenha gravado outra linha na mesma chave
+        conn.execute('DELETE FROM contas_rotacionadas WHERE lote_id = ?', (lote_id,))
+        conn.execute('''
+            INSERT OR IGNORE INTO contas_rotacionadas (raiz_cnpj, data_entrou_carteira, conta_id, nome_vendedor, dados, lote_id)
+            SELECT raiz_cnpj, data_entrou_carteira, conta_id, nome_vendedor, dados, lote_anterior
+            FROM contas_rotacionadas_substituidas
+            WHERE lote_id = ?
+        ''', (lote_id,))
+        conn.execute('DELETE FROM contas_rotacionadas_substituidas WHERE lote_id = ?', (lote_id,))
+
+        # Situação restaurada de cada conta: o vendedor e a data da rotação mais recente que sobrou
+        contas = sorted({conta_id for _, _, conta_id, _ in linhas if conta_id is not None})
+        restauradas = []
+        for conta_id in contas:
+            anterior = conn.execute('''
+                SELECT nome_vendedor, data_rotacao
+                FROM historico_rotacao
+                WHERE conta_id = ?
+                ORDER BY data_rotacao DESC, id DESC
+                LIMIT 1
+            ''', (conta_id,)).fetchone()
+            restauradas.append((conta_id,) + (anterior or (None, None)))
+
+        _incrementar_estado(conn, 'reversoes')
+        _incrementar_estado(conn, 'versao')
+
+    revertidas = pd.DataFrame(
+        [(conta_id, vendedor) for _, vendedor, conta_id, _ in linhas],
+        columns=['conta_id', 'vendedor_revertido']
+    )
+    restauradas = pd.DataFrame(restauradas, columns=['conta_id', 'vendedor_anterior', 'data_ultima_rotacao'])
+    return revertidas.merge(restauradas, on='conta_id', how='left')
+
+
+def reversoes_historico():
+    # Muda a cada reversão; junto com versao_historico identifica o estado do histórico
+    with conexao() as conn:
+        return _ler_estado(conn, 'reversoes')
+
+
+# ---------- CONSULTA PAGINADA DO HISTÓRICO ----------
+def consultar_historico(vendedor=None, conta_id=None, data_inicio=None, data_fim=None,
+                        tipo_rotacao=None, apos=None, tamanho_pagina=50):
+    # Paginação por chave (keyset): ordena por (data_rotacao, id) decrescente e "apos" é a
+    # chave da última linha da página anterior, então cada página lê só tamanho_pagina linhas.
+    condicoes = []
+    parametros = []
+    if vendedor:
+        condicoes.append('nome_vendedor = ?')
+        parametros.append(vendedor)
+    if conta_id is not None:
+        condicoes.append('conta_id = ?')
+        parametros.append(int(conta_id))
+    if tipo_rotacao:
+        condicoes.append('tipo_rotacao = ?')
+        parametros.append(tipo_rotacao)
+    if data_inicio is not None:
+        condicoes.append('data_rotacao >= ?')
+        parametros.append(str(data_inicio)[:10])
+    if data_fim is not None:
+        condicoes.append('data_rotacao <= ?')
+        parametros.append(str(data_fim)[:10])
+    if apos is not None:
+        condicoes.append('(data_rotacao < ? OR (data_rotacao = ? AND id < ?))')
+        parametros.extend([apos[0], apos[0], apos[1]])
+
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ''
+    with conexao() as conn:
+        return conn.execute(f'''
+            SELECT id, nome_vendedor, conta_id, tipo_rotacao, data_rotacao
+            FROM historico_rotacao
+            {where}
+            ORDER BY data_rotacao DESC, id DESC
+            LIMIT ?
+        ''', parametros + [tamanho_pagina]).fetchall()
+
+
+def opcoes_filtro_historico():
+    # Valores distintos lidos direto dos índices de vendedor e tipo
+    with conexao() as conn:
+        vendedores = [r[0] for r in conn.execute(
+            'SELECT DISTINCT nome_vendedor FROM historico_rotacao WHERE nome_vendedor IS NOT NULL ORDER BY nome_vendedor')]
+        tipos = [r[0] for r in conn.execute(
+            'SELECT DISTINCT tipo_rotacao FROM historico_rotacao WHERE tipo_rotacao IS NOT NULL ORDER BY tipo_rotacao')]
+    return vendedores, tipos
+
+
+# ---------- EXCLUSÕES (todo vendedor que já recebeu a conta) ----------
+_cache_exclusoes = {'versao': None, 'exclusoes': None}
+
+
+def atualizar_exclusoes():
+    # Incremental como os agregados: só as linhas do histórico acima da última marca. Os vendedores
+    # viram códigos inteiros estáveis (vendedores_historico) e cada par aparece uma vez.
+    with transacao() as conn:
+        marca = _ler_estado(conn, 'exclusoes_ultimo_id')
+        ultimo_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0]
+        if ultimo_id > marca:
+            conn.execute('''
+                INSERT OR IGNORE INTO vendedores_historico (nome)
+                SELECT DISTINCT nome_vendedor
+                FROM historico_rotacao
+                WHERE id > ? AND id <= ? AND nome_vendedor IS NOT NULL
+            ''', (marca, ultimo_id))
+            conn.execute('''
+                INSERT OR IGNORE INTO exclusoes_conta (conta_id, vendedor_id)
+                SELECT DISTINCT h.conta_id, v.id
+                FROM historico_rotacao h
+                JOIN vendedores_historico v ON v.nome = h.nome_vendedor
+                WHERE h.id > ? AND h.id <= ? AND h.conta_id IS NOT NULL
+            ''', (marca, ultimo_id))
+            _gravar_estado(conn, 'exclusoes_ultimo_id', ultimo_id)
+            _incrementar_estado(conn, 'exclusoes_versao')
+
+
+def _exclusoes_em_cache(conn):
+    # Matriz esparsa conta x vendedor em formato CSR: para a i-ésima conta de 'contas' (ordenadas),
+    # os códigos em vendedores[inicio[i]:inicio[i + 1]], com o nome de cada código em 'nomes'.
+    # Soma a tabela às linhas do histórico acima da marca que ainda não entraram nela (vendedor novo
+    # ganha um código só na memória). Cache no processo pela versão das exclusões e pelo último id
+    # do histórico, que mudam a cada atualização, rotação ou reversão (inclusive de outro processo).
+    marca = _ler_estado(conn, 'exclusoes_ultimo_id')
+    versao = (
+        _ler_estado(conn, 'exclusoes_versao'),
+        conn.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0],
+    )
+    if _cache_exclusoes['versao'] != versao:
+        nomes = dict(conn.execute('SELECT id, nome FROM vendedores_historico').fetchall())
+        pares = conn.execute('SELECT conta_id, vendedor_id FROM exclusoes_conta').fetchall()
+        if versao[1] > marca:
+            codigo_do_nome = {nome: codigo for codigo, nome in nomes.items()}
+            for conta_id, nome in conn.execute('''
+                SELECT DISTINCT conta_id, nome_vendedor
+                FROM historico_rotacao
+                WHERE id > ? AND conta_id IS NOT NULL AND nome_vendedor IS NOT NULL
+            ''', (marca,)):
+                if nome not in codigo_do_nome:
+                    codigo_do_nome[nome] = max(nomes, default=0) + 1
+                    nomes[codigo_do_nome[nome]] = nome
+                pares.append((conta_id, codigo_do_nome[nome]))
+        pares = np.array(pares, dtype=np.int64).reshape(-1, 2)
+        pares = pares[np.lexsort((pares[:, 1], pares[:, 0]))]  # ordena por conta, vendedor
+        pares = pares[np.append(True, (pares[1:] != pares[:-1]).any(axis=1))] if len(pares) else pares
+        contas, inicio = np.unique(pares[:, 0], return_index=True)
+        codigos = np.full(max(nomes, default=0) + 1, None, dtype=object)
+        codigos[list(nomes)] = list(nomes.values())
+        _cache_exclusoes.update(exclusoes={
+            'contas': contas,
+            'inicio': np.append(inicio, len(pares)),
+            'vendedores': pares[:, 1],
+            'nomes': codigos,
+        }, versao=versao)
+    return _cache_exclusoes['exclusoes']
+
+
+def carregar_exclusoes():
+    # Para as rodadas: atualiza a tabela persistida antes de montar a matriz
+    atualizar_exclusoes()
+    with conexao() as conn:
+        return _exclusoes_em_cache(conn)
+
+
+def ler_exclusoes():
+    # Só leitura (simulação, dry-run): não abre transação de escrita nem grava a tabela
+    with conexao() as conn:
+        return _exclusoes_em_cache(conn)
+
+
+# ---------- AGREGADOS DO PAINEL ----------
+def atualizar_agregados_rotacao(conn=None):
+    # Incremental: soma só as linhas do histórico com id acima da última marca processada.
+    # Sem linha nova (o caso comum ao abrir o painel; a rodada já atualiza na própria transação)
+    # fica só na leitura, sem disputar o lock de escrita com rotações e reversões.
+    if conn is None:
+        with conexao() as leitura:
+            marca = _ler_estado(leitura, 'rotacoes_ultimo_id')
+            if leitura.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0] <= marca:
+                return
+    with _na_transacao(conn) as conn:
+        marca = _ler_estado(conn, 'rotacoes_ultimo_id')
+        ultimo_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM historico_rotacao').fetchone()[0]
+        if ultimo_id > marca:
+            conn.execute('''
+                INSERT INTO agg_rotacoes_mes (mes, nome_vendedor, rotacoes)
+                SELECT substr(data_rotacao, 1, 7), nome_vendedor, COUNT(*)
+                FROM historico_rotacao
+                WHERE id > ? AND id <= ? AND nome_vendedor IS NOT NULL AND data_rotacao IS NOT NULL
+                GROUP BY substr(data_rotacao, 1, 7), nome_vendedor
+                ON CONFLICT (mes, nome_vendedor) DO UPDATE SET rotacoes = rotacoes + excluded.rotacoes
+            ''', (marca, ultimo_id))
+            _gravar_estado(conn, 'rotacoes_ultimo_id', ultimo_id)
+            _incrementar_estado(conn, 'versao')
+
+
+def registrar_resultado_rodada(mes, grupo, candidatas, colocadas, conn=None):
+    with _na_transacao(conn) as conn:
+        conn.execute('''
+            INSERT INTO agg_sobras_mes (mes, grupo, rodadas, candidatas, colocadas)
+            VALUES (?, ?, 1, ?, ?)
+            ON CONFLICT (mes, grupo) DO UPDATE SET
+                rodadas = rodadas + 1,
+                candidatas = candidatas + excluded.candidatas,
+                colocadas = colocadas + excluded.colocadas
+        ''', (mes, grupo, int(candidatas), int(colocadas)))
+        _incrementar_estado(conn, 'versao')
+
+
+def registrar_conversao(linhas, data_extracao):
+    # linhas: [(mes_rotacao, nome_vendedor, contas, com_contato, com_orcamento, com_venda, faturamento)]
+    # Retrato da extração mais recente; substitui o anterior por completo.
+    with transacao() as conn:
+        conn.execute('DELETE FROM agg_conversao_mes')
+        conn.executemany('''
+            INSERT INTO agg_conversao_mes
+                (mes_rotacao, nome_vendedor, contas, com_contato, com_orcamento, com_venda, faturamento, data_extracao)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [tuple(linha) + (data_extracao,) for linha in linhas])
+        _incrementar_estado(conn, 'versao')
+
+
+def versao_agregados():
+    with conexao() as conn:
+        return _ler_estado(conn, 'versao')
+
+
+def carregar_agregados():
+    with conexao() as conn:
+        return {
+            'rotacoes': pd.read_sql_query('SELECT * FROM agg_rotacoes_mes ORDER BY mes', conn),
+            'sobras': pd.read_sql_query('SELECT * FROM agg_sobras_mes ORDER BY mes', conn),
+            'conversao': pd.read_sql_query('SELECT * FROM agg_conversao_mes ORDER BY mes_rotacao', conn),
+        }
+
+
+# ---------- MEDIÇÕES DE INICIALIZAÇÃO ----------
+def registrar_medicao_inicializacao(etapa, segundos):
+    with transacao() as conn:
+        conn.execute(
+            'INSERT INTO medicoes_inicializacao (momento, processo, etapa, segundos) VALUES (?, ?, ?, ?)',
+            (time.strftime('%Y-%m-%d %H:%M:%S'), os.getpid(), etapa, float(segundos))
+        )
+
+
+def carregar_medicoes_inicializacao(limite=30):
+    with conexao() as conn:
+        return conn.execute('''
+            SELECT momento, processo, etapa, segundos
+            FROM medicoes_inicializacao
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (limite,)).fetchall()
+
+
+# ---------- EXECUÇÕES DE ROTAÇÃO ----------
+def registrar_execucao(execucao, dados):
+    # dados: o registro completo em JSON (etapas, carga por vendedor...); as colunas servem às consultas
+    with transacao() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO execucoes_rotacao
+                (id, grupo, inicio, fim, status, segundos, candidatas, colocadas, sobras, dados)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (execucao['id'], execucao['grupo'], execucao['inicio'], execucao['fim'], execucao['status'],
+              float(execucao['segundos']), int(execucao['candidatas']), int(execucao['colocadas']),
+              int(execucao['sobras']), dados))
+
+
+def carregar_execucoes(limite=None):
+    with conexao() as conn:
+        return pd.read_sql_query(f'''
+            SELECT id, grupo, inicio, fim, status, segundos, candidatas, colocadas, sobras, revertida_em, dados
+            FROM execucoes_rotacao
+            ORDER BY inicio DESC
+            {'LIMIT ?' if limite else ''}
+        ''', conn, params=(limite,) if limite else None)
@@ -0,0 +1,108 @@
+import argparse
+import os
+import time
+import pandas as pd
+
+from banco_local import inicializar_banco, versao_historico, carregar_rotacoes
+from pipeline import MOTORES, datas_da_rodada, preparar_referencia, processar_extracao
+from relatorios import _converter_datas, relatorios_por_vendedor
+from snapshots import listar_snapshots, carregar_snapshot
+
+# Compara os motores lado a lado numa extração salva (snapshot 'extracao' ou outro Parquet):
+#   python benchmark_motores.py --repetir 20 --rodadas 3
+#   POLARS_MAX_THREADS=4 python benchmark_motores.py --referencia referencia.xlsx
+# Mede o processamento da extração e a montagem dos relatórios (sem gravar os xlsx) e confere
+# que os dois motores devolvem exatamente o mesmo resultado.
+
+
+def carregar_base(caminho, repetir):
+    if caminho is None:
+        extracoes = listar_snapshots('extracao')
+        if extracoes.empty:
+            raise SystemExit("Nenhum snapshot de extração salvo; informe --extracao.")
+        caminho = extracoes.at[0, 'caminho']
+    df = carregar_snapshot(caminho)
+    if repetir > 1:
+        # Cópias com Raiz_CNPJ e Conta_ID novos, para a base crescer sem virar duplicata
+        deslocamento = int(pd.to_numeric(df['Conta_ID'], errors='coerce').max()) + 1
+        copias = []
+        for n in range(repetir):
+            copia = df.copy()
+            copia['Raiz_CNPJ'] = [f'{n:03d}{raiz[3:]}' if n else raiz
+                                  for raiz in df['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14)]
+            copia['Conta_ID'] = pd.to_numeric(df['Conta_ID'], errors='coerce') + n * deslocamento
+            copias.append(copia)
+        df = pd.concat(copias, ignore_index=True)
+    return caminho, df
+
+
+def cronometrar(funcao, rodadas):
+    tempos = []
+    for _ in range(rodadas):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos), resultado
+
+
+def conferir(resultados):
+    # Mesmas linhas, colunas e tipos em todos os motores
+    base_pandas, relatorios_pandas = resultados['pandas']
+    for motor, (base, relatorios) in resultados.items():
+        pd.testing.assert_frame_equal(base['df'], base_pandas['df'])
+        for grupo, contas in base_pandas['contas_por_grupo'].items():
+            pd.testing.assert_frame_equal(base['contas_por_grupo'][grupo], contas)
+        assert base['carga_atual'] == base_pandas['carga_atual'], motor
+        assert relatorios.keys() == relatorios_pandas.keys(), motor
+        for vendedor, relatorio in relatorios_pandas.items():
+            pd.testing.assert_frame_equal(relatorios[vendedor], relatorio)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark dos motores de processamento (pandas x polars).")
+    parser.add_argument('--extracao', help="Parquet da extração (padrão: o snapshot de extração mais recente)")
+    parser.add_argument('--referencia', help="Planilha de referência (.xlsx); sem ela, nenhuma conta é transferida")
+    parser.add_argument('--repetir', type=int, default=1, help="Multiplica a base para testar volumes maiores")
+    parser.add_argument('--rodadas', type=int, default=3, help="Repetições por motor; vale o menor tempo")
+    parser.add_argument('--motores', nargs='+', default=list(MOTORES), choices=MOTORES)
+    parser.add_argument('--data-base', help="Data-base da rodada (AAAA-MM-DD); padrão: hoje ou ROTACAO_DATA_BASE")
+    argumentos = parser.parse_args()
+
+    inicializar_banco()
+    caminho, df = carregar_base(argumentos.extracao, argumentos.repetir)
+    if argumentos.referencia:
+        referencia = preparar_referencia(pd.read_excel(argumentos.referencia))
+    else:
+        referencia = preparar_referencia(pd.DataFrame(columns=['Raiz_CNPJ', 'Nome_Vendedor']))
+    rotacoes = carregar_rotacoes(versao_historico())
+    datas = datas_da_rodada(argumentos.data_base)
+    data_referencia, data_limite, data_rotacao = datas['data_referencia'], datas['data_limite'], datas['data_rotacao']
+    vendedores_ativos = list(df['Nome_Vendedor'].dropna().unique())
+
+    print(f"Base: {caminho} ({len(df)} linhas, {len(rotacoes)} rotações no histórico, "
+          f"{os.cpu_count()} núcleos, POLARS_MAX_THREADS={os.environ.get('POLARS_MAX_THREADS', '-')})")
+    resultados = {}
+    linhas = []
+    for motor in argumentos.motores:
+        segundos_base, base = cronometrar(lambda: processar_extracao(
+            df, referencia, rotacoes, vendedores_ativos, data_referencia, data_limite, motor=motor
+        ), argumentos.rodadas)
+        df_filtrado = _converter_datas(base['df_filtrado'])
+        vendedores = df_filtrado['Nome_Vendedor'].dropna().unique()
+        segundos_relatorios, relatorios = cronometrar(lambda: {
+            vendedor: relatorio for vendedor, relatorio in relatorios_por_vendedor(
+                df_filtrado, df_filtrado, vendedores, data_limite, data_rotacao, motor
+            ) if relatorio is not None and not relatorio.empty
+        }, argumentos.rodadas)
+        resultados[motor] = (base, relatorios)
+        linhas.append((motor, segundos_base, segundos_relatorios))
+
+    if 'pandas' in resultados:
+        conferir(resultados)
+        print("Resultados iguais nos motores comparados.")
+    tempo_pandas = {motor: b + r for motor, b, r in linhas}.get('pandas')
+    print(f"{'motor':<8} {'extração (s)':>13} {'relatórios (s)':>15} {'total (s)':>10} {'x pandas':>9}")
+    for motor, segundos_base, segundos_relatorios in linhas:
+        total = segundos_base + segundos_relatorios
+        ganho = f"{tempo_pandas / total:.2f}" if tempo_pandas else '-'
+        print(f"{motor:<8} {segundos_base:>13.3f} {segundos_relatorios:>15.3f} {total:>10.3f} {ganho:>9}")
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from snapshots import preparar_para_arrow
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+# Cache em disco compartilhado por todas as réplicas do Streamlit no mesmo host. Cada entrada é um
+# arquivo Arrow IPC sem compressão, aberto por memory map: as páginas ficam no cache do sistema
+# operacional e são lidas sem cópia por qualquer processo.
+PASTA_CACHE = os.environ.get('ROTACAO_CACHE', os.path.join(PASTA_APP, 'cache_compartilhado'))
+IDADE_MAXIMA_CACHE = int(os.environ.get('ROTACAO_CACHE_IDADE_MAXIMA', 24 * 60 * 60))  # segundos
+TAMANHO_MAXIMO_CACHE = int(os.environ.get('ROTACAO_CACHE_TAMANHO_MAXIMO', 2 * 1024 ** 3))  # bytes
+TRAVA_EXPIRADA = 15 * 60  # segundos; uma réplica que morreu segurando a trava não bloqueia as outras
+RENOVAR_TRAVA = 60  # segundos; quem segura a trava (ex.: extração longa) renova a data do arquivo
+
+ARQUIVO_MANIFESTO = 'manifesto.json'
+
+_tabelas_abertas = {}
+_lock_tabelas = threading.Lock()
+
+
+# ---------- TRAVA ENTRE PROCESSOS ----------
+@contextmanager
+def _trava(chave=None, espera=TRAVA_EXPIRADA):
+    # Arquivo criado com O_EXCL: funciona igual no Linux e no Windows, sem depender de fcntl.
+    # Sem chave é a trava do manifesto, segura só para publicar; com chave, a de quem está
+    # calculando aquela entrada, que não bloqueia as outras chaves nem os leitores.
+    caminho = os.path.join(PASTA_CACHE, '.trava' if chave is None else f'.trava-{chave}')
+    inicio = time.time()
+    while True:
+        try:
+            fd = os.open(caminho, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(caminho) > TRAVA_EXPIRADA:
+                    os.remove(caminho)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() - inicio > espera:
+                raise TimeoutError("Cache compartilhado travado por outro processo.")
+            time.sleep(0.2)
+    # Enquanto a trava estiver com este processo, a data do arquivo é renovada: só uma trava
+    # abandonada (processo morto) passa de TRAVA_EXPIRADA e é quebrada pelas outras réplicas
+    parar = threading.Event()
+
+    def renovar():
+        while not parar.wait(RENOVAR_TRAVA):
+            try:
+                os.utime(caminho)
+            except FileNotFoundError:
+                return
+
+    renovador = threading.Thread(target=renovar, name='renovar_trava_cache', daemon=True)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        renovador.start()
+        yield
+    finally:
+        parar.set()
+        if renovador.is_alive():
+            renovador.join()
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+
+
+# ---------- MANIFESTO ----------
+def _ler_manifesto():
+    try:
+        with open(os.path.join(PASTA_CACHE, ARQUIVO_MANIFESTO), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'versao': 0, 'entradas': {}}
+
+
+def _gravar_manifesto(manifesto):
+    # Só é chamado com a trava; a troca por os.replace é atômica para quem está lendo
+    manifesto['versao'] += 1
+    temporario = os.path.join(PASTA_CACHE, f'{ARQUIVO_MANIFESTO}.{uuid.uuid4().hex}.tmp')
+    with open(temporario, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=1)
+    os.replace(temporario, os.path.join(PASTA_CACHE, ARQUIVO_MANIFESTO))
+
+
+def _entrada_valida(entrada, ttl):
+    return (
+        entrada is not None
+        and time.time() - entrada['criado_em'] < ttl
+        and os.path.exists(os.path.join(PASTA_CACHE, entrada['arquivo']))
+    )
+
+
+def _despejar(manifesto, manter=None):
+    # Remove entradas velhas e, se ainda passar do tamanho máximo, as mais antigas primeiro.
+    # Quem já abriu o arquivo por memory map continua lendo normalmente no Linux; no Windows a
+    # remoção falha e o arquivo fica para a próxima limpeza.
+    agora = time.time()
+    entradas = manifesto['entradas']
+    ordenadas = sorted(entradas.items(), key=lambda item: item[1]['criado_em'])
+    total = sum(e['tamanho'] for _, e in ordenadas)
+    for chave, entrada in ordenadas:
+        if chave == manter:
+            continue
+        if agora - entrada['criado_em'] > IDADE_MAXIMA_CACHE or total > TAMANHO_MAXIMO_CACHE:
+            del entradas[chave]
+            total -= entrada['tamanho']
+    em_uso = {e['arquivo'] for e in entradas.values()}
+    for arquivo in os.listdir(PASTA_CACHE):
+        if arquivo.endswith('.arrow') and arquivo not in em_uso:
+            try:
+                os.remove(os.path.join(PASTA_CACHE, arquivo))
+            except OSError:
+                pass
+
+
+# ---------- LEITURA E GRAVAÇÃO ----------
+def _tipo_pandas(tipo):
+    # Textos continuam nos buffers Arrow do arquivo mapeado (pd.ArrowDtype, sem cópia); números e
+    # datas sem nulos já saem do to_pandas apontando para o mesmo buffer
+    import pandas as pd
+    import pyarrow as pa
+
+    if pa.types.is_string(tipo) or pa.types.is_large_string(tipo):
+        return pd.ArrowDtype(tipo)
+    return None
+
+
+def _abrir(entrada, colunas=None):
+    import pyarrow as pa
+
+    caminho = os.path.join(PASTA_CACHE, entrada['arquivo'])
+    with _lock_tabelas:
+        tabela = _tabelas_abertas.get(caminho)
+        if tabela is None:
+            tabela = pa.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+            # Mantém aberta só a versão mais recente de cada chave
+            for antigo in [c for c in _tabelas_abertas if c.startswith(caminho.rsplit('-v', 1)[0] + '-v')]:
+                del _tabelas_abertas[antigo]
+            _tabelas_abertas[caminho] = tabela
+    if colunas is not None:
+        # Cada etapa converte só as colunas que usa; o resto fica no arquivo
+        tabela = tabela.select([coluna for coluna in colunas if coluna in tabela.column_names])
+    return tabela.to_pandas(split_blocks=True, types_mapper=_tipo_pandas)
+
+
+def _publicar(chave, df):
+    # O arquivo é escrito fora da trava do manifesto; com ela, só o rename para a próxima versão
+    # e a troca do manifesto
+    import pyarrow as pa
+
+    temporario = os.path.join(PASTA_CACHE, f'{chave}.{uuid.uuid4().hex}.tmp')
+    tabela = pa.Table.from_pandas(preparar_para_arrow(df), preserve_index=False)
+    with pa.OSFile(temporario, 'wb') as destino, pa.ipc.new_file(destino, tabela.schema) as escritor:
+        escritor.write_table(tabela)
+    with _trava():
+        manifesto = _ler_manifesto()
+        entrada = manifesto['entradas'].get(chave)
+        versao = (entrada['versao'] + 1) if entrada else 1
+        arquivo = f'{chave}-v{versao}.arrow'
+        os.replace(temporario, os.path.join(PASTA_CACHE, arquivo))
+        manifesto['entradas'][chave] = {
+            'arquivo': arquivo,
+            'versao': versao,
+            'criado_em': time.time(),
+            'tamanho': os.path.getsize(os.path.join(PASTA_CACHE, arquivo)),
+            'linhas': len(df),
+        }
+        _despejar(manifesto, manter=chave)
+        _gravar_manifesto(manifesto)
+    return manifesto['entradas'][chave]
+
+
+def obter(chave, ttl=IDADE_MAXIMA_CACHE, colunas=None):
+    # Só leitura, sem trava: None quando não há entrada válida
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+    entrada = _ler_manifesto()['entradas'].get(chave)
+    if _entrada_valida(entrada, ttl):
+        try:
+            return _abrir(entrada, colunas)
+        except FileNotFoundError:
+            pass  # despejado entre a leitura do manifesto e a abertura
+    return None
+
+
+def gravar(chave, df):
+    # Para quem calcula fora da trava (ex.: várias consultas em paralelo) e só grava no fim
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+    return _abrir(_publicar(chave, df))
+
+
+def obter_ou_calcular(chave, calcular, ttl=IDADE_MAXIMA_CACHE, colunas=None):
+    # Só uma réplica calcula cada chave (ex.: consulta o SQL Server); as outras esperam a trava
+    # dessa chave e leem o arquivo. Outras chaves e leitores não esperam o cálculo.
+    df = obter(chave, ttl, colunas)
+    if df is not None:
+        return df
+
+    with _trava(chave):
+        df = obter(chave, ttl, colunas)  # calculado por outra réplica enquanto esta esperava
+        if df is not None:
+            return df
+        return _abrir(_publicar(chave, calcular()), colunas)
+
+
+def invalidar(chave):
+    os.makedirs(PASTA_CACHE, exist_ok=True)
+    with _trava():
+        manifesto = _ler_manifesto()
+        if manifesto['entradas'].pop(chave, None) is not None:
+            _despejar(manifesto)
+            _gravar_manifesto(manifesto)
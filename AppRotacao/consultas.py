@@ -0,0 +1,259 @@
+import argparse
+import glob
+import os
+import threading
+
+import pandas as pd
+
+from banco_local import CAMINHO_BANCO, conexao
+from pipeline import MOTIVOS_ELEGIBILIDADE, REGRAS_EXCLUSAO
+from snapshots import PASTA_SNAPSHOTS
+
+# Camada analítica em DuckDB (em memória, embutido no processo): o histórico em SQLite fica
+# anexado como o schema "historico" e os snapshots Parquet viram as views "extracoes" e
+# "atribuicoes". As consultas rodam colunares dentro do DuckDB; só o resultado vira DataFrame.
+#   python consultas.py                                   # lista as consultas
+#   python consultas.py conversao_por_vendedor inicio=2025-01-01
+#   python consultas.py --sql "SELECT count(*) FROM historico.historico_rotacao"
+
+# Sem a extensão sqlite do DuckDB (servidor sem internet), estas tabelas são copiadas do SQLite
+# em lotes Arrow e recopiadas quando o arquivo do banco muda
+TABELAS_HISTORICO = ('historico_rotacao', 'historico_revertido', 'contas_rotacionadas', 'execucoes_rotacao')
+LINHAS_POR_LOTE_COPIA = 50000
+TIPOS_SQLITE = {'INTEGER': 'BIGINT', 'REAL': 'DOUBLE', 'TEXT': 'VARCHAR', 'BLOB': 'BLOB'}
+
+# Colunas das views quando ainda não há snapshot do tipo (as consultas continuam válidas, vazias)
+VISOES_SNAPSHOTS = {
+    'extracoes': ('extracao', {
+        'Raiz_CNPJ': 'VARCHAR', 'Conta_ID': 'BIGINT', 'Nome_Vendedor': 'VARCHAR',
+        'Faturamento_6_Meses': 'DOUBLE', 'Data_Ultima_Venda_Individual': 'TIMESTAMP',
+        'data_ultima_rotacao': 'TIMESTAMP', 'Data_Entrou_Carteira': 'TIMESTAMP', 'Elegibilidade': 'UTINYINT',
+    }),
+    'atribuicoes': ('atribuicao', {
+        'Raiz_CNPJ': 'VARCHAR', 'Conta_ID': 'BIGINT', 'Nome_Vendedor': 'VARCHAR',
+        'Data_Entrou_Carteira': 'TIMESTAMP',
+    }),
+}
+
+_lock = threading.Lock()
+_conexao = None
+_versao_copia = None
+
+
+# ---------- CONEXÃO ----------
+def _assinatura_banco():
+    # Muda a cada commit: no modo WAL a escrita vai para o -wal antes do checkpoint
+    return tuple(
+        os.stat(caminho).st_mtime_ns if os.path.exists(caminho) else None
+        for caminho in (CAMINHO_BANCO, CAMINHO_BANCO + '-wal')
+    )
+
+
+def _literal(texto):
+    return "'" + str(texto).replace("'", "''") + "'"
+
+
+def _copiar_historico(conn):
+    import pyarrow as pa
+
+    conn.execute('DROP SCHEMA IF EXISTS historico CASCADE')
+    conn.execute('CREATE SCHEMA historico')
+    with conexao() as sqlite:
+        for tabela in TABELAS_HISTORICO:
+            colunas = [(linha[1], TIPOS_SQLITE.get(str(linha[2]).upper(), 'VARCHAR'))
+                       for linha in sqlite.execute(f'PRAGMA table_info({tabela})')]
+            if not colunas:
+                continue
+            conn.execute(f'CREATE TABLE historico.{tabela} ('
+                         + ', '.join(f'"{nome}" {tipo}' for nome, tipo in colunas) + ')')
+            cursor = sqlite.execute(f'SELECT * FROM {tabela}')
+            while linhas := cursor.fetchmany(LINHAS_POR_LOTE_COPIA):
+                lote = pa.table({nome: list(valores) for (nome, _), valores in zip(colunas, zip(*linhas))})
+                conn.register('_lote_copia', lote)
+                conn.execute(f'INSERT INTO historico.{tabela} SELECT * FROM _lote_copia')
+                conn.unregister('_lote_copia')
+
+
+def _atualizar_visoes(conn):
+    # Refeitas a cada consulta: um snapshot novo já entra sem reiniciar o processo
+    for visao, (tipo, colunas) in VISOES_SNAPSHOTS.items():
+        padrao = os.path.join(PASTA_SNAPSHOTS, f'tipo={tipo}', 'mes=*', '*.parquet')
+        if glob.glob(padrao):
+            origem = (f'SELECT * FROM read_parquet({_literal(padrao)}, hive_partitioning = true, '
+                      f'union_by_name = true, filename = true)')
+        else:
+            origem = ('SELECT ' + ', '.join(f'NULL::{tipo_coluna} AS "{nome}"' for nome, tipo_coluna in colunas.items())
+                      + ", NULL::VARCHAR AS mes, NULL::VARCHAR AS filename WHERE false")
+        conn.execute(f'CREATE OR REPLACE VIEW {visao} AS {origem}')
+
+
+def conexao_analitica():
+    # Uma conexão DuckDB por processo; cada consulta usa um cursor próprio (seguro entre threads)
+    global _conexao, _versao_copia
+    import duckdb
+
+    with _lock:
+        if _conexao is None:
+            _conexao = duckdb.connect(':memory:')
+            try:
+                _conexao.execute('INSTALL sqlite')
+                _conexao.execute('LOAD sqlite')
+                _conexao.execute(f'ATTACH {_literal(CAMINHO_BANCO)} AS historico (TYPE sqlite, READ_ONLY)')
+            except duckdb.Error:
+                _versao_copia = False  # sem a extensão: cópia do SQLite
+        if _versao_copia is not None and _versao_copia != _assinatura_banco():
+            _versao_copia = _assinatura_banco()
+            _copiar_historico(_conexao)
+        _atualizar_visoes(_conexao)
+        return _conexao.cursor()
+
+
+# ---------- CONSULTAS ----------
+def _data(valor):
+    return pd.Timestamp(valor).date() if valor not in (None, '') else None
+
+
+def _raiz(valor):
+    return str(valor).strip().zfill(14)
+
+
+def _sql_motivos(coluna):
+    # Os bits de pipeline.MOTIVOS_ELEGIBILIDADE viram texto dentro do DuckDB
+    return "concat_ws('; ', " + ', '.join(
+        f'CASE WHEN {coluna} & {regra} <> 0 THEN {_literal(motivo)} END' for regra, motivo in MOTIVOS_ELEGIBILIDADE.items()
+    ) + ')'
+
+
+# parametros: (nome, conversão, padrão); datas vazias não limitam o período
+CONSULTAS = {
+    'rotacoes_da_conta': {
+        'descricao': "Todas as rotações de uma Raiz_CNPJ (pelas contas dela nos snapshots e nas contas rotacionadas)",
+        'parametros': [('raiz_cnpj', _raiz, None)],
+        'sql': '''
+            WITH contas AS (
+                SELECT DISTINCT conta_id FROM historico.contas_rotacionadas WHERE raiz_cnpj = $raiz_cnpj
+                UNION
+                SELECT DISTINCT CAST(Conta_ID AS BIGINT) FROM extracoes WHERE Raiz_CNPJ = $raiz_cnpj
+            )
+            SELECT h.data_rotacao, h.nome_vendedor, h.conta_id, h.tipo_rotacao, h.lote_id,
+                   count(*) OVER () AS total_rotacoes
+            FROM historico.historico_rotacao h
+            JOIN contas USING (conta_id)
+            ORDER BY h.data_rotacao, h.id
+        ''',
+    },
+    'elegibilidade_da_conta': {
+        'descricao': "Por que uma Raiz_CNPJ foi ou não candidata, em cada extração salva",
+        'parametros': [('raiz_cnpj', _raiz, None)],
+        'sql': f'''
+            SELECT mes, regexp_extract(filename, '[^/\\\\]+$') AS snapshot, Nome_Vendedor, Conta_ID, Elegibilidade,
+                   Elegibilidade & {REGRAS_EXCLUSAO} = 0 AS candidata,
+                   {_sql_motivos('Elegibilidade')} AS motivos
+            FROM extracoes
+            WHERE Raiz_CNPJ = $raiz_cnpj
+            ORDER BY filename DESC
+        ''',
+    },
+    'contas_mais_rotacionadas': {
+        'descricao': "Contas que mais trocaram de vendedor no período",
+        'parametros': [('inicio', _data, None), ('fim', _data, None), ('limite', int, 50)],
+        'sql': '''
+            SELECT conta_id, count(*) AS rotacoes, count(DISTINCT nome_vendedor) AS vendedores,
+                   min(data_rotacao) AS primeira, max(data_rotacao) AS ultima,
+                   arg_max(nome_vendedor, data_rotacao) AS vendedor_atual
+            FROM historico.historico_rotacao
+            WHERE ($inicio::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) >= $inicio::DATE)
+              AND ($fim::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) <= $fim::DATE)
+            GROUP BY conta_id
+            ORDER BY rotacoes DESC, ultima DESC
+            LIMIT $limite
+        ''',
+    },
+    'rotacoes_por_mes': {
+        'descricao': "Rotações recebidas por vendedor em cada mês",
+        'parametros': [('inicio', _data, None), ('fim', _data, None)],
+        'sql': '''
+            SELECT substr(data_rotacao, 1, 7) AS mes, nome_vendedor, count(*) AS rotacoes,
+                   count(DISTINCT conta_id) AS contas
+            FROM historico.historico_rotacao
+            WHERE nome_vendedor IS NOT NULL
+              AND ($inicio::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) >= $inicio::DATE)
+              AND ($fim::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) <= $fim::DATE)
+            GROUP BY ALL
+            ORDER BY mes, nome_vendedor
+        ''',
+    },
+    'conversao_por_vendedor': {
+        'descricao': "Contas recebidas no período que seguem com o vendedor e compraram depois da rotação "
+                     "(pela extração mais recente)",
+        'parametros': [('inicio', _data, None), ('fim', _data, None)],
+        'sql': '''
+            WITH ultima_extracao AS (
+                SELECT CAST(Conta_ID AS BIGINT) AS conta_id, Nome_Vendedor, Faturamento_6_Meses,
+                       CAST(Data_Ultima_Venda_Individual AS DATE) AS data_ultima_venda
+                FROM extracoes
+                WHERE filename = (SELECT max(filename) FROM extracoes)
+            ),
+            recebidas AS (
+                SELECT conta_id, nome_vendedor, max(TRY_CAST(data_rotacao AS DATE)) AS data_rotacao
+                FROM historico.historico_rotacao
+                WHERE nome_vendedor IS NOT NULL
+                  AND ($inicio::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) >= $inicio::DATE)
+                  AND ($fim::DATE IS NULL OR TRY_CAST(data_rotacao AS DATE) <= $fim::DATE)
+                GROUP BY ALL
+            )
+            SELECT r.nome_vendedor,
+                   count(*) AS contas_recebidas,
+                   count(*) FILTER (WHERE e.Nome_Vendedor = r.nome_vendedor) AS ainda_na_carteira,
+                   count(*) FILTER (WHERE e.Nome_Vendedor = r.nome_vendedor
+                                    AND e.data_ultima_venda >= r.data_rotacao) AS com_venda,
+                   coalesce(sum(e.Faturamento_6_Meses) FILTER (WHERE e.Nome_Vendedor = r.nome_vendedor
+                                    AND e.data_ultima_venda >= r.data_rotacao), 0) AS faturamento,
+                   round(com_venda / contas_recebidas, 4) AS taxa_conversao
+            FROM recebidas r
+            LEFT JOIN ultima_extracao e USING (conta_id)
+            GROUP BY r.nome_vendedor
+            ORDER BY taxa_conversao DESC, com_venda DESC
+        ''',
+    },
+}
+
+
+def consultar(nome, **parametros):
+    if nome not in CONSULTAS:
+        raise ValueError(f"Consulta desconhecida: {nome}")
+    consulta = CONSULTAS[nome]
+    valores = {}
+    for parametro, converter, padrao in consulta['parametros']:
+        valor = parametros.get(parametro, padrao)
+        if valor is None and padrao is None and converter is not _data:
+            raise ValueError(f"Parâmetro obrigatório: {parametro}")
+        valores[parametro] = converter(valor) if valor is not None else None
+    return executar_sql(consulta['sql'], valores)
+
+
+def executar_sql(sql, parametros=None):
+    # Parâmetros nomeados ($nome) vão separados do texto; nada é interpolado na consulta
+    return conexao_analitica().execute(sql, parametros or {}).df()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Consultas analíticas sobre o histórico e os snapshots.")
+    parser.add_argument('consulta', nargs='?', choices=sorted(CONSULTAS))
+    parser.add_argument('parametros', nargs='*', help="chave=valor (ex.: inicio=2025-01-01)")
+    parser.add_argument('--sql', help="Consulta livre (tabelas historico.*, views extracoes e atribuicoes)")
+    parser.add_argument('--csv', help="Grava o resultado neste arquivo em vez de imprimir")
+    argumentos = parser.parse_args()
+
+    if argumentos.sql:
+        resultado = executar_sql(argumentos.sql)
+    elif argumentos.consulta:
+        resultado = consultar(argumentos.consulta, **dict(p.split('=', 1) for p in argumentos.parametros))
+    else:
+        for nome, consulta in CONSULTAS.items():
+            print(f"{nome} ({', '.join(p for p, _, _ in consulta['parametros'])}): {consulta['descricao']}")
+        raise SystemExit
+    if argumentos.csv:
+        resultado.to_csv(argumentos.csv, index=False)
+    else:
+        print(resultado.to_string(index=False))
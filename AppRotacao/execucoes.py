@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+from banco_local import registrar_execucao, carregar_execucoes, reverter_lote
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+# Um registro por rodada: uma linha JSON em execucoes_rotacao.jsonl e uma linha na tabela do SQLite
+PASTA_REGISTROS = os.environ.get('ROTACAO_REGISTROS', os.path.join(PASTA_APP, 'registros'))
+ARQUIVO_EXECUCOES = os.path.join(PASTA_REGISTROS, 'execucoes_rotacao.jsonl')
+# Diretório do textfile collector do node_exporter (--collector.textfile.directory)
+PASTA_METRICAS = os.environ.get('ROTACAO_METRICAS', PASTA_REGISTROS)
+ARQUIVO_METRICAS = 'rotacao.prom'
+
+_lock = threading.Lock()
+
+
+# ---------- REGISTRO DA RODADA ----------
+def iniciar_execucao(grupo, **dados):
+    return {
+        'id': uuid.uuid4().hex,
+        'grupo': grupo,
+        'inicio': datetime.now().isoformat(timespec='milliseconds'),
+        'status': 'executando',
+        'candidatas': 0,
+        'colocadas': 0,
+        'sobras': 0,
+        'conflitos': 0,
+        'etapas': {},
+        **dados,
+        '_relogio': time.perf_counter(),
+    }
+
+
+@contextmanager
+def etapa(execucao, nome):
+    # Soma o tempo da etapa no registro; sem registro (ex.: simulação) não mede nada
+    if execucao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        execucao['etapas'][nome] = execucao['etapas'].get(nome, 0.0) + time.perf_counter() - inicio
+
+
+def finalizar_execucao(execucao, erro=None):
+    # Falhar ao registrar não desfaz nem interrompe a rotação, que já foi gravada
+    execucao['segundos'] = time.perf_counter() - execucao.pop('_relogio')
+    execucao['fim'] = datetime.now().isoformat(timespec='milliseconds')
+    execucao['status'] = 'erro' if erro is not None else 'concluida'
+    execucao['erro'] = str(erro) if erro is not None else None
+    try:
+        linha = json.dumps(execucao, ensure_ascii=False, default=str)
+        os.makedirs(PASTA_REGISTROS, exist_ok=True)
+        with _lock, open(ARQUIVO_EXECUCOES, 'a', encoding='utf-8') as f:
+            f.write(linha + '\n')
+        registrar_execucao(execucao, linha)
+        exportar_metricas()
+    except Exception:
+        traceback.print_exc()
+    return execucao
+
+
+def reverter_execucao(id_execucao):
+    # O id da execução é o lote_id gravado no histórico; devolve as contas com o vendedor restaurado
+    contas = reverter_lote(id_execucao)
+    try:
+        evento = {'id': id_execucao, 'status': 'revertida', 'revertida_em': datetime.now().isoformat(timespec='milliseconds'),
+                  'contas': len(contas)}
+        with _lock, open(ARQUIVO_EXECUCOES, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(evento, ensure_ascii=False) + '\n')
+        exportar_metricas()
+    except Exception:
+        traceback.print_exc()
+    return contas
+
+
+def listar_execucoes(limite=50):
+    execucoes = carregar_execucoes(limite)
+    return execucoes.drop(columns='dados')
+
+
+# ---------- MÉTRICAS (formato texto do Prometheus) ----------
+RESULTADOS = ('candidatas', 'colocadas', 'sobras', 'conflitos')
+
+
+def _rotulos(**rotulos):
+    def escapar(valor):
+        return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+    return '{' + ','.join(f'{chave}="{escapar(valor)}"' for chave, valor in rotulos.items()) + '}'
+
+
+def gerar_metricas():
+    # Refeito a partir da tabela a cada rodada, então os contadores somam as rodadas de todos os processos
+    execucoes = carregar_execucoes()  # mais recente primeiro
+    registros = [json.loads(dados) for dados in execucoes['dados']]
+    familias = {}
+
+    def adicionar(familia, tipo, ajuda, amostra, rotulos, valor):
+        familias.setdefault(familia, (tipo, ajuda, {}))[2][(amostra, _rotulos(**rotulos))] = valor
+
+    def somar(familia, tipo, ajuda, amostra, rotulos, valor):
+        amostras = familias.setdefault(familia, (tipo, ajuda, {}))[2]
+        chave = (amostra, _rotulos(**rotulos))
+        amostras[chave] = amostras.get(chave, 0) + valor
+
+    # Rodada não revertida vem do read_sql como NaN, não None
+    for registro, revertida_em in zip(registros, execucoes['revertida_em']):
+        grupo = registro['grupo']
+        somar('rotacao_execucoes_total', 'counter', 'Rodadas de rotação registradas.',
+              'rotacao_execucoes_total', {'grupo': grupo, 'status': registro['status']}, 1)
+        somar('rotacao_reversoes_total', 'counter', 'Rodadas desfeitas com reverter_lote.',
+              'rotacao_reversoes_total', {'grupo': grupo}, int(pd.notna(revertida_em)))
+        for resultado in RESULTADOS:
+            somar('rotacao_contas_total', 'counter', 'Contas por resultado, somadas em todas as rodadas.',
+                  'rotacao_contas_total', {'grupo': grupo, 'resultado': resultado}, int(registro.get(resultado, 0)))
+        for nome_etapa, segundos in registro['etapas'].items():
+            rotulos = {'grupo': grupo, 'etapa': nome_etapa}
+            somar('rotacao_etapa_segundos', 'summary', 'Tempo gasto em cada etapa da rotação.',
+                  'rotacao_etapa_segundos_sum', rotulos, segundos)
+            somar('rotacao_etapa_segundos', 'summary', 'Tempo gasto em cada etapa da rotação.',
+                  'rotacao_etapa_segundos_count', rotulos, 1)
+
+    # Última rodada de cada grupo
+    ultimas = {}
+    for registro in registros:
+        ultimas.setdefault(registro['grupo'], registro)
+    for grupo, registro in ultimas.items():
+        adicionar('rotacao_ultima_execucao_timestamp_seconds', 'gauge', 'Fim da última rodada do grupo.',
+                  'rotacao_ultima_execucao_timestamp_seconds', {'grupo': grupo},
+                  datetime.fromisoformat(registro['fim']).timestamp())
+        adicionar('rotacao_ultima_execucao_segundos', 'gauge', 'Duração da última rodada do grupo.',
+                  'rotacao_ultima_execucao_segundos', {'grupo': grupo}, registro['segundos'])
+        for nome_etapa, segundos in registro['etapas'].items():
+            adicionar('rotacao_ultima_etapa_segundos', 'gauge', 'Duração de cada etapa na última rodada do grupo.',
+                      'rotacao_ultima_etapa_segundos', {'grupo': grupo, 'etapa': nome_etapa}, segundos)
+        for resultado in RESULTADOS:
+            adicionar('rotacao_ultima_execucao_contas', 'gauge', 'Contas por resultado na última rodada do grupo.',
+                      'rotacao_ultima_execucao_contas', {'grupo': grupo, 'resultado': resultado},
+                      int(registro.get(resultado, 0)))
+        for vendedor, quantidade in registro.get('colocadas_por_vendedor', {}).items():
+            adicionar('rotacao_ultima_colocadas_vendedor', 'gauge', 'Contas recebidas por vendedor na última rodada.',
+                      'rotacao_ultima_colocadas_vendedor', {'grupo': grupo, 'vendedor': vendedor}, int(quantidade))
+        for vendedor, carga in registro.get('carga_por_vendedor', {}).items():
+            adicionar('rotacao_ultima_carga_vendedor', 'gauge', 'Carteira de cada vendedor após a última rodada.',
+                      'rotacao_ultima_carga_vendedor', {'grupo': grupo, 'vendedor': vendedor}, int(carga))
+
+    linhas = []
+    for familia, (tipo, ajuda, amostras) in familias.items():
+        linhas.append(f'# HELP {familia} {ajuda}')
+        linhas.append(f'# TYPE {familia} {tipo}')
+        linhas.extend(f'{amostra}{rotulos} {valor}' for (amostra, rotulos), valor in amostras.items())
+    return '\n'.join(linhas) + '\n'
+
+
+def exportar_metricas():
+    # O node_exporter pode ler o arquivo a qualquer momento: grava ao lado e renomeia
+    os.makedirs(PASTA_METRICAS, exist_ok=True)
+    caminho = os.path.join(PASTA_METRICAS, ARQUIVO_METRICAS)
+    temporario = f'{caminho}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(temporario, 'w', encoding='utf-8') as f:
+        f.write(gerar_metricas())
+    os.replace(temporario, caminho)
+    return caminho
+
+
+if __name__ == '__main__':
+    # Regrava o arquivo de métricas (ex.: por cron, depois de mudar ROTACAO_METRICAS)
+    print(exportar_metricas())
@@ -0,0 +1,335 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+
+CHAVES_CREDENCIAIS = ('DB_SERVER', 'DB_NAME', 'DB_USER', 'DB_PASSWORD')
+
+# Extração paralela: a base de contas e cada agregado em consultas separadas, ao mesmo tempo
+EXTRACAO_PARALELA_PADRAO = os.environ.get('ROTACAO_EXTRACAO_PARALELA', '0') == '1'
+CONEXOES_EXTRACAO = int(os.environ.get('ROTACAO_EXTRACAO_CONEXOES', 4))
+
+
+def _conectar(credenciais):
+    # pyodbc só é importado quando alguém realmente consulta o SQL Server
+    import pyodbc
+
+    connection_string = (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={credenciais['DB_SERVER']};DATABASE={credenciais['DB_NAME']};"
+        f"UID={credenciais['DB_USER']};PWD={credenciais['DB_PASSWORD']}"
+    )
+    return pyodbc.connect(connection_string)
+
+
+# ---------- EXTRAÇÃO PRINCIPAL ----------
+# Agregados da extração: (nome, SQL, chave do agregado, coluna da base de contas em que ele se liga).
+# Na consulta única cada um é uma CTE; na extração paralela, uma consulta própria.
+AGREGADOS_EXTRACAO = [
+    ('Faturamento', """    SELECT pessoa_id, SUM(valor_total) AS valor_total
+    FROM dbo.rel_faturamento
+    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
+    GROUP BY pessoa_id""", 'pessoa_id', 'pessoa_id'),
+    ('Followups', """    SELECT pessoa_id, COUNT(*) AS total_followups, MAX(data_cadastro) AS data_ultimo_followup
+    FROM dbo.pessoas_followup_anexos
+    GROUP BY pessoa_id""", 'pessoa_id', 'pessoa_id'),
+    ('Contatos', """    SELECT pessoa_id, COUNT(*) AS total_contatos, MAX(data_cadastro) AS data_ultimo_contato
+    FROM dbo.contatos
+    GROUP BY pessoa_id""", 'pessoa_id', 'pessoa_id'),
+    ('Oportunidades', """    SELECT
+        conta_id AS pessoa_id,
+        COUNT(*) AS total_oportunidades,
+        MAX(data_cadastro) AS data_ultima_oportunidade
+    FROM dbo.crm_oportunidades
+    GROUP BY conta_id""", 'pessoa_id', 'Conta_ID'),
+    ('UltimaVendaPorRaizCNPJ', """    SELECT LEFT(cpf_cnpj, 8) AS Raiz_CNPJ, MAX(data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ
+    FROM dbo.pessoas
+    WHERE data_ultima_venda IS NOT NULL
+    GROUP BY LEFT(cpf_cnpj, 8)""", 'Raiz_CNPJ', 'Raiz_CNPJ'),
+    ('Pedidos', """    SELECT
+        pessoa_id,
+        COUNT(*) AS total_pedidos
+    FROM dbo.rel_faturamento
+    WHERE data_emissao >= DATEADD(MONTH, -6, GETDATE())
+    GROUP BY pessoa_id""", 'pessoa_id', 'pessoa_id'),
+    ('Orcamentos', """    SELECT
+        pessoa_cliente_id,
+        COUNT(*) AS total_orcamentos,
+        MAX(data_emissao) AS data_ultimo_orcamento
+    FROM dbo.rel_crm_orcamentos
+    GROUP BY pessoa_cliente_id""", 'pessoa_cliente_id', 'pessoa_id'),
+    ('PedidosPorRevenda', """    SELECT
+        p.revenda_id AS pessoa_id,
+        COUNT(*) AS total_pedidos_revenda,
+        SUM(p.valor_total) AS valor_total_revenda,
+        MAX(p.data_faturamento) AS ultima_data_pedido_revenda
+    FROM dbo.rel_pedidos p
+    WHERE
+        p.revenda_id IS NOT NULL
+        AND p.data_faturamento >= DATEADD(MONTH, -6, GETDATE())
+    GROUP BY p.revenda_id""", 'pessoa_id', 'pessoa_id'),
+]
+
+CONSULTA_PRINCIPAL = """-- Query principal
+SELECT
+    a.id AS Conta_ID,
+    a.tipo_conta,
+    b.razao_social AS Razao_Social_Pessoas,
+    b.cpf_cnpj AS CNPJ,
+    LEFT(b.cpf_cnpj, 8) AS Raiz_CNPJ,
+    c.grupo_id AS Grupo_Econômico_ID,
+    c.grupo_nome AS Grupo_Econômico_Nome,
+    v.razao_social AS Nome_Vendedor,
+    b.data_ultima_venda AS Data_Ultima_Venda_Individual,
+
+    -- Soma do faturamento direto + indireto (como revenda)
+    COALESCE(f.valor_total, 0) + COALESCE(pr.valor_total_revenda, 0) AS Faturamento_6_Meses,
+
+    a.data_cadastro AS Data_Abertura_Conta,
+    COALESCE(p.total_pedidos, 0) + COALESCE(pr.total_pedidos_revenda, 0) AS Total_Pedidos,
+    COALESCE(g.Data_Ultima_Venda_Grupo_CNPJ, b.data_ultima_venda) AS Data_Ultima_Venda_Grupo_CNPJ,
+    COALESCE(fu.total_followups, 0) AS Total_Followups,
+    fu.data_ultimo_followup AS Data_Ultimo_Followup,
+    COALESCE(ct.total_contatos, 0) AS Total_Contatos,
+    ct.data_ultimo_contato AS Data_Ultimo_Contato,
+    COALESCE(o.total_oportunidades, 0) AS Total_Oportunidades,
+    o.data_ultima_oportunidade AS Data_Ultima_Oportunidade,
+    a.classificacao_id AS Classificacao_Conta,
+    b.classificacao_id AS Classificacao_Pessoa,
+    a.porte_id AS Porte_Empresa,
+
+    -- Orçamentos
+    (
+        SELECT COUNT(*)
+        FROM dbo.rel_crm_orcamentos d
+        WHERE d.pessoa_cliente_id = b.id
+    ) AS Total_Orcamentos,
+
+    (
+        SELECT MAX(data_emissao)
+        FROM dbo.rel_crm_orcamentos d
+        WHERE d.pessoa_cliente_id = b.id
+    ) AS Data_Ultimo_Orcamento
+
+FROM
+    grupofort.dbo.crm_contas a
+    INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
+    INNER JOIN dbo.rel_pessoas c ON b.id = c.id
+    INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
+    LEFT JOIN Faturamento f ON a.cliente_id = f.pessoa_id
+    LEFT JOIN Followups fu ON b.id = fu.pessoa_id
+    LEFT JOIN Contatos ct ON b.id = ct.pessoa_id
+    LEFT JOIN Oportunidades o ON a.id = o.pessoa_id
+    LEFT JOIN UltimaVendaPorRaizCNPJ g ON LEFT(b.cpf_cnpj, 8) = g.Raiz_CNPJ
+    LEFT JOIN Pedidos p ON a.cliente_id = p.pessoa_id
+    LEFT JOIN PedidosPorRevenda pr ON b.id = pr.pessoa_id
+
+WHERE
+    a.tipo_conta = 2
+    AND a.excluido = 0
+    AND a.status_conta = 0
+    AND b.classificacao_id <> 1
+    AND a.classificacao_id <> 1;
+"""
+CONSULTA_EXTRACAO = (
+    'WITH ' + ',\n'.join(f'{nome} AS (\n{sql}\n)' for nome, sql, _, _ in AGREGADOS_EXTRACAO)
+    + '\n\n' + CONSULTA_PRINCIPAL
+)
+
+
+def _arredondar_faturamento(df):
+    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
+    df['Faturamento_6_Meses'] = df['Faturamento_6_Meses'].round(2)
+    return df
+
+
+def consultar_extracao_sql(credenciais):
+    conn = _conectar(credenciais)
+    df = _arredondar_faturamento(pd.read_sql(CONSULTA_EXTRACAO, conn))
+    conn.close()
+    return df
+
+
+# ---------- EXTRAÇÃO PARALELA ----------
+# Só a base de contas (os mesmos filtros e joins da consulta principal) e a chave pessoa_id
+CONSULTA_CONTAS = """SELECT
+    a.id AS Conta_ID,
+    a.tipo_conta,
+    b.razao_social AS Razao_Social_Pessoas,
+    b.cpf_cnpj AS CNPJ,
+    LEFT(b.cpf_cnpj, 8) AS Raiz_CNPJ,
+    c.grupo_id AS Grupo_Econômico_ID,
+    c.grupo_nome AS Grupo_Econômico_Nome,
+    v.razao_social AS Nome_Vendedor,
+    b.data_ultima_venda AS Data_Ultima_Venda_Individual,
+    a.data_cadastro AS Data_Abertura_Conta,
+    a.classificacao_id AS Classificacao_Conta,
+    b.classificacao_id AS Classificacao_Pessoa,
+    a.porte_id AS Porte_Empresa,
+    b.id AS pessoa_id
+FROM
+    grupofort.dbo.crm_contas a
+    INNER JOIN dbo.pessoas b ON a.cliente_id = b.id
+    INNER JOIN dbo.rel_pessoas c ON b.id = c.id
+    INNER JOIN dbo.pessoas v ON a.vendedor_id = v.id
+WHERE
+    a.tipo_conta = 2
+    AND a.excluido = 0
+    AND a.status_conta = 0
+    AND b.classificacao_id <> 1
+    AND a.classificacao_id <> 1;
+"""
+
+# Conexões abertas ficam num pool por servidor/banco/usuário e são reaproveitadas entre extrações
+_pool_conexoes = {}
+_lock_pool = threading.Lock()
+
+
+@contextmanager
+def _conexao_do_pool(credenciais):
+    chave = tuple(credenciais[c] for c in CHAVES_CREDENCIAIS)
+    with _lock_pool:
+        livres = _pool_conexoes.setdefault(chave, [])
+        conn = livres.pop() if livres else None
+    if conn is None:
+        conn = _conectar(credenciais)
+    try:
+        yield conn
+    except Exception:
+        conn.close()  # estado desconhecido: não volta para o pool
+        raise
+    with _lock_pool:
+        if len(_pool_conexoes[chave]) < CONEXOES_EXTRACAO:
+            _pool_conexoes[chave].append(conn)
+            conn = None
+    if conn is not None:
+        conn.close()
+
+
+def _ler_consulta(credenciais, sql):
+    # Uma nova tentativa com outra conexão: a do pool pode ter sido derrubada pelo servidor
+    for tentativa in range(2):
+        try:
+            with _conexao_do_pool(credenciais) as conn:
+                return pd.read_sql(sql, conn)
+        except Exception:
+            if tentativa:
+                raise
+
+
+def montar_extracao(contas, agregados):
+    # Mesmo resultado da consulta única: left joins nas chaves das CTEs e os mesmos COALESCE
+    df = contas
+    for nome, _, chave, chave_base in AGREGADOS_EXTRACAO:
+        agregado = agregados[nome].dropna(subset=[chave]).rename(columns={chave: chave_base})
+        df = df.merge(agregado, on=chave_base, how='left', validate='many_to_one')
+
+    def zero(coluna):
+        return df[coluna].fillna(0)
+
+    extracao = pd.DataFrame({
+        'Conta_ID': df['Conta_ID'],
+        'tipo_conta': df['tipo_conta'],
+        'Razao_Social_Pessoas': df['Razao_Social_Pessoas'],
+        'CNPJ': df['CNPJ'],
+        'Raiz_CNPJ': df['Raiz_CNPJ'],
+        'Grupo_Econômico_ID': df['Grupo_Econômico_ID'],
+        'Grupo_Econômico_Nome': df['Grupo_Econômico_Nome'],
+        'Nome_Vendedor': df['Nome_Vendedor'],
+        'Data_Ultima_Venda_Individual': df['Data_Ultima_Venda_Individual'],
+        'Faturamento_6_Meses': zero('valor_total') + zero('valor_total_revenda'),
+        'Data_Abertura_Conta': df['Data_Abertura_Conta'],
+        'Total_Pedidos': (zero('total_pedidos') + zero('total_pedidos_revenda')).astype('int64'),
+        'Data_Ultima_Venda_Grupo_CNPJ': df['Data_Ultima_Venda_Grupo_CNPJ'].fillna(df['Data_Ultima_Venda_Individual']),
+        'Total_Followups': zero('total_followups').astype('int64'),
+        'Data_Ultimo_Followup': df['data_ultimo_followup'],
+        'Total_Contatos': zero('total_contatos').astype('int64'),
+        'Data_Ultimo_Contato': df['data_ultimo_contato'],
+        'Total_Oportunidades': zero('total_oportunidades').astype('int64'),
+        'Data_Ultima_Oportunidade': df['data_ultima_oportunidade'],
+        'Classificacao_Conta': df['Classificacao_Conta'],
+        'Classificacao_Pessoa': df['Classificacao_Pessoa'],
+        'Porte_Empresa': df['Porte_Empresa'],
+        'Total_Orcamentos': zero('total_orcamentos').astype('int64'),
+        'Data_Ultimo_Orcamento': df['data_ultimo_orcamento'],
+    })
+    return _arredondar_faturamento(extracao)
+
+
+def consultar_extracao_paralela(credenciais, usar_cache=True):
+    # A base de contas e os oito agregados rodam ao mesmo tempo, cada um na sua conexão do pool,
+    # e são ligados aqui por pessoa_id/Conta_ID/Raiz_CNPJ. Cada parte tem a sua entrada no cache
+    # compartilhado: se um agregado falhar, a próxima tentativa só refaz o que faltou.
+    from aquecimento import registrar_etapa
+    from cache_compartilhado import obter_ou_calcular
+
+    consultas = [('Contas', CONSULTA_CONTAS)] + [(nome, sql) for nome, sql, _, _ in AGREGADOS_EXTRACAO]
+
+    def ler(nome, sql):
+        def consultar():
+            inicio = time.perf_counter()
+            df = _ler_consulta(credenciais, sql)
+            registrar_etapa(f'extracao_sql:{nome}', time.perf_counter() - inicio)
+            return df
+        # A trava do cache é por chave: as partes são calculadas ao mesmo tempo
+        return obter_ou_calcular(f'extracao_sql_{nome}', consultar) if usar_cache else consultar()
+
+    with ThreadPoolExecutor(max_workers=CONEXOES_EXTRACAO, thread_name_prefix='extracao') as executor:
+        futuros = {nome: executor.submit(ler, nome, sql) for nome, sql in consultas}
+        partes = {nome: futuro.result() for nome, futuro in futuros.items()}
+    contas = partes.pop('Contas')
+    return montar_extracao(contas, partes)
+
+
+# Um lote enriquecido (datas convertidas, colunas *_Rotacao, status) ocupa algumas vezes o lote
+# lido do cursor; o tamanho dos lotes é calculado para caber nesse múltiplo dentro do orçamento.
+FATOR_EXPANSAO_LOTE = 4
+LINHAS_PRIMEIRO_LOTE = 5000
+
+
+def ler_extracao_em_lotes(credenciais, orcamento_bytes):
+    # Mesma consulta, lida do cursor aos poucos em vez de montar a base inteira; o primeiro
+    # lote mede quantos bytes cada linha ocupa e define o tamanho dos seguintes.
+    conn = _conectar(credenciais)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(CONSULTA_EXTRACAO)
+        colunas = [descricao[0] for descricao in cursor.description]
+        tamanho_lote = LINHAS_PRIMEIRO_LOTE
+        while linhas := cursor.fetchmany(tamanho_lote):
+            lote = pd.DataFrame.from_records([tuple(linha) for linha in linhas], columns=colunas, coerce_float=True)
+            del linhas
+            _arredondar_faturamento(lote)
+            bytes_por_linha = lote.memory_usage(deep=True).sum() / len(lote)
+            tamanho_lote = max(1000, int(orcamento_bytes / (FATOR_EXPANSAO_LOTE * bytes_por_linha)))
+            yield lote
+    finally:
+        conn.close()
+
+
+def carregar_extracao(credenciais, paralela=None):
+    # Cache em disco compartilhado entre as réplicas: só uma delas consulta o SQL Server.
+    # No modo paralelo as partes têm cache próprio, cada uma com a sua trava.
+    from cache_compartilhado import obter_ou_calcular
+
+    if paralela is None:
+        paralela = EXTRACAO_PARALELA_PADRAO
+    consultar = consultar_extracao_paralela if paralela else consultar_extracao_sql
+    return obter_ou_calcular('extracao_sql', lambda: consultar(credenciais))
+
+
+# ---------- VENDEDORES ATIVOS NO ERP ----------
+def consultar_nomes_vendedores_empresa(credenciais):
+    # Conexão e query para buscar os nomes dos vendedores da tabela dbo.pessoas
+    conn_vendedores = _conectar(credenciais)
+    query_vendedores = """
+    SELECT razao_social
+    FROM dbo.pessoas
+    WHERE vendedor = 1 AND ativo = 1
+    """
+    df_nomes_vendedores = pd.read_sql(query_vendedores, conn_vendedores)
+    conn_vendedores.close()
+    return sorted(df_nomes_vendedores['razao_social'].dropna().unique().tolist())
@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+import polars as pl
+
+from pipeline import (DATA_ROTACAO_LEGADA, REGRA_FATURAMENTO, REGRA_VENDA_GRUPO, REGRA_ABERTURA, REGRA_ENTRADA,
+                      REGRA_GRUPO_ECONOMICO, REGRA_DISTRIBUICAO, REGRAS_EXCLUSAO, CLASSIFICACOES_DISTRIBUICAO)
+from snapshots import preparar_para_arrow
+
+# Motor alternativo (ROTACAO_MOTOR=polars): as mesmas etapas do pipeline em pandas, montadas como
+# LazyFrames do Polars, que paraleliza joins, agregações e máscaras em todos os núcleos
+# (limite com POLARS_MAX_THREADS). Entradas e saídas continuam em pandas: só as colunas usadas vão
+# para o Polars, e o resultado volta com os mesmos valores e tipos do motor pandas.
+
+COLUNAS_ENRIQUECIMENTO = [
+    'Raiz_CNPJ', 'Nome_Vendedor', 'Conta_ID', 'Faturamento_6_Meses', 'Data_Ultima_Venda_Grupo_CNPJ',
+    'Data_Abertura_Conta', 'Grupo_Econômico_ID', 'Classificacao_Conta',
+    'Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento', 'Data_Ultima_Oportunidade',
+    'Total_Contatos', 'Total_Followups', 'Total_Orcamentos', 'Total_Oportunidades',
+]
+ATIVIDADES_ROTACAO = [
+    ('Total_Contatos', 'Data_Ultimo_Contato'),
+    ('Total_Followups', 'Data_Ultimo_Followup'),
+    ('Total_Orcamentos', 'Data_Ultimo_Orcamento'),
+    ('Total_Oportunidades', 'Data_Ultima_Oportunidade'),
+]
+# Status na ordem de prioridade do montar_relatorio_vendedor: a conta fica no primeiro que a aceita
+STATUS_RELATORIO = ['Ativa', 'Entraram Recentemente', 'Novas Recebidas', 'Cadastrado Recentemente', 'Retiradas']
+
+
+def _para_polars(df, colunas):
+    return pl.from_pandas(preparar_para_arrow(df[colunas]).reset_index(drop=True))
+
+
+def _como_data(frame, coluna, unidade='us'):
+    # Equivalente a pd.to_datetime(errors='coerce') para colunas que já são data ou texto
+    tipo = frame.collect_schema()[coluna]
+    if tipo == pl.String:
+        return pl.col(coluna).str.to_datetime(strict=False, time_unit=unidade)
+    if tipo == pl.Null:
+        return pl.col(coluna).cast(pl.Datetime(unidade))
+    return pl.col(coluna)
+
+
+# ---------- ENRIQUECIMENTO E CANDIDATAS ----------
+def enriquecer_e_filtrar(df, referencia, rotacoes_historico, data_referencia, data_limite):
+    # Mesmo resultado de pipeline.enriquecer + pipeline.mascara_candidatas
+    data_referencia = pd.Timestamp(data_referencia).normalize()
+    base = _para_polars(df, COLUNAS_ENRIQUECIMENTO).lazy().with_row_index('_linha')
+
+    colunas_referencia = {
+        'Raiz_CNPJ': referencia.index.to_numpy(dtype=object),
+        '_vendedor_referencia': referencia['Nome_Vendedor'].to_numpy(dtype=object),
+    }
+    if 'Data_Entrou_Carteira' in referencia.columns:
+        colunas_referencia['_entrada_referencia'] = (
+            pd.to_datetime(referencia['Data_Entrou_Carteira'], errors='coerce').to_numpy(dtype='datetime64[ns]')
+        )
+    ref = pl.from_pandas(pd.DataFrame(colunas_referencia)).lazy().with_columns(_na_referencia=pl.lit(True))
+
+    rotacoes = (
+        pl.from_pandas(rotacoes_historico[['conta_id', 'nome_vendedor', 'data_rotacao']])
+        .lazy()
+        .with_columns(pl.col('data_rotacao').cast(pl.Datetime('ns')))
+        .filter(pl.col('nome_vendedor').is_not_null() & (pl.col('data_rotacao') <= data_referencia))
+    )
+    # Todas as contas usam a mesma data de referência: a as-of join vira o máximo por chave
+    ultima = rotacoes.group_by('conta_id').agg(pl.col('data_rotacao').max().alias('data_ultima_rotacao'))
+    ultima_do_vendedor = rotacoes.group_by(['conta_id', 'nome_vendedor']).agg(
+        pl.col('data_rotacao').max().alias('_entrada_vendedor')
+    )
+
+    enriquecida = (
+        base
+        .with_columns(pl.col('Raiz_CNPJ').cast(pl.String).str.strip_chars().str.zfill(14))
+        .join(ref, on='Raiz_CNPJ', how='left')
+        .with_columns(
+            pl.col('_na_referencia').fill_null(False),
+            pl.when(pl.col('_na_referencia')).then(pl.col('_vendedor_referencia'))
+            .otherwise(pl.col('Nome_Vendedor')).alias('Nome_Vendedor'),
+            pl.col('Conta_ID').cast(pl.Int64, strict=False).fill_null(-1).alias('_conta_id'),
+        )
+        .join(ultima, left_on='_conta_id', right_on='conta_id', how='left')
+        .join(ultima_do_vendedor, left_on=['_conta_id', 'Nome_Vendedor'], right_on=['conta_id', 'nome_vendedor'],
+              how='left')
+        .with_columns(
+            pl.when(pl.col('_entrada_vendedor') == pl.col('data_ultima_rotacao'))
+            .then(pl.col('_entrada_vendedor')).alias('Data_Entrou_Carteira')
+        )
+    )
+    if 'Data_Entrou_Carteira' in referencia.columns:
+        entrada_referencia = pl.col('_entrada_referencia')
+    else:
+        entrada_referencia = pl.when(pl.col('_na_referencia')).then(pl.lit(DATA_ROTACAO_LEGADA).cast(pl.Datetime('ns')))
+    enriquecida = enriquecida.with_columns(
+        pl.coalesce(
+            pl.col('Data_Entrou_Carteira'),
+            pl.when(pl.col('data_ultima_rotacao').is_null()).then(entrada_referencia)
+        ).cast(pl.Datetime('ns')).alias('Data_Entrou_Carteira'),
+        pl.col('Faturamento_6_Meses').cast(pl.Float64, strict=False).fill_nan(None).fill_null(0.0),
+        *[_como_data(base, coluna).alias(coluna) for coluna in
+          ('Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento')],
+    )
+    rotacionada = pl.col('Data_Entrou_Carteira').is_not_null() & pl.col('data_ultima_rotacao').is_not_null()
+    enriquecida = enriquecida.with_columns(
+        pl.when(
+            (pl.col('Faturamento_6_Meses') > 0) |
+            (_como_data(base, 'Data_Ultima_Venda_Grupo_CNPJ') >= data_limite).fill_null(False)
+        ).then(pl.lit('Compra')).otherwise(pl.lit('Nao Compra')).alias('Status_Cliente'),
+        *[
+            pl.when(rotacionada & (_como_data(base, data_atividade) >= pl.col('Data_Entrou_Carteira')))
+            .then(pl.col(total)).otherwise(0).alias(f'{total}_Rotacao')
+            for total, data_atividade in ATIVIDADES_ROTACAO
+        ],
+    )
+    regras = [
+        (REGRA_FATURAMENTO, pl.col('Faturamento_6_Meses') > 0),
+        (REGRA_VENDA_GRUPO, _como_data(base, 'Data_Ultima_Venda_Grupo_CNPJ') >= data_limite),
+        (REGRA_ABERTURA, ~(_como_data(base, 'Data_Abertura_Conta') < data_limite).fill_null(False)),
+        (REGRA_ENTRADA, pl.col('Data_Entrou_Carteira') >= data_limite),
+        (REGRA_GRUPO_ECONOMICO, pl.col('Grupo_Econômico_ID').is_not_null()
+         & (pl.col('Grupo_Econômico_ID').cast(pl.String) != '')),
+        (REGRA_DISTRIBUICAO, pl.col('Classificacao_Conta').is_in(CLASSIFICACOES_DISTRIBUICAO)),
+    ]
+    elegibilidade = pl.sum_horizontal(
+        pl.when(aplica.fill_null(False)).then(pl.lit(regra, pl.UInt8)).otherwise(pl.lit(0, pl.UInt8))
+        for regra, aplica in regras
+    ).cast(pl.UInt8).alias('Elegibilidade')
+
+    colunas_saida = [
+        'Raiz_CNPJ', 'Nome_Vendedor', 'data_ultima_rotacao', 'Data_Entrou_Carteira', 'Faturamento_6_Meses',
+        'Status_Cliente', 'Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento',
+        *[f'{total}_Rotacao' for total, _ in ATIVIDADES_ROTACAO], 'Elegibilidade',
+    ]
+    resultado = (
+        enriquecida.with_columns(elegibilidade)
+        .sort('_linha')
+        .select(colunas_saida)
+        .collect()
+    )
+
+    # De volta ao frame original: colunas existentes no lugar, novas no fim, na ordem do motor pandas
+    novas = resultado.to_pandas()
+    novas.index = df.index
+    novas['Data_Entrou_Carteira'] = novas['Data_Entrou_Carteira'].astype('datetime64[ns]')
+    novas['data_ultima_rotacao'] = novas['data_ultima_rotacao'].astype('datetime64[ns]')
+    for total, _ in ATIVIDADES_ROTACAO:
+        novas[f'{total}_Rotacao'] = novas[f'{total}_Rotacao'].astype(df[total].dtype)
+    ordem = ['Raiz_CNPJ', 'Nome_Vendedor', 'data_ultima_rotacao', 'Data_Entrou_Carteira', 'Faturamento_6_Meses',
+             'Status_Cliente', 'Data_Ultimo_Contato', 'Data_Ultimo_Followup', 'Data_Ultimo_Orcamento']
+    df = df.assign(**{coluna: novas[coluna] for coluna in ordem})
+    df = df.assign(**{f'{total}_Rotacao': novas[f'{total}_Rotacao'] for total, _ in ATIVIDADES_ROTACAO})
+    df = df.assign(Elegibilidade=novas['Elegibilidade'])
+    return df, (df['Elegibilidade'].to_numpy() & REGRAS_EXCLUSAO) == 0
+
+
+# ---------- RELATÓRIOS POR VENDEDOR ----------
+def montar_relatorios(df_atual, df_anterior, vendedores, colunas_relatorio, data_limite, data_rotacao):
+    # Todos os vendedores de uma vez. Cada conta fica no primeiro status (na ordem de
+    # STATUS_RELATORIO) em que aparece na carteira do vendedor, como no montar_relatorio_vendedor;
+    # o Polars só decide quais linhas entram e em que ordem, as linhas saem dos frames pandas.
+    seis_meses_atras = data_rotacao - pd.DateOffset(months=6)
+    anterior = _para_polars(df_anterior, [
+        'Nome_Vendedor', 'Raiz_CNPJ', 'Razao_Social_Pessoas', 'Faturamento_6_Meses',
+        'Data_Ultima_Venda_Grupo_CNPJ', 'Grupo_Econômico_ID', 'Data_Entrou_Carteira', 'Data_Abertura_Conta',
+    ]).lazy().with_row_index('_posicao')
+    atual = _para_polars(df_atual, [
+        'Nome_Vendedor', 'Raiz_CNPJ', 'Razao_Social_Pessoas', 'Data_Entrou_Carteira',
+    ]).lazy().with_row_index('_posicao')
+
+    na_carteira_atual = atual.select('Nome_Vendedor', 'Raiz_CNPJ').unique().with_columns(_no_atual=pl.lit(True))
+    prioridade_anterior = (
+        pl.when(
+            (pl.col('Faturamento_6_Meses') > 0) |
+            (pl.col('Data_Ultima_Venda_Grupo_CNPJ') >= data_limite) |
+            pl.col('Grupo_Econômico_ID').is_not_null()
+        ).then(0)
+        .when((pl.col('Data_Entrou_Carteira') >= seis_meses_atras) & (pl.col('Data_Entrou_Carteira') != data_rotacao))
+        .then(1)
+        .when(pl.col('Data_Abertura_Conta') >= seis_meses_atras).then(3)
+        .when(pl.col('_no_atual').is_null() & (pl.col('Faturamento_6_Meses') <= 0.01)).then(4)
+    )
+    colunas = ['Nome_Vendedor', 'Raiz_CNPJ', 'Razao_Social_Pessoas', '_prioridade', '_origem', '_posicao']
+    linhas = pl.concat([
+        anterior.join(na_carteira_atual, on=['Nome_Vendedor', 'Raiz_CNPJ'], how='left')
+        .with_columns(_prioridade=prioridade_anterior, _origem=pl.lit(0))
+        .select(colunas),
+        atual.with_columns(
+            _prioridade=pl.when(pl.col('Data_Entrou_Carteira') == data_rotacao).then(2), _origem=pl.lit(1)
+        ).select(colunas),
+    ], how='vertical_relaxed')
+
+    escolhidas = (
+        linhas
+        .filter(pl.col('_prioridade').is_not_null() & pl.col('Nome_Vendedor').is_in(list(vendedores)))
+        .sort(['Nome_Vendedor', 'Raiz_CNPJ', '_prioridade', '_posicao'])
+        .unique(subset=['Nome_Vendedor', 'Raiz_CNPJ'], keep='first', maintain_order=True)
+        .with_columns(pl.col('_prioridade').replace_strict(
+            list(range(len(STATUS_RELATORIO))), STATUS_RELATORIO, return_dtype=pl.String
+        ).alias('Status'))
+        .sort(['Nome_Vendedor', 'Status', 'Razao_Social_Pessoas', '_posicao'], nulls_last=True)
+        .select('Nome_Vendedor', 'Status', '_origem', '_posicao')
+        .collect()
+    )
+
+    # Linhas do anterior e do atual num só frame: a posição final é a posição na origem + deslocamento
+    base = pd.concat([df_anterior[colunas_relatorio], df_atual[colunas_relatorio]], ignore_index=True)
+    posicoes = escolhidas['_posicao'].to_numpy().astype(np.int64) + escolhidas['_origem'].to_numpy() * len(df_anterior)
+    status = escolhidas['Status'].to_numpy().astype(object)
+    relatorios = {}
+    inicio = 0
+    for vendedor, quantidade in escolhidas.group_by('Nome_Vendedor', maintain_order=True).len().iter_rows():
+        relatorio = base.take(posicoes[inicio:inicio + quantidade]).reset_index(drop=True)
+        relatorio.insert(0, 'Status', status[inicio:inicio + quantidade])
+        relatorios[vendedor] = relatorio
+        inicio += quantidade
+    return relatorios
@@ -0,0 +1,92 @@
+from io import BytesIO
+
+import pandas as pd
+
+
+# ---------- CONVERSÃO DAS CONTAS ROTACIONADAS ----------
+def calcular_conversao(df):
+    # Uma linha por (mês da última rotação, vendedor atual) a partir da base enriquecida
+    rotacionadas = df[df['data_ultima_rotacao'].notna()]
+    if rotacionadas.empty:
+        return []
+    venda_apos = (
+        pd.to_datetime(rotacionadas['Data_Ultima_Venda_Individual'], errors='coerce')
+        >= rotacionadas['data_ultima_rotacao']
+    )
+    base = pd.DataFrame({
+        'mes_rotacao': rotacionadas['data_ultima_rotacao'].dt.strftime('%Y-%m'),
+        'nome_vendedor': rotacionadas['Nome_Vendedor'],
+        'contas': 1,
+        'com_contato': (rotacionadas['Total_Contatos_Rotacao'] > 0).astype(int),
+        'com_orcamento': (rotacionadas['Total_Orcamentos_Rotacao'] > 0).astype(int),
+        'com_venda': venda_apos.astype(int),
+        'faturamento': rotacionadas['Faturamento_6_Meses'].where(venda_apos, 0.0),
+    }).dropna(subset=['nome_vendedor'])
+    agregado = base.groupby(['mes_rotacao', 'nome_vendedor'], as_index=False).sum()
+    return list(agregado.itertuples(index=False, name=None))
+
+
+# ---------- FIGURAS ----------
+def _png(fig):
+    import matplotlib.pyplot as plt
+
+    buffer = BytesIO()
+    fig.savefig(buffer, format='png', dpi=110, bbox_inches='tight')
+    plt.close(fig)
+    return buffer.getvalue()
+
+
+def renderizar_figuras(agregados):
+    # Renderiza a partir das tabelas agregadas (pequenas), nunca do histórico bruto
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    figuras = {}
+
+    rotacoes = agregados['rotacoes']
+    if not rotacoes.empty:
+        matriz = rotacoes.pivot_table(index='nome_vendedor', columns='mes', values='rotacoes', fill_value=0).astype(int)
+        fig, ax = plt.subplots(figsize=(max(6, 1.1 * matriz.shape[1] + 4), max(3, 0.35 * matriz.shape[0] + 1)))
+        sns.heatmap(matriz, annot=True, fmt='d', cmap='Blues', cbar=False, ax=ax)
+        ax.set_title('Rotações por vendedor e mês')
+        ax.set_xlabel('')
+        ax.set_ylabel('')
+        figuras['rotacoes'] = _png(fig)
+
+    conversao = agregados['conversao']
+    if not conversao.empty:
+        por_vendedor = conversao.groupby('nome_vendedor')[['contas', 'com_contato', 'com_orcamento', 'com_venda']].sum()
+        taxas = pd.DataFrame({
+            'Contato': por_vendedor['com_contato'] / por_vendedor['contas'],
+            'Orçamento': por_vendedor['com_orcamento'] / por_vendedor['contas'],
+            'Venda': por_vendedor['com_venda'] / por_vendedor['contas'],
+        }).sort_values('Venda')
+        fig, ax = plt.subplots(figsize=(8, max(3, 0.35 * len(taxas) + 1)))
+        taxas.plot.barh(ax=ax)
+        ax.set_title('Conversão das contas rotacionadas')
+        ax.xaxis.set_major_formatter(matplotlib.ticker.PercentFormatter(1.0))
+        ax.set_ylabel('')
+        figuras['conversao'] = _png(fig)
+
+        faturamento = conversao.groupby('mes_rotacao')['faturamento'].sum()
+        fig, ax = plt.subplots(figsize=(8, 3))
+        faturamento.plot.bar(ax=ax, color='#2a9d8f')
+        ax.set_title('Faturamento das contas rotacionadas (venda após a rotação)')
+        ax.set_xlabel('Mês da rotação')
+        figuras['faturamento'] = _png(fig)
+
+    sobras = agregados['sobras']
+    if not sobras.empty:
+        taxa_sobra = sobras.assign(
+            taxa=1 - sobras['colocadas'] / sobras['candidatas'].where(sobras['candidatas'] > 0)
+        ).pivot_table(index='mes', columns='grupo', values='taxa')
+        fig, ax = plt.subplots(figsize=(8, 3))
+        taxa_sobra.plot(ax=ax, marker='o')
+        ax.set_title('Taxa de contas sem rotação (sobras)')
+        ax.yaxis.set_major_formatter(matplotlib.ticker.PercentFormatter(1.0))
+        ax.set_xlabel('')
+        figuras['sobras'] = _png(fig)
+
+    return figuras
@@ -0,0 +1,280 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from painel import calcular_conversao
+from relatorios import COLUNAS_RELATORIO
+from rotacao import calcular_datas_entrada
+from snapshots import preparar_para_arrow
+
+# Rotação feita antes do histórico em SQLite existir; só vale para contas da referência sem registro nele
+DATA_ROTACAO_LEGADA = pd.Timestamp('2025-03-20')
+
+# Modo em lotes para bases que não cabem na memória; também pode ser ligado pela barra lateral
+MODO_LOTES_PADRAO = os.environ.get('ROTACAO_MODO_LOTES', '0') == '1'
+ORCAMENTO_MEMORIA_MB_PADRAO = int(os.environ.get('ROTACAO_ORCAMENTO_MEMORIA_MB', 512))
+PREFIXO_PASTA_LOTES = 'rotacao_lotes_'
+
+# Motor do enriquecimento, do filtro de candidatas e dos relatórios. 'polars' (motor_polars.py)
+# usa todos os núcleos da máquina e dá o mesmo resultado; compare com benchmark_motores.py.
+MOTORES = ('pandas', 'polars')
+MOTOR_PADRAO = os.environ.get('ROTACAO_MOTOR', 'pandas')
+
+# Data-base da rodada: o "hoje" de todas as etapas (data de referência do histórico, data limite
+# das regras e do Status_Cliente, data da rotação e dos relatórios). Com ela fixa, a mesma entrada
+# dá sempre o mesmo resultado; ROTACAO_DATA_BASE=AAAA-MM-DD refaz uma rodada passada.
+DATA_BASE_PADRAO = os.environ.get('ROTACAO_DATA_BASE')
+DIAS_DATA_LIMITE = 6 * 30
+
+# Colunas que os relatórios leem da base (o resto fica só nas partes em disco)
+COLUNAS_BASE_RELATORIO = COLUNAS_RELATORIO + ['Grupo_Econômico_ID', 'Data_Abertura_Conta']
+
+# Elegibilidade: um bit por regra na coluna Elegibilidade (uint8) da base enriquecida, que vai junto
+# para as partes e os snapshots. Bit ligado = a regra impede a rotação; candidata = nenhum bit de
+# REGRAS_EXCLUSAO. O bit de distribuição só informa o grupo (classificação 5 ou 7).
+REGRA_FATURAMENTO = 1
+REGRA_VENDA_GRUPO = 2
+REGRA_ABERTURA = 4
+REGRA_ENTRADA = 8
+REGRA_GRUPO_ECONOMICO = 16
+REGRA_DISTRIBUICAO = 32
+REGRAS_EXCLUSAO = REGRA_FATURAMENTO | REGRA_VENDA_GRUPO | REGRA_ABERTURA | REGRA_ENTRADA | REGRA_GRUPO_ECONOMICO
+MOTIVOS_ELEGIBILIDADE = {
+    REGRA_FATURAMENTO: "Faturou nos últimos 6 meses",
+    REGRA_VENDA_GRUPO: "Venda do grupo/CNPJ depois da data limite",
+    REGRA_ABERTURA: "Conta aberta depois da data limite (ou sem data de abertura)",
+    REGRA_ENTRADA: "Entrou na carteira do vendedor depois da data limite",
+    REGRA_GRUPO_ECONOMICO: "Pertence a um grupo econômico",
+}
+CLASSIFICACOES_DISTRIBUICAO = [5, 7]
+
+
+# ---------- DATAS DA RODADA ----------
+def datas_da_rodada(data_base=None):
+    if data_base is None:
+        data_base = DATA_BASE_PADRAO or pd.Timestamp.today()
+    data_base = pd.Timestamp(data_base).normalize()
+    return {
+        'data_referencia': data_base,
+        'data_limite': data_base - pd.Timedelta(days=DIAS_DATA_LIMITE),
+        'data_rotacao': data_base,
+    }
+
+
+# ---------- ENRIQUECIMENTO ----------
+def preparar_referencia(referencia):
+    # Uma linha por Raiz_CNPJ (a última da planilha, como no dict de transferência)
+    referencia = referencia.assign(Raiz_CNPJ=referencia['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14))
+    return referencia.drop_duplicates('Raiz_CNPJ', keep='last').set_index('Raiz_CNPJ')
+
+
+def enriquecer(df, referencia, rotacoes_historico, data_referencia, data_limite):
+    # referencia: saída de preparar_referencia. Funciona igual para a base inteira ou para um lote.
+    df = df.assign(Raiz_CNPJ=df['Raiz_CNPJ'].astype(str).str.strip().str.zfill(14))
+
+    # Atualiza o Nome_Vendedor do df conforme a referência
+    na_referencia = df['Raiz_CNPJ'].isin(referencia.index)
+    df['Nome_Vendedor'] = df['Nome_Vendedor'].where(
+        ~na_referencia, df['Raiz_CNPJ'].map(referencia['Nome_Vendedor'])
+    )
+
+    # Data de entrada na carteira do vendedor atual, calculada do histórico (as-of data_referencia).
+    # Contas da referência sem registro no histórico (rotações anteriores a ele) usam a
+    # Data_Entrou_Carteira da própria planilha ou, se ela não tiver a coluna, a data da rotação legada.
+    df['data_ultima_rotacao'], df['Data_Entrou_Carteira'] = calcular_datas_entrada(
+        df['Conta_ID'], df['Nome_Vendedor'], rotacoes_historico, data_referencia
+    )
+    if 'Data_Entrou_Carteira' in referencia.columns:
+        entrada_referencia = df['Raiz_CNPJ'].map(
+            pd.to_datetime(referencia['Data_Entrou_Carteira'], errors='coerce')
+        )
+    else:
+        entrada_referencia = pd.Series(
+            np.where(na_referencia, DATA_ROTACAO_LEGADA, pd.NaT), index=df.index, dtype='datetime64[ns]'
+        )
+    df['Data_Entrou_Carteira'] = df['Data_Entrou_Carteira'].fillna(
+        entrada_referencia.where(df['data_ultima_rotacao'].isna())
+    )
+
+    # Lógica de status
+    df['Faturamento_6_Meses'] = pd.to_numeric(df['Faturamento_6_Meses'], errors='coerce').fillna(0)
+    df['Status_Cliente'] = np.where(
+        (df['Faturamento_6_Meses'] > 0) |
+        (pd.to_datetime(df['Data_Ultima_Venda_Grupo_CNPJ'], errors='coerce') >= data_limite),
+        'Compra', 'Nao Compra'
+    )
+
+    # --- Garantir tipos corretos ---
+    df['Data_Ultimo_Contato'] = pd.to_datetime(df['Data_Ultimo_Contato'], errors='coerce')
+    df['Data_Ultimo_Followup'] = pd.to_datetime(df['Data_Ultimo_Followup'], errors='coerce')
+    df['Data_Entrou_Carteira'] = pd.to_datetime(df['Data_Entrou_Carteira'], errors='coerce')
+    df['Data_Ultimo_Orcamento'] = pd.to_datetime(df['Data_Ultimo_Orcamento'], errors='coerce')
+
+    # --- Contatos e Follow-ups após rotação (desde a entrada na carteira, vinda do histórico) ---
+    rotacionada = df['Data_Entrou_Carteira'].notna() & df['data_ultima_rotacao'].notna()
+    for total, data_atividade in [
+        ('Total_Contatos', 'Data_Ultimo_Contato'),
+        ('Total_Followups', 'Data_Ultimo_Followup'),
+        ('Total_Orcamentos', 'Data_Ultimo_Orcamento'),
+        ('Total_Oportunidades', 'Data_Ultima_Oportunidade'),
+    ]:
+        depois_da_entrada = rotacionada & (
+            pd.to_datetime(df[data_atividade], errors='coerce') >= df['Data_Entrou_Carteira']
+        )
+        df[f'{total}_Rotacao'] = df[total].where(depois_da_entrada, 0)
+
+    df['Elegibilidade'] = calcular_elegibilidade(df, data_limite)
+    return df
+
+
+# ---------- ELEGIBILIDADE ----------
+def calcular_elegibilidade(df, data_limite):
+    elegibilidade = np.zeros(len(df), dtype=np.uint8)
+    for regra, aplica in [
+        (REGRA_FATURAMENTO, df['Faturamento_6_Meses'] > 0),
+        (REGRA_VENDA_GRUPO, pd.to_datetime(df['Data_Ultima_Venda_Grupo_CNPJ'], errors='coerce') >= data_limite),
+        (REGRA_ABERTURA, ~(df['Data_Abertura_Conta'] < data_limite)),
+        (REGRA_ENTRADA, df['Data_Entrou_Carteira'] >= data_limite),
+        (REGRA_GRUPO_ECONOMICO, df['Grupo_Econômico_ID'].notnull() & (df['Grupo_Econômico_ID'] != '')),
+        (REGRA_DISTRIBUICAO, df['Classificacao_Conta'].isin(CLASSIFICACOES_DISTRIBUICAO)),
+    ]:
+        elegibilidade[aplica.to_numpy(dtype=bool)] |= regra
+    return elegibilidade
+
+
+def mascara_candidatas(df):
+    return (df['Elegibilidade'].to_numpy() & REGRAS_EXCLUSAO) == 0
+
+
+def explicar_elegibilidade(elegibilidade):
+    # Motivos (na ordem das regras) que impedem a rotação; lista vazia = candidata
+    return [motivo for regra, motivo in MOTIVOS_ELEGIBILIDADE.items() if int(elegibilidade) & regra]
+
+
+def indice_elegibilidade(df):
+    # Raiz_CNPJ -> bits: "por que esta conta não foi rotacionada?" sem reprocessar a base
+    return pd.Series(df['Elegibilidade'].to_numpy(), index=df['Raiz_CNPJ'].to_numpy(), name='Elegibilidade')
+
+
+def enriquecer_e_filtrar(df, referencia, rotacoes_historico, data_referencia, data_limite, motor='pandas'):
+    # Devolve a base enriquecida e a máscara (numpy) das candidatas à rotação
+    if motor == 'polars':
+        from motor_polars import enriquecer_e_filtrar as enriquecer_polars
+
+        return enriquecer_polars(df, referencia, rotacoes_historico, data_referencia, data_limite)
+    if motor != 'pandas':
+        raise ValueError(f"Motor desconhecido: {motor}")
+    df = enriquecer(df, referencia, rotacoes_historico, data_referencia, data_limite)
+    return df, mascara_candidatas(df)
+
+
+def separar_grupos(contas_vao_rotacionar):
+    # O bit de distribuição separa as candidatas dos dois grupos (Distribuição = classificação 5 ou 7)
+    eh_distribuicao = (contas_vao_rotacionar['Elegibilidade'].to_numpy() & REGRA_DISTRIBUICAO) != 0
+    return {
+        "Distribuição (Helder)": contas_vao_rotacionar[eh_distribuicao],
+        "Corporativo (Karen)": contas_vao_rotacionar[~eh_distribuicao],
+    }
+
+
+# ---------- BASE INTEIRA EM MEMÓRIA ----------
+def processar_extracao(df, referencia, rotacoes_historico, vendedores_ativos, data_referencia, data_limite,
+                       motor='pandas'):
+    df, candidatas = enriquecer_e_filtrar(df.drop_duplicates(subset='Raiz_CNPJ'), referencia, rotacoes_historico,
+                                          data_referencia, data_limite, motor)
+    df_filtrado = df[df['Nome_Vendedor'].isin(vendedores_ativos)].reset_index(drop=True)
+    return {
+        'df': df,
+        'df_filtrado': df_filtrado,
+        'partes': None,
+        'conversao': calcular_conversao(df),
+        'df_historico': df[['Raiz_CNPJ', 'Nome_Vendedor']].dropna().drop_duplicates().reset_index(drop=True),
+        'contas_por_grupo': separar_grupos(df[candidatas]),
+        'elegibilidade': indice_elegibilidade(df),
+        'carga_atual': df_filtrado['Nome_Vendedor'].value_counts().to_dict(),
+    }
+
+
+# ---------- BASE EM LOTES (fora da memória) ----------
+def processar_em_lotes(lotes, referencia, rotacoes_historico, vendedores_ativos, data_referencia, data_limite,
+                       pasta_lotes, progresso=None, motor='pandas'):
+    # Cada lote é enriquecido e gravado em Parquet na pasta_lotes; na memória ficam só as candidatas,
+    # os pares (Raiz_CNPJ, vendedor) das exclusões e os contadores por vendedor.
+    os.makedirs(pasta_lotes, exist_ok=True)
+    vistos = set()  # drop_duplicates('Raiz_CNPJ') entre lotes: fica a primeira ocorrência
+    partes, candidatas, historico, conversao, elegibilidade = [], [], [], [], []
+    carga_atual = {}
+    linhas_lidas = 0
+
+    for n, lote in enumerate(lotes):
+        linhas_lidas += len(lote)
+        if progresso:
+            progresso(n, n + 1, f"Processando lote {n + 1} ({linhas_lidas} linhas lidas)")
+        novos = ~lote['Raiz_CNPJ'].duplicated().to_numpy()
+        novos &= np.fromiter((raiz not in vistos for raiz in lote['Raiz_CNPJ']), dtype=bool, count=len(lote))
+        lote = lote[novos]
+        vistos.update(lote['Raiz_CNPJ'])
+        if lote.empty:
+            continue
+
+        lote, candidatas_lote = enriquecer_e_filtrar(lote, referencia, rotacoes_historico, data_referencia,
+                                                     data_limite, motor)
+        conversao.extend(calcular_conversao(lote))
+        historico.append(lote[['Raiz_CNPJ', 'Nome_Vendedor']].dropna().drop_duplicates())
+        candidatas.append(lote[candidatas_lote])
+        elegibilidade.append(indice_elegibilidade(lote))
+        for vendedor, quantidade in lote.loc[lote['Nome_Vendedor'].isin(vendedores_ativos), 'Nome_Vendedor'].value_counts().items():
+            carga_atual[vendedor] = carga_atual.get(vendedor, 0) + int(quantidade)
+
+        caminho = os.path.join(pasta_lotes, f'parte_{n:05d}.parquet')
+        preparar_para_arrow(lote).to_parquet(caminho, engine='pyarrow', compression='zstd', index=False)
+        partes.append(caminho)
+
+    if conversao:
+        conversao = list(
+            pd.DataFrame(conversao).groupby([0, 1], as_index=False).sum().itertuples(index=False, name=None)
+        )
+    contas_vao_rotacionar = (
+        pd.concat(candidatas, ignore_index=True) if candidatas
+        else pd.DataFrame({'Classificacao_Conta': [], 'Raiz_CNPJ': [], 'Conta_ID': [], 'Nome_Vendedor': [],
+                           'Elegibilidade': np.array([], dtype=np.uint8)})
+    )
+    df_historico = (
+        pd.concat(historico).drop_duplicates().reset_index(drop=True) if historico
+        else pd.DataFrame(columns=['Raiz_CNPJ', 'Nome_Vendedor'])
+    )
+    return {
+        'df': None,
+        'df_filtrado': None,
+        'partes': partes,
+        'conversao': conversao,
+        'df_historico': df_historico,
+        'contas_por_grupo': separar_grupos(contas_vao_rotacionar),
+        'elegibilidade': (
+            pd.concat(elegibilidade) if elegibilidade else pd.Series([], dtype=np.uint8, name='Elegibilidade')
+        ),
+        'carga_atual': carga_atual,
+    }
+
+
+def carregar_partes(partes, colunas=None, vendedores=None):
+    # Lê de volta só as colunas e os vendedores pedidos, uma parte por vez
+    filtros = [('Nome_Vendedor', 'in', list(vendedores))] if vendedores is not None else None
+    frames = [pd.read_parquet(parte, engine='pyarrow', columns=colunas, filters=filtros) for parte in partes]
+    if not frames:
+        return pd.DataFrame(columns=colunas or [])
+    return pd.concat(frames, ignore_index=True)
+
+
+def nova_pasta_lotes():
+    import tempfile
+
+    return tempfile.mkdtemp(prefix=PREFIXO_PASTA_LOTES)
+
+
+def descartar_lotes(pasta_lotes):
+    # Remove as partes de um processamento anterior da sessão
+    if pasta_lotes and os.path.basename(pasta_lotes).startswith(PREFIXO_PASTA_LOTES):
+        shutil.rmtree(pasta_lotes, ignore_errors=True)
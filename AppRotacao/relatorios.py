@@ -0,0 +1,307 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+# Relatórios já gerados ficam em <pasta_destino>/_cache, nomeados pelo hash do conteúdo
+PASTA_CACHE_RELATORIOS = '_cache'
+IDADE_MAXIMA_CACHE_RELATORIOS = 30 * 24 * 60 * 60  # segundos sem uso até o arquivo ser apagado
+NIVEL_COMPRESSAO_ZIP = 6  # xlsx já vem comprimido; acima disso o ganho é nulo e o tempo cresce
+# Pacotes (ZIP) de cada tarefa, numa pasta por tarefa; os de sessões abandonadas ou de antes de um
+# reinício do servidor saem pela idade, na geração do próximo pacote
+PASTA_PACOTES = os.environ.get('ROTACAO_PACOTES', os.path.join(tempfile.gettempdir(), 'rotacao_relatorios'))
+IDADE_MAXIMA_PACOTE = 24 * 60 * 60  # segundos; acima da vida de uma tarefa concluída (tarefas.py)
+
+
+COLUNAS_RELATORIO = [
+    'Nome_Vendedor',
+    'Razao_Social_Pessoas',
+    'Conta_ID',
+    'Raiz_CNPJ',
+    'Faturamento_6_Meses',
+    'Total_Pedidos',
+    'Data_Ultima_Venda_Grupo_CNPJ',
+    'Data_Entrou_Carteira',
+    'data_ultima_rotacao',
+    'Total_Contatos_Rotacao',
+    'Data_Ultimo_Contato',
+    'Total_Followups_Rotacao',
+    'Data_Ultimo_Followup',
+    'Total_Orcamentos_Rotacao',
+    'Data_Ultimo_Orcamento'
+]
+
+
+def _converter_datas(df):
+    # Não altera o frame recebido: com Copy-on-Write o assign só materializa as colunas convertidas
+    convertidas = {
+        coluna: pd.to_datetime(df[coluna], errors='coerce')
+        for coluna in ('Data_Entrou_Carteira', 'Data_Ultima_Venda_Grupo_CNPJ')
+        if not pd.api.types.is_datetime64_any_dtype(df[coluna])
+    }
+    return df.assign(**convertidas) if convertidas else df
+
+
+def montar_relatorio_vendedor(atual_vend, anterior_vend, data_limite, data_rotacao):
+    seis_meses_atras = data_rotacao - pd.DateOffset(months=6)
+    usados = set()
+    blocos = []
+    status = []
+
+    def montar_bloco(df, mascara, nome_status):
+        # Uma única seleção de linhas + colunas por bloco; o Status entra depois do concat
+        bloco = df.loc[mascara, COLUNAS_RELATORIO]
+        usados.update(bloco['Raiz_CNPJ'])
+        blocos.append(bloco)
+        status.append((nome_status, len(bloco)))
+
+    montar_bloco(anterior_vend, (
+        (
+            (anterior_vend['Faturamento_6_Meses'] > 0) |
+            (anterior_vend['Data_Ultima_Venda_Grupo_CNPJ'] >= data_limite) |
+            (anterior_vend['Grupo_Econômico_ID'].notnull())
+        ) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ), 'Ativa')
+
+    montar_bloco(anterior_vend, (
+        (anterior_vend['Data_Entrou_Carteira'] >= seis_meses_atras) &
+        (anterior_vend['Data_Entrou_Carteira'] != data_rotacao) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ), 'Entraram Recentemente')
+
+    montar_bloco(atual_vend, (
+        (atual_vend['Data_Entrou_Carteira'] == data_rotacao) &
+        (~atual_vend['Raiz_CNPJ'].isin(usados))
+    ), 'Novas Recebidas')
+
+    montar_bloco(anterior_vend, (
+        (anterior_vend['Data_Abertura_Conta'] >= seis_meses_atras) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados))
+    ), 'Cadastrado Recentemente')
+
+    # CNPJs que não estão mais com o vendedor atual
+    # Filtro extra: garantir que são contas sem faturamento e não migraram para outro vendedor
+    montar_bloco(anterior_vend, (
+        (~anterior_vend['Raiz_CNPJ'].isin(atual_vend['Raiz_CNPJ'])) &
+        (~anterior_vend['Raiz_CNPJ'].isin(usados)) &
+        (anterior_vend['Faturamento_6_Meses'] <= 0.01)
+    ), 'Retiradas')
+
+    df_relatorio = pd.concat(blocos, ignore_index=True)
+    df_relatorio.insert(0, 'Status', np.repeat([s for s, _ in status], [n for _, n in status]))
+    df_relatorio = df_relatorio.drop_duplicates(subset='Raiz_CNPJ', keep='first')
+    return df_relatorio.sort_values(['Status', 'Razao_Social_Pessoas']).reset_index(drop=True)
+
+
+# ---------- CACHE POR CONTEÚDO ----------
+def _hash_relatorio(df):
+    h = hashlib.blake2b(digest_size=16)
+    h.update('|'.join(f'{coluna}:{tipo}' for coluna, tipo in df.dtypes.items()).encode())
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def _arquivo_em_cache(pasta_cache, assinatura, escrever):
+    # Só escreve o xlsx se esse conteúdo ainda não foi gerado; o uso renova a data do arquivo
+    caminho = os.path.join(pasta_cache, f'{assinatura}.xlsx')
+    if os.path.exists(caminho):
+        os.utime(caminho)
+        return caminho, False
+    # Nome temporário único por chamada: as tarefas de relatório são threads do mesmo processo
+    temporario = os.path.join(pasta_cache, f'{assinatura}.{uuid.uuid4().hex}.tmp.xlsx')
+    escrever(temporario)
+    if os.path.exists(caminho):
+        # Outra tarefa gerou o mesmo conteúdo enquanto este era escrito
+        os.remove(temporario)
+        return caminho, False
+    try:
+        os.replace(temporario, caminho)
+    except OSError:
+        # No Windows o destino recém-criado por outra tarefa pode estar aberto; o conteúdo é o mesmo
+        if not os.path.exists(caminho):
+            raise
+        os.remove(temporario)
+        return caminho, False
+    return caminho, True
+
+
+def _limpar_cache(pasta_cache, em_uso):
+    limite = time.time() - IDADE_MAXIMA_CACHE_RELATORIOS
+    for arquivo in os.listdir(pasta_cache):
+        caminho = os.path.join(pasta_cache, arquivo)
+        if caminho not in em_uso and os.path.getmtime(caminho) < limite:
+            try:
+                os.remove(caminho)
+            except OSError:
+                pass
+
+
+def relatorios_por_vendedor(df_atual, df_anterior, vendedores, data_limite, data_rotacao, motor='pandas'):
+    # Gera (vendedor, df_relatorio) na ordem de vendedores; os dois motores dão frames iguais
+    if motor == 'polars':
+        from motor_polars import montar_relatorios
+
+        relatorios = montar_relatorios(df_atual, df_anterior, vendedores, COLUNAS_RELATORIO, data_limite, data_rotacao)
+        for vendedor in vendedores:
+            yield vendedor, relatorios.get(vendedor)
+        return
+    if motor != 'pandas':
+        raise ValueError(f"Motor desconhecido: {motor}")
+
+    # Posições das linhas de cada vendedor, calculadas uma vez em vez de uma máscara por vendedor
+    linhas_atual = df_atual.groupby('Nome_Vendedor', sort=False).indices
+    linhas_anterior = df_anterior.groupby('Nome_Vendedor', sort=False).indices
+    sem_linhas = np.array([], dtype=np.int64)
+    for vendedor in vendedores:
+        atual_vend = df_atual.take(linhas_atual[vendedor])
+        anterior_vend = df_anterior.take(linhas_anterior.get(vendedor, sem_linhas))
+        yield vendedor, montar_relatorio_vendedor(atual_vend, anterior_vend, data_limite, data_rotacao)
+
+
+def gerar_relatorios(df_atual, df_anterior, data_limite, data_rotacao, pasta_destino='Relatorio_Rotação',
+                     progresso=None, ao_gerar=None, motor='pandas', pasta_cache=None):
+    # ao_gerar(caminho): chamado assim que cada arquivo fica pronto (ex.: para já ir compactando).
+    # pasta_cache: por padrão <pasta_destino>/_cache; o pacote usa uma pasta_destino própria por
+    # tarefa e o cache compartilhado.
+    os.makedirs(pasta_destino, exist_ok=True)
+    if pasta_cache is None:
+        pasta_cache = os.path.join(pasta_destino, PASTA_CACHE_RELATORIOS)
+    os.makedirs(pasta_cache, exist_ok=True)
+
+    data_rotacao = pd.to_datetime(data_rotacao).normalize()
+    data_limite = pd.to_datetime(data_limite).normalize()
+
+    df_atual = _converter_datas(df_atual)
+    df_anterior = _converter_datas(df_anterior)
+
+    vendedores = df_atual['Nome_Vendedor'].dropna().unique()
+    arquivos_por_vendedor = {}
+
+    # Cada carteira vira um hash do frame do relatório; vendedor sem mudança reaproveita o xlsx
+    # já gerado (só uma cópia de arquivo), e o completo só é reescrito se alguma aba mudou.
+    abas = []
+    em_uso = set()
+    reaproveitados = 0
+
+    relatorios = relatorios_por_vendedor(df_atual, df_anterior, vendedores, data_limite, data_rotacao, motor)
+    for n, (vendedor, df_relatorio) in enumerate(relatorios, start=1):
+        if progresso:
+            progresso(n - 1, len(vendedores), f"Gerando relatório de {vendedor} ({n}/{len(vendedores)}, "
+                                              f"{reaproveitados} sem mudança)")
+
+        if df_relatorio is not None and not df_relatorio.empty:
+            assinatura = _hash_relatorio(df_relatorio)
+            em_cache, gerado = _arquivo_em_cache(
+                pasta_cache, assinatura, lambda caminho: df_relatorio.to_excel(caminho, index=False)
+            )
+            reaproveitados += not gerado
+            em_uso.add(em_cache)
+
+            nome_arquivo_vendedor = f"{pasta_destino}/relatorio_{vendedor.replace(' ', '_')}_{data_rotacao.strftime('%Y-%m-%d')}.xlsx"
+            shutil.copyfile(em_cache, nome_arquivo_vendedor)
+            arquivos_por_vendedor[vendedor] = nome_arquivo_vendedor
+            if ao_gerar:
+                ao_gerar(nome_arquivo_vendedor)
+
+            aba = vendedor[:31]
+            abas.append((aba, assinatura, df_relatorio))
+
+    if progresso:
+        progresso(len(vendedores), len(vendedores), f"Montando relatório completo ({reaproveitados} vendedores sem mudança)")
+
+    def escrever_completo(caminho):
+        with pd.ExcelWriter(caminho, engine='xlsxwriter') as writer:
+            for aba, _, df_relatorio in abas:
+                df_relatorio.to_excel(writer, sheet_name=aba, index=False)
+
+    assinatura_completo = hashlib.blake2b(
+        '|'.join(f'{aba}:{assinatura}' for aba, assinatura, _ in abas).encode(), digest_size=16
+    ).hexdigest()
+    em_cache, _ = _arquivo_em_cache(pasta_cache, f'completo_{assinatura_completo}', escrever_completo)
+    em_uso.add(em_cache)
+    shutil.copyfile(em_cache, f'{pasta_destino}/relatorio_mensal_completo.xlsx')
+    if ao_gerar:
+        ao_gerar(f'{pasta_destino}/relatorio_mensal_completo.xlsx')
+
+    _limpar_cache(pasta_cache, em_uso)
+    return arquivos_por_vendedor
+
+
+# ---------- TAREFA EM SEGUNDO PLANO ----------
+def gerar_pacote_relatorios(df_atual, df_anterior, data_limite, data_rotacao,
+                            pasta_destino='Relatorio_Rotação', progresso=None, motor='pandas'):
+    import queue
+    import threading
+    import zipfile
+
+    # Um diretório temporário por tarefa, para que sessões simultâneas não sobrescrevam o mesmo ZIP
+    # nem os arquivos que ainda vão entrar nele (os nomes só têm vendedor e data). Só o cache por
+    # conteúdo, em <pasta_destino>/_cache, é compartilhado entre as tarefas.
+    os.makedirs(PASTA_PACOTES, exist_ok=True)
+    limpar_pacotes()
+    pasta_tarefa = tempfile.mkdtemp(prefix='relatorios_', dir=PASTA_PACOTES)
+    zip_file_path = os.path.join(pasta_tarefa, "relatorios_rotacao.zip")
+    pasta_arquivos = os.path.join(pasta_tarefa, 'arquivos')
+
+    # Cada relatório entra no ZIP (DEFLATE) numa thread própria assim que fica pronto, enquanto o
+    # próximo vendedor já está sendo gerado; o zlib solta o GIL, então as duas etapas andam juntas.
+    # O arquivo vai direto para o disco, entrada por entrada, sem montar o pacote em memória.
+    fila = queue.Queue()
+    falhas = []
+
+    def compactar():
+        try:
+            with zipfile.ZipFile(zip_file_path, 'w', compression=zipfile.ZIP_DEFLATED,
+                                 compresslevel=NIVEL_COMPRESSAO_ZIP) as zipf:
+                while (caminho := fila.get()) is not None:
+                    zipf.write(caminho, os.path.basename(caminho))
+        except Exception as e:
+            falhas.append(e)
+            while fila.get() is not None:
+                pass
+
+    compactador = threading.Thread(target=compactar, name='compactar_relatorios')
+    compactador.start()
+    try:
+        gerar_relatorios(
+            df_atual=df_atual,
+            df_anterior=df_anterior,
+            data_limite=data_limite,
+            data_rotacao=data_rotacao,
+            pasta_destino=pasta_arquivos,
+            progresso=progresso,
+            ao_gerar=fila.put,
+            motor=motor,
+            pasta_cache=os.path.join(pasta_destino, PASTA_CACHE_RELATORIOS)
+        )
+    finally:
+        fila.put(None)
+        if progresso:
+            progresso(1, 1, "Finalizando o ZIP...")
+        compactador.join()
+        shutil.rmtree(pasta_arquivos, ignore_errors=True)
+    if falhas:
+        raise falhas[0]
+    return zip_file_path
+
+
+def descartar_pacote(zip_file_path):
+    # Remove o ZIP anterior da sessão (e o diretório temporário dele) antes de gerar outro
+    if zip_file_path and os.path.basename(os.path.dirname(zip_file_path)).startswith('relatorios_'):
+        shutil.rmtree(os.path.dirname(zip_file_path), ignore_errors=True)
+
+
+def limpar_pacotes(idade_maxima=IDADE_MAXIMA_PACOTE):
+    # Pasta de tarefa sem mudança há mais que idade_maxima; no Windows um ZIP ainda aberto
+    # num download não sai e fica para a próxima limpeza
+    limite = time.time() - idade_maxima
+    for nome in os.listdir(PASTA_PACOTES):
+        caminho = os.path.join(PASTA_PACOTES, nome)
+        if nome.startswith('relatorios_') and os.path.isdir(caminho) and os.path.getmtime(caminho) < limite:
+            shutil.rmtree(caminho, ignore_errors=True)
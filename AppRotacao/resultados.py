@@ -0,0 +1,115 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from snapshots import preparar_para_arrow
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+# Resultado de cada rodada gravado uma vez no servidor, numa pasta por id:
+#   resultados/<id>/rotacionadas.arrow, sobras.arrow, resumo.json (e os xlsx, gerados no 1º download)
+# As sessões guardam só o id e leem fatias por memory map; o arquivo é o mesmo para todas as abas
+# e réplicas do host.
+PASTA_RESULTADOS = os.environ.get('ROTACAO_RESULTADOS', os.path.join(PASTA_APP, 'resultados'))
+IDADE_MAXIMA_RESULTADO = int(os.environ.get('ROTACAO_RESULTADOS_IDADE_MAXIMA', 7 * 24 * 60 * 60))  # segundos
+TABELAS_ABERTAS_MAXIMO = 8
+
+_tabelas_abertas = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---------- GRAVAÇÃO ----------
+def salvar_resultado(tabelas, **dados):
+    # tabelas: {nome: DataFrame}. A pasta é montada ao lado e renomeada: quem lê nunca vê meio resultado.
+    import pyarrow as pa
+
+    id_resultado = uuid.uuid4().hex
+    os.makedirs(PASTA_RESULTADOS, exist_ok=True)
+    temporaria = os.path.join(PASTA_RESULTADOS, f'.{id_resultado}.tmp')
+    os.makedirs(temporaria)
+    for nome, df in tabelas.items():
+        tabela = pa.Table.from_pandas(preparar_para_arrow(df), preserve_index=False)
+        with pa.OSFile(os.path.join(temporaria, f'{nome}.arrow'), 'wb') as destino, \
+                pa.ipc.new_file(destino, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+    resumo = {
+        'id': id_resultado,
+        'criado_em': datetime.now().isoformat(timespec='seconds'),
+        'linhas': {nome: len(df) for nome, df in tabelas.items()},
+        **dados,
+    }
+    with open(os.path.join(temporaria, 'resumo.json'), 'w', encoding='utf-8') as f:
+        json.dump(resumo, f, ensure_ascii=False, default=str)
+    os.replace(temporaria, os.path.join(PASTA_RESULTADOS, id_resultado))
+    limpar_resultados()
+    return id_resultado
+
+
+def limpar_resultados(idade_maxima=IDADE_MAXIMA_RESULTADO):
+    # No Windows uma pasta com arquivo aberto por memory map não sai; fica para a próxima limpeza
+    limite = time.time() - idade_maxima
+    for nome in os.listdir(PASTA_RESULTADOS):
+        caminho = os.path.join(PASTA_RESULTADOS, nome)
+        if os.path.isdir(caminho) and os.path.getmtime(caminho) < limite:
+            shutil.rmtree(caminho, ignore_errors=True)
+
+
+# ---------- LEITURA ----------
+def _pasta(id_resultado):
+    # O id vem da sessão; só aceita o formato gerado aqui, sem caminhos
+    if not id_resultado or not all(c in '0123456789abcdef' for c in id_resultado):
+        raise ValueError(f"Resultado inválido: {id_resultado}")
+    return os.path.join(PASTA_RESULTADOS, id_resultado)
+
+
+def resumo_resultado(id_resultado):
+    try:
+        with open(os.path.join(_pasta(id_resultado), 'resumo.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _abrir(id_resultado, nome):
+    import pyarrow as pa
+
+    caminho = os.path.join(_pasta(id_resultado), f'{nome}.arrow')
+    with _lock:
+        tabela = _tabelas_abertas.pop(caminho, None)
+        if tabela is None:
+            tabela = pa.ipc.open_file(pa.memory_map(caminho, 'r')).read_all()
+        _tabelas_abertas[caminho] = tabela
+        while len(_tabelas_abertas) > TABELAS_ABERTAS_MAXIMO:
+            _tabelas_abertas.popitem(last=False)
+    return tabela
+
+
+def carregar_resultado(id_resultado, nome, colunas=None, inicio=0, quantidade=None, vendedores=None):
+    # Só a fatia pedida vira DataFrame; o resto continua no arquivo mapeado
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    tabela = _abrir(id_resultado, nome)
+    if vendedores is not None:
+        tabela = tabela.filter(pc.is_in(tabela['Nome_Vendedor'], value_set=pa.array(list(vendedores), pa.string())))
+    tabela = tabela.slice(inicio, quantidade)
+    if colunas is not None:
+        tabela = tabela.select(list(colunas))
+    return tabela.to_pandas()
+
+
+def arquivo_excel(id_resultado, nome):
+    # O xlsx de download é gerado uma vez por resultado e servido do disco a todas as sessões
+    caminho = os.path.join(_pasta(id_resultado), f'{nome}.xlsx')
+    if not os.path.exists(caminho):
+        import pandas as pd
+
+        temporario = os.path.join(_pasta(id_resultado), f'{nome}.{uuid.uuid4().hex}.tmp.xlsx')
+        with pd.ExcelWriter(temporario, engine='xlsxwriter') as writer:
+            carregar_resultado(id_resultado, nome).to_excel(writer, index=False, sheet_name='Planilha1')
+        os.replace(temporario, caminho)
+    return caminho
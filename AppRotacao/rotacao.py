@@ -0,0 +1,497 @@
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from banco_local import (lease, transacao, registrar_rotacoes, registrar_contas_rotacionadas,
+                         atualizar_agregados_rotacao, registrar_resultado_rodada, carregar_exclusoes)
+from snapshots import salvar_snapshot
+from execucoes import iniciar_execucao, etapa, finalizar_execucao
+from resultados import salvar_resultado
+
+
+# ---------- DATAS DE ENTRADA (a partir do histórico) ----------
+def calcular_datas_entrada(contas_id, vendedores, rotacoes, data_referencia):
+    # Para cada conta, na data de referência: a última rotação (qualquer vendedor) e a última
+    # rotação para o vendedor atual. A conta só "entrou na carteira" nessa data se depois dela
+    # não houve rotação para outro vendedor. Duas as-of joins ordenadas, sem loop por linha.
+    data_referencia = pd.Timestamp(data_referencia).normalize()
+    rotacoes = rotacoes.dropna(subset=['nome_vendedor'])
+    rotacoes = rotacoes[rotacoes['data_rotacao'] <= data_referencia]
+    # Vendedores viram códigos inteiros comuns aos dois lados (a chave "by" precisa do mesmo tipo)
+    codigos, _ = pd.factorize(np.concatenate([
+        np.asarray(vendedores, dtype=object), rotacoes['nome_vendedor'].to_numpy(dtype=object)
+    ]))
+    rotacoes = pd.DataFrame({
+        'conta_id': rotacoes['conta_id'].to_numpy(dtype=np.int64),
+        'vendedor': codigos[len(vendedores):],
+        'data_rotacao': rotacoes['data_rotacao'].to_numpy(dtype='datetime64[ns]'),
+    }).sort_values('data_rotacao', kind='stable')
+    contas = pd.DataFrame({
+        'conta_id': pd.to_numeric(pd.Series(contas_id), errors='coerce').fillna(-1).to_numpy(dtype=np.int64),
+        'vendedor': codigos[:len(vendedores)],
+        'data_referencia': np.full(len(vendedores), data_referencia.to_datetime64(), dtype='datetime64[ns]'),
+    })
+    ultima = pd.merge_asof(
+        contas, rotacoes[['conta_id', 'data_rotacao']],
+        left_on='data_referencia', right_on='data_rotacao', by='conta_id', direction='backward'
+    )
+    ultima_do_vendedor = pd.merge_asof(
+        contas, rotacoes,
+        left_on='data_referencia', right_on='data_rotacao', by=['conta_id', 'vendedor'], direction='backward'
+    )
+    # merge_asof preserva a ordem da esquerda, que já está na ordem de contas_id
+    data_ultima_rotacao = ultima['data_rotacao'].to_numpy()
+    data_entrada = ultima_do_vendedor['data_rotacao'].to_numpy()
+    data_entrada = np.where(data_entrada == data_ultima_rotacao, data_entrada, np.datetime64('NaT'))
+    return data_ultima_rotacao, data_entrada
+
+
+# ---------- EXCLUSÕES (vendedores que já tiveram a conta) ----------
+def montar_exclusoes(df_historico):
+    exclusoes = {}
+    if df_historico is None:
+        return exclusoes
+    for cnpj, vendedor in zip(df_historico['Raiz_CNPJ'], df_historico['Nome_Vendedor']):
+        exclusoes.setdefault(cnpj, set()).add(vendedor)
+    return exclusoes
+
+
+def _bloqueios(cnpjs, lista_vendedores, exclusoes, contas_id=None, exclusoes_historico=None):
+    # Matriz conta x vendedor (True = o vendedor já teve a conta), montada de uma vez para todos
+    # os vendedores: pelas exclusões por Raiz_CNPJ da extração e, se houver, pela matriz esparsa
+    # do histórico completo (banco_local.carregar_exclusoes), indexada por Conta_ID.
+    # Os pares (linha, coluna) saem de códigos e np.repeat, sem laço Python por par.
+    posicao = pd.Index(lista_vendedores)
+    bloqueado = np.zeros((len(cnpjs), len(lista_vendedores)), dtype=bool)
+
+    if exclusoes:
+        # Uma linha por Raiz_CNPJ distinta; só as chaves do dict presentes entre as contas são lidas
+        codigos_cnpj, unicos = pd.factorize(np.asarray(cnpjs, dtype=object), use_na_sentinel=False)
+        chaves = pd.Index(list(exclusoes), dtype=object)
+        linha_da_chave = pd.Index(unicos, dtype=object).get_indexer(chaves)
+        achadas = np.flatnonzero(linha_da_chave >= 0)
+        antigos = list(map(exclusoes.__getitem__, chaves[achadas]))
+        quantos = np.fromiter(map(len, antigos), dtype=np.int64, count=len(antigos))
+        colunas = posicao.get_indexer(list(chain.from_iterable(antigos)))
+        linhas = np.repeat(linha_da_chave[achadas], quantos)
+        valido = colunas >= 0
+        bloqueado_unico = np.zeros((len(unicos), len(lista_vendedores)), dtype=bool)
+        bloqueado_unico[linhas[valido], colunas[valido]] = True
+        bloqueado = bloqueado_unico[codigos_cnpj]
+
+    if exclusoes_historico is not None and contas_id is not None:
+        contas = pd.to_numeric(pd.Series(contas_id), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        indice = exclusoes_historico['contas']
+        inicio = exclusoes_historico['inicio']
+        pos = np.searchsorted(indice, contas)
+        achou = pos < len(indice)
+        achou[achou] = indice[pos[achou]] == contas[achou]
+        linhas = np.flatnonzero(achou)
+        # Expande as fatias [inicio, fim) das contas encontradas sem loop
+        primeiro = inicio[pos[linhas]]
+        quantos = inicio[pos[linhas] + 1] - primeiro
+        deslocamento = np.arange(quantos.sum()) - np.repeat(np.cumsum(quantos) - quantos, quantos)
+        codigos = exclusoes_historico['vendedores'][np.repeat(primeiro, quantos) + deslocamento]
+        coluna_do_codigo = posicao.get_indexer(exclusoes_historico['nomes'])
+        colunas = coluna_do_codigo[codigos]
+        valido = colunas >= 0
+        bloqueado[np.repeat(linhas, quantos)[valido], colunas[valido]] = True
+    return bloqueado
+
+
+def _classes_permitidas(cnpjs, lista_vendedores, exclusoes, contas_id=None, exclusoes_historico=None):
+    # Contas com o mesmo conjunto de vendedores permitidos formam uma classe: devolve a classe de
+    # cada conta e a linha da matriz de permitidos de cada classe (linhas comparadas como bytes)
+    permitido = ~_bloqueios(cnpjs, lista_vendedores, exclusoes, contas_id, exclusoes_historico)
+    linhas = np.packbits(permitido, axis=1, bitorder='little')
+    linhas = np.ascontiguousarray(linhas).view(np.dtype((np.void, linhas.shape[1]))).reshape(-1)
+    codigos, combinacoes = pd.factorize(linhas)
+    primeira = np.empty(len(combinacoes), dtype=np.int64)
+    primeira[codigos[::-1]] = np.arange(len(codigos))[::-1]
+    return codigos, permitido[primeira]
+
+
+def _mascaras_permitidas(cnpjs, lista_vendedores, exclusoes, contas_id=None, exclusoes_historico=None):
+    # Cada conta vira uma máscara de bits com os vendedores que podem recebê-la; só as
+    # combinações distintas passam por int (Python, para qualquer número de vendedores)
+    codigos, permitido = _classes_permitidas(cnpjs, lista_vendedores, exclusoes, contas_id, exclusoes_historico)
+    linhas = np.packbits(permitido, axis=1, bitorder='little')
+    valores = np.empty(len(linhas), dtype=object)
+    valores[:] = [int.from_bytes(linha.tobytes(), 'little') for linha in linhas]
+    return valores[codigos]
+
+
+# ---------- FLUXO MÁXIMO (classes de contas x vendedores) ----------
+def _fluxo_maximo(demandas, permitidos, capacidades):
+    # Contas com o mesmo conjunto de vendedores permitidos são intercambiáveis,
+    # então o grafo bipartido é reduzido a classes -> vendedores -> capacidade.
+    n_vend = len(capacidades)
+    residual_classe = list(demandas)
+    residual_vend = list(capacidades)
+    fluxo = [dict() for _ in demandas]
+    classes_no_vendedor = [set() for _ in range(n_vend)]
+
+    # Solução gulosa inicial: classes mais restritas primeiro, vendedor mais folgado
+    # (max a cada passo em vez de ordenar os vendedores da classe: quase toda classe para no primeiro)
+    for k in sorted(range(len(demandas)), key=lambda k: len(permitidos[k])):
+        while residual_classe[k] > 0 and permitidos[k]:
+            s = max(permitidos[k], key=residual_vend.__getitem__)
+            q = min(residual_classe[k], residual_vend[s])
+            if q == 0:
+                break
+            fluxo[k][s] = fluxo[k].get(s, 0) + q
+            classes_no_vendedor[s].add(k)
+            residual_classe[k] -= q
+            residual_vend[s] -= q
+
+    # Caminhos aumentantes (Edmonds-Karp) a partir de todas as classes com sobra
+    while any(residual_vend):  # com todos os vendedores cheios não há caminho
+        origem_vend = [None] * n_vend
+        origem_classe = {}
+        fila = deque()
+        for k, r in enumerate(residual_classe):
+            if r > 0:
+                origem_classe[k] = None
+                fila.append(k)
+        destino = None
+        while fila and destino is None:
+            k = fila.popleft()
+            for s in permitidos[k]:
+                if origem_vend[s] is not None:
+                    continue
+                origem_vend[s] = k
+                if residual_vend[s] > 0:
+                    destino = s
+                    break
+                for k2 in classes_no_vendedor[s]:
+                    if k2 not in origem_classe:
+                        origem_classe[k2] = s
+                        fila.append(k2)
+        if destino is None:
+            break
+
+        # Reconstrói o caminho e aplica o gargalo
+        caminho = []
+        s = destino
+        while True:
+            k = origem_vend[s]
+            caminho.append((k, s))
+            s_anterior = origem_classe[k]
+            if s_anterior is None:
+                break
+            caminho.append((k, s_anterior, 'reverso'))
+            s = s_anterior
+        gargalo = min(residual_vend[destino], residual_classe[caminho[-1][0]])
+        for passo in caminho:
+            if len(passo) == 3:
+                gargalo = min(gargalo, fluxo[passo[0]][passo[1]])
+        for passo in caminho:
+            k, s = passo[0], passo[1]
+            if len(passo) == 3:
+                fluxo[k][s] -= gargalo
+                if fluxo[k][s] == 0:
+                    del fluxo[k][s]
+                    classes_no_vendedor[s].discard(k)
+            else:
+                fluxo[k][s] = fluxo[k].get(s, 0) + gargalo
+                classes_no_vendedor[s].add(k)
+        residual_vend[destino] -= gargalo
+        residual_classe[caminho[-1][0]] -= gargalo
+
+    return fluxo, sum(demandas) - sum(residual_classe)
+
+
+# ---------- MOTOR DE ATRIBUIÇÃO ----------
+def atribuir_contas(cnpjs, lista_vendedores, exclusoes, limite_por_vendedor=50,
+                    metodo='otimo', carga_atual=None, seed=None, contas_id=None, exclusoes_historico=None):
+    # Retorna, para cada conta, a posição do vendedor escolhido em lista_vendedores (-1 = sobra)
+    rng = np.random.default_rng(seed)
+    n_vend = len(lista_vendedores)
+    destino = np.full(len(cnpjs), -1, dtype=np.int64)
+    if n_vend == 0 or len(cnpjs) == 0:
+        return destino
+
+    if metodo == 'guloso':
+        mascaras = _mascaras_permitidas(cnpjs, lista_vendedores, exclusoes, contas_id, exclusoes_historico)
+        # Comportamento antigo: ordem da base e sorteio entre os candidatos livres
+        contagem = np.zeros(n_vend, dtype=np.int64)
+        for i, mascara in enumerate(mascaras):
+            candidatos = [s for s in range(n_vend) if mascara >> s & 1 and contagem[s] < limite_por_vendedor]
+            if candidatos:
+                escolhido = rng.choice(candidatos)
+                contagem[escolhido] += 1
+                destino[i] = escolhido
+        return destino
+
+    # Agrupa contas por conjunto de vendedores permitidos; os vendedores de cada classe, na ordem
+    # sorteada, saem de uma vez da matriz das classes (np.nonzero) e são fatiados por classe
+    inverso, permitido_classes = _classes_permitidas(cnpjs, lista_vendedores, exclusoes, contas_id,
+                                                     exclusoes_historico)
+    demandas = np.bincount(inverso)
+    ordem_vend = rng.permutation(n_vend)
+    classe, coluna = np.nonzero(permitido_classes[:, ordem_vend])
+    vendedores_classe = ordem_vend[coluna].tolist()
+    fim = np.cumsum(np.bincount(classe, minlength=len(demandas))).tolist()
+    permitidos = [vendedores_classe[a:b] for a, b in zip([0] + fim[:-1], fim)]
+    inicio_classe = np.cumsum(demandas) - demandas
+    demandas = demandas.tolist()
+
+    capacidades = [limite_por_vendedor] * n_vend
+    fluxo, total = _fluxo_maximo(demandas, permitidos, capacidades)
+
+    if carga_atual is not None:
+        # Balanceamento: menor nível L tal que cada vendedor receba até L - carteira atual
+        # sem perder nenhuma conta em relação ao fluxo máximo.
+        carga = np.array([carga_atual.get(v, 0) for v in lista_vendedores], dtype=np.int64)
+
+        def capacidades_no_nivel(nivel):
+            return np.clip(nivel - carga, 0, limite_por_vendedor)
+
+        # Abaixo do nível em que a soma das capacidades cobre o total não há solução (só numpy);
+        # o fluxo confere a partir dele, dobrando o passo, e a busca binária fecha o intervalo.
+        # Quase sempre o nível fica nesse limite ou logo acima: um ou dois fluxos em vez de ~log2.
+        baixo, alto = int(carga.min()), int(carga.max()) + limite_por_vendedor  # no alto cabe tudo
+        while baixo < alto:
+            nivel = (baixo + alto) // 2
+            if capacidades_no_nivel(nivel).sum() >= total:
+                alto = nivel
+            else:
+                baixo = nivel + 1
+        teto, passo = int(carga.max()) + limite_por_vendedor, 1
+        while True:
+            fluxo_nivel, colocadas = _fluxo_maximo(demandas, permitidos, capacidades_no_nivel(alto).tolist())
+            if colocadas == total or alto == teto:
+                break
+            baixo, alto, passo = alto + 1, min(alto + passo, teto), passo * 2
+        fluxo = fluxo_nivel
+        while baixo < alto:
+            nivel = (baixo + alto) // 2
+            fluxo_nivel, colocadas = _fluxo_maximo(demandas, permitidos, capacidades_no_nivel(nivel).tolist())
+            if colocadas == total:
+                alto, fluxo = nivel, fluxo_nivel
+            else:
+                baixo = nivel + 1
+
+    # Distribui as contas de cada classe conforme o fluxo, com desempate sorteado: as contas são
+    # embaralhadas uma vez e agrupadas por classe (ordenação estável); cada aresta classe -> vendedor
+    # do fluxo leva a sua fatia da classe
+    embaralhadas = rng.permutation(len(cnpjs))
+    ordem = embaralhadas[np.argsort(inverso[embaralhadas], kind='stable')]
+    arestas = [(k, s, q) for k, saidas in enumerate(fluxo) for s, q in saidas.items()]
+    if arestas:
+        classe, vendedor, quantidade = np.array(arestas, dtype=np.int64).T
+        antes = np.cumsum(quantidade) - quantidade
+        # Início da aresta dentro da classe: o que as arestas anteriores da mesma classe já levaram
+        posicao = inicio_classe[classe] + antes - antes[np.searchsorted(classe, classe)]
+        deslocamento = np.arange(quantidade.sum()) - np.repeat(antes, quantidade)
+        destino[ordem[np.repeat(posicao, quantidade) + deslocamento]] = np.repeat(vendedor, quantidade)
+    return destino
+
+
+# ---------- FUNÇÃO DE ROTAÇÃO ----------
+def rotacionar_contas(df_contas, lista_vendedores, df_historico, limite_por_vendedor=50,
+                      metodo='otimo', carga_atual=None, seed=None, registrar=True,
+                      versao_historico=None, progresso=None, execucao=None, lote_id=None,
+                      exclusoes_historico=None, data_rotacao=None, ao_registrar=None):
+    # execucao: registro da rodada (execucoes.iniciar_execucao) que recebe os tempos das etapas.
+    # lote_id marca as linhas gravadas no histórico (por padrão, o id da execução) para reverter_lote.
+    # exclusoes_historico: matriz de banco_local.carregar_exclusoes; a conta também não volta para
+    # nenhum vendedor que já a recebeu em qualquer rotação registrada.
+    # data_rotacao: data-base da rodada (pipeline.datas_da_rodada); sem ela, a data de hoje.
+    # ao_registrar(conn, df_rotacionadas, df_sobras): grava o que mais for da rodada na mesma
+    # transação do histórico (tudo ou nada).
+    lista_vendedores = list(lista_vendedores)
+    # df_historico pode vir já convertido em {Raiz_CNPJ: {vendedores}} (ex.: simulação)
+    if isinstance(df_historico, dict):
+        exclusoes = df_historico
+    else:
+        with etapa(execucao, 'exclusoes'):
+            exclusoes = montar_exclusoes(df_historico)
+    with etapa(execucao, 'atribuicao'):
+        destino = atribuir_contas(
+            df_contas['Raiz_CNPJ'].to_numpy(), lista_vendedores, exclusoes,
+            limite_por_vendedor=limite_por_vendedor, metodo=metodo,
+            carga_atual=carga_atual, seed=seed,
+            contas_id=df_contas['Conta_ID'].to_numpy(), exclusoes_historico=exclusoes_historico
+        )
+
+    data_hoje = _data_da_rodada(data_rotacao)
+    posicoes = np.flatnonzero(destino >= 0)
+    posicoes_sobras = np.flatnonzero(destino < 0)
+    nomes = np.asarray(lista_vendedores, dtype=object)
+
+    def separar():
+        # Só as linhas de saída são materializadas (take), sem copiar df_contas inteiro;
+        # as colunas alteradas são atribuídas de uma vez no resultado, que já é um frame novo.
+        df_rotacionadas = df_contas.take(posicoes).reset_index(drop=True)
+        df_rotacionadas['Nome_Vendedor'] = nomes[destino[posicoes]]
+        df_rotacionadas['Data_Entrou_Carteira'] = data_hoje
+        return df_rotacionadas, df_contas.take(posicoes_sobras).reset_index(drop=True)
+
+    if not registrar:
+        return separar()
+
+    # Registrar histórico no banco (uma transação, junto com o que ao_registrar gravar; contas já
+    # rotacionadas por outra sessão viram sobra)
+    if progresso:
+        progresso(0, 1, f"Registrando histórico de {len(posicoes)} contas...")
+    contas_id = df_contas['Conta_ID'].to_numpy()[posicoes].astype(np.int64)
+    linhas = [
+        (novo_vendedor, int(conta_id), 'Automática', data_hoje.strftime('%Y-%m-%d'))
+        for novo_vendedor, conta_id in zip(nomes[destino[posicoes]], contas_id)
+    ]
+    if lote_id is None:
+        lote_id = execucao['id'] if execucao is not None else uuid.uuid4().hex
+    with transacao() as conn:
+        with etapa(execucao, 'registro_historico'):
+            conflitos = registrar_rotacoes(linhas, versao_lida=versao_historico, lote_id=lote_id, conn=conn)
+        if execucao is not None:
+            execucao['conflitos'] = len(conflitos)
+        if conflitos:
+            em_conflito = np.isin(contas_id, list(conflitos))
+            posicoes_sobras = np.sort(np.concatenate([posicoes_sobras, posicoes[em_conflito]]))
+            posicoes = posicoes[~em_conflito]
+        df_rotacionadas, df_sobras = separar()
+        if ao_registrar:
+            ao_registrar(conn, df_rotacionadas, df_sobras)
+    return df_rotacionadas, df_sobras
+
+
+def _data_da_rodada(data_rotacao):
+    return pd.Timestamp(data_rotacao if data_rotacao is not None else pd.Timestamp.today()).normalize()
+
+
+# ---------- TAREFA EM SEGUNDO PLANO ----------
+def executar_rotacao(df_contas, lista_vendedores, df_historico, grupo, versao_historico=None,
+                     carga_atual=None, seed=None, progresso=None, exclusoes_historico=None, data_rotacao=None):
+    # Uma rodada por grupo de vendedores; Distribuição e Corporativo podem rodar ao mesmo tempo.
+    # Cada rodada, com ou sem erro, deixa um registro com tempos por etapa e contagens (execucoes.py).
+    data_rotacao = _data_da_rodada(data_rotacao)
+    execucao = iniciar_execucao(
+        grupo, candidatas=len(df_contas), vendedores=len(lista_vendedores), seed=seed,
+        versao_historico=versao_historico, balanceada=carga_atual is not None,
+        data_rotacao=data_rotacao.strftime('%Y-%m-%d')
+    )
+    def gravar_rodada(conn, contas_rotacionadas, contas_sobras):
+        # Na transação do histórico e ainda sob o lease: agregados e contas rotacionadas entram junto
+        # com o histórico ou nada entra, e reverter_lote sempre encontra as linhas substituídas
+        with etapa(execucao, 'agregados'):
+            registrar_resultado_rodada(
+                data_rotacao.strftime('%Y-%m'), grupo, len(df_contas), len(contas_rotacionadas), conn=conn
+            )
+            atualizar_agregados_rotacao(conn=conn)
+        if progresso:
+            progresso(1, 1, "Gravando contas rotacionadas...")
+        with etapa(execucao, 'contas_rotacionadas'):
+            registrar_contas_rotacionadas(contas_rotacionadas, lote_id=execucao['id'], conn=conn)
+
+    try:
+        if exclusoes_historico is None:
+            with etapa(execucao, 'exclusoes_historico'):
+                exclusoes_historico = carregar_exclusoes()
+        with lease(f"grupo:{grupo}"):
+            if progresso:
+                progresso(0, 1, f"Distribuindo {len(df_contas)} contas entre {len(lista_vendedores)} vendedores...")
+            contas_rotacionadas, contas_sobras = rotacionar_contas(
+                df_contas, lista_vendedores, df_historico,
+                carga_atual=carga_atual,
+                seed=seed,
+                versao_historico=versao_historico,
+                progresso=progresso,
+                execucao=execucao,
+                exclusoes_historico=exclusoes_historico,
+                data_rotacao=data_rotacao,
+                ao_registrar=gravar_rodada
+            )
+        colocadas = contas_rotacionadas['Nome_Vendedor'].value_counts()
+        execucao['colocadas'] = len(contas_rotacionadas)
+        execucao['sobras'] = len(contas_sobras)
+        execucao['colocadas_por_vendedor'] = {v: int(colocadas.get(v, 0)) for v in lista_vendedores}
+        if carga_atual is not None:
+            execucao['carga_por_vendedor'] = {
+                v: int(carga_atual.get(v, 0)) + int(colocadas.get(v, 0)) for v in lista_vendedores
+            }
+
+        # Retrato da atribuição desta rodada, para comparações futuras sem depender do SQL Server
+        with etapa(execucao, 'snapshot'):
+            salvar_snapshot(contas_rotacionadas, 'atribuicao', rotulo=grupo, data_referencia=data_rotacao)
+    except Exception as e:
+        finalizar_execucao(execucao, erro=e)
+        raise
+    finalizar_execucao(execucao)
+    return contas_rotacionadas, contas_sobras
+
+
+# ---------- VÁRIOS GRUPOS NA MESMA PASSADA ----------
+def executar_rotacao_grupos(grupos, df_historico, versao_historico=None, carga_atual=None, seed=None,
+                            progresso=None, data_rotacao=None, falhas=None):
+    # grupos: {nome do grupo: (df_contas, lista_vendedores)}. As contas vêm de uma partição da mesma
+    # base enriquecida, então os grupos nunca disputam a mesma conta; cada um grava o histórico na sua
+    # própria transação, sob o seu lease, com a mesma versão lida do histórico.
+    # Um grupo que falha (ex.: lease de outra sessão) não desfaz os que já gravaram: com falhas={} o erro
+    # de cada grupo vai para o dict e voltam só os grupos gravados; sem ele, o primeiro erro sobe.
+    exclusoes = df_historico if isinstance(df_historico, dict) else montar_exclusoes(df_historico)
+    exclusoes_historico = carregar_exclusoes()
+    data_rotacao = _data_da_rodada(data_rotacao)  # a mesma para todos os grupos, mesmo virando o dia
+    andamento = dict.fromkeys(grupos, 0.0)
+    lock_andamento = threading.Lock()
+
+    def progresso_do_grupo(grupo):
+        def atualizar(feito, total, mensagem=''):
+            with lock_andamento:
+                andamento[grupo] = feito / total if total else 1.0
+                if progresso:
+                    progresso(sum(andamento.values()), len(andamento), f"{grupo}: {mensagem}")
+        return atualizar
+
+    with ThreadPoolExecutor(max_workers=len(grupos), thread_name_prefix='grupo') as executor:
+        futuros = {
+            grupo: executor.submit(
+                executar_rotacao, df_contas, lista_vendedores, exclusoes, grupo,
+                versao_historico=versao_historico,
+                carga_atual=carga_atual,
+                seed=seed,
+                progresso=progresso_do_grupo(grupo),
+                exclusoes_historico=exclusoes_historico,
+                data_rotacao=data_rotacao
+            )
+            for grupo, (df_contas, lista_vendedores) in grupos.items()
+        }
+        resultados = []
+        for grupo, futuro in futuros.items():
+            try:
+                resultados.append(futuro.result())
+            except Exception as e:
+                if falhas is None:
+                    raise
+                falhas[grupo] = e
+
+    if not resultados:
+        # Nenhum grupo gravou nada: a rodada inteira falhou
+        raise next(iter(falhas.values()))
+    contas_rotacionadas = pd.concat([r for r, _ in resultados], ignore_index=True)
+    contas_sobras = pd.concat([s for _, s in resultados], ignore_index=True)
+    return contas_rotacionadas, contas_sobras
+
+
+def executar_rotacao_guardada(grupos, df_historico, progresso=None, data_rotacao=None, **opcoes):
+    # Para o app: o resultado vai para o armazenamento do servidor (resultados.py) e a tarefa
+    # devolve só o id, que é o que a sessão guarda. Se só parte dos grupos gravou, o resultado
+    # guarda esses grupos e o erro de cada um dos outros.
+    data_rotacao = _data_da_rodada(data_rotacao)
+    falhas = {}
+    contas_rotacionadas, contas_sobras = executar_rotacao_grupos(
+        grupos, df_historico, progresso=progresso, data_rotacao=data_rotacao, falhas=falhas, **opcoes
+    )
+    gravados = [grupo for grupo in grupos if grupo not in falhas]
+    return salvar_resultado(
+        {'rotacionadas': contas_rotacionadas, 'sobras': contas_sobras},
+        grupos=gravados, candidatas=sum(len(grupos[grupo][0]) for grupo in gravados),
+        data_rotacao=data_rotacao.strftime('%Y-%m-%d'),
+        falhas={grupo: str(erro) for grupo, erro in falhas.items()}
+    )
@@ -0,0 +1,119 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from banco_local import ler_exclusoes
+from rotacao import montar_exclusoes, rotacionar_contas
+
+COLUNAS_SIMULACAO = ['Conta_ID', 'Raiz_CNPJ', 'Nome_Vendedor', 'Data_Entrou_Carteira']
+
+# Estado de cada processo do pool (carregado uma vez no initializer)
+_contas = None
+_historico = None
+_exclusoes_historico = None
+
+
+def _iniciar_worker(df_contas, df_historico, exclusoes_historico=None):
+    global _contas, _historico, _exclusoes_historico
+    _contas = df_contas
+    _historico = df_historico
+    _exclusoes_historico = exclusoes_historico
+
+
+# ---------- UMA RODADA (dry-run, sem gravar histórico) ----------
+def simular_rodada(df_contas, lista_vendedores, df_historico, limite_por_vendedor, seed,
+                   metodo='otimo', fracao_candidatos=1.0, prob_ausencia=0.0, exclusoes_historico=None):
+    rng = np.random.default_rng(seed)
+
+    contas = df_contas
+    if fracao_candidatos < 1.0:
+        n = int(round(len(df_contas) * fracao_candidatos))
+        contas = df_contas.iloc[np.sort(rng.choice(len(df_contas), size=n, replace=False))]
+
+    vendedores = list(lista_vendedores)
+    if prob_ausencia > 0:
+        vendedores = [v for v in vendedores if rng.random() >= prob_ausencia]
+
+    df_rotacionadas, df_sobras = rotacionar_contas(
+        contas, vendedores, df_historico,
+        limite_por_vendedor=limite_por_vendedor,
+        metodo=metodo,
+        seed=int(rng.integers(2**32)),
+        registrar=False,
+        exclusoes_historico=exclusoes_historico
+    )
+    return {
+        'Vendedores_Presentes': len(vendedores),
+        'Candidatas': len(contas),
+        'Colocadas': len(df_rotacionadas),
+        'Sobras': len(df_sobras),
+    }
+
+
+def _rodar_lote(tarefas):
+    resultados = []
+    for grupo, lista_vendedores, limite, seed, metodo, fracao, ausencia in tarefas:
+        resultado = simular_rodada(_contas, lista_vendedores, _historico, limite, seed,
+                                   metodo=metodo, fracao_candidatos=fracao, prob_ausencia=ausencia,
+                                   exclusoes_historico=_exclusoes_historico)
+        resultado.update({'Grupo': grupo, 'Limite': limite, 'Seed': seed})
+        resultados.append(resultado)
+    return resultados
+
+
+# ---------- MONTE CARLO (várias rodadas em paralelo) ----------
+def simular_capacidade(df_contas, grupos_vendedores, df_historico, limites, n_rodadas=200,
+                       metodo='otimo', fracao_candidatos=1.0, prob_ausencia=0.0,
+                       seed=0, max_workers=None):
+    # grupos_vendedores: {'nome do cenário': [vendedores]}
+    contas = df_contas[COLUNAS_SIMULACAO]
+    historico = montar_exclusoes(df_historico)
+    exclusoes_historico = ler_exclusoes()  # dry-run: não atualiza a tabela de exclusões
+
+    seeds = np.random.SeedSequence(seed).generate_state(n_rodadas).tolist()
+    tarefas = [
+        (grupo, list(vendedores), int(limite), s, metodo, fracao_candidatos, prob_ausencia)
+        for grupo, vendedores in grupos_vendedores.items()
+        for limite in limites
+        for s in seeds
+    ]
+
+    max_workers = max_workers or os.cpu_count() or 1
+    tamanho_lote = max(1, len(tarefas) // (max_workers * 4))
+    lotes = [tarefas[i:i + tamanho_lote] for i in range(0, len(tarefas), tamanho_lote)]
+
+    resultados = []
+    if max_workers == 1:
+        _iniciar_worker(contas, historico, exclusoes_historico)
+        for lote in lotes:
+            resultados.extend(_rodar_lote(lote))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_iniciar_worker,
+            initargs=(contas, historico, exclusoes_historico)
+        ) as executor:
+            for parcial in executor.map(_rodar_lote, lotes):
+                resultados.extend(parcial)
+
+    df_resultados = pd.DataFrame(resultados)
+    df_resultados['Taxa_Sobra'] = (df_resultados['Sobras'] / df_resultados['Candidatas']).fillna(0)
+    return df_resultados
+
+
+def resumir_simulacao(df_resultados):
+    resumo = df_resultados.groupby(['Grupo', 'Limite']).agg(
+        Rodadas=('Seed', 'size'),
+        Colocadas_Media=('Colocadas', 'mean'),
+        Colocadas_P5=('Colocadas', lambda x: x.quantile(0.05)),
+        Colocadas_P95=('Colocadas', lambda x: x.quantile(0.95)),
+        Sobras_Media=('Sobras', 'mean'),
+        Sobras_P5=('Sobras', lambda x: x.quantile(0.05)),
+        Sobras_P95=('Sobras', lambda x: x.quantile(0.95)),
+        Taxa_Sobra_Media=('Taxa_Sobra', 'mean'),
+    )
+    return resumo.round(2).reset_index()
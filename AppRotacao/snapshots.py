@@ -0,0 +1,168 @@
+import os
+import re
+import unicodedata
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+PASTA_APP = os.path.dirname(os.path.abspath(__file__))
+# Retratos mensais em Parquet, particionados por tipo e mês:
+#   snapshots/tipo=extracao/mes=2025-03/20250320T101500_Distribuicao.parquet
+PASTA_SNAPSHOTS = os.environ.get('ROTACAO_SNAPSHOTS', os.path.join(PASTA_APP, 'snapshots'))
+COMPRESSAO = 'zstd'
+
+TIPOS_SNAPSHOT = ('extracao', 'atribuicao')
+
+COLUNAS_DIFF = ('Nome_Vendedor', 'Status_Cliente', 'Faturamento_6_Meses', 'Data_Entrou_Carteira')
+
+
+def _rotulo(texto):
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^0-9A-Za-z]+', '_', str(texto)).strip('_') or 'geral'
+
+
+def preparar_para_arrow(df):
+    # Colunas object com tipos misturados (ex.: Grupo_Econômico_ID com '' e números) não têm
+    # tipo Arrow; viram texto, preservando os nulos.
+    convertidas = {}
+    for coluna in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[coluna], skipna=True).startswith('mixed'):
+            convertidas[coluna] = df[coluna].astype('string')
+    return df.assign(**convertidas) if convertidas else df
+
+
+# ---------- GRAVAÇÃO ----------
+def _caminho_snapshot(tipo, rotulo, data_referencia):
+    if tipo not in TIPOS_SNAPSHOT:
+        raise ValueError(f"Tipo de snapshot inválido: {tipo}")
+    agora = pd.Timestamp(datetime.now())
+    momento = pd.Timestamp(data_referencia) if data_referencia is not None else agora
+    if momento == momento.normalize():
+        # Só a data-base da rodada: vale para a partição do mês e o dia; a hora de agora mantém
+        # nomes distintos para várias rodadas na mesma data-base
+        momento += agora - agora.normalize()
+    pasta = os.path.join(PASTA_SNAPSHOTS, f'tipo={tipo}', f'mes={momento.strftime("%Y-%m")}')
+    os.makedirs(pasta, exist_ok=True)
+    return os.path.join(pasta, f'{momento.strftime("%Y%m%dT%H%M%S")}_{_rotulo(rotulo)}.parquet')
+
+
+def salvar_snapshot(df, tipo, rotulo='', data_referencia=None):
+    caminho = _caminho_snapshot(tipo, rotulo, data_referencia)
+    # Grava num temporário e renomeia: quem lista os snapshots nunca vê um arquivo pela metade
+    temporario = caminho + '.tmp'
+    preparar_para_arrow(df).to_parquet(temporario, engine='pyarrow', compression=COMPRESSAO, index=False)
+    os.replace(temporario, caminho)
+    return caminho
+
+
+def salvar_snapshot_partes(partes, tipo, rotulo='', data_referencia=None):
+    # Junta as partes Parquet do modo em lotes num único snapshot, um row group por parte,
+    # sem carregar a base inteira. Coluna vazia num lote (tipo nulo) assume o tipo dos outros.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    caminho = _caminho_snapshot(tipo, rotulo, data_referencia)
+    esquema = pa.unify_schemas(
+        [pq.read_schema(parte).remove_metadata() for parte in partes], promote_options='permissive'
+    )
+    temporario = caminho + '.tmp'
+    with pq.ParquetWriter(temporario, esquema, compression=COMPRESSAO) as escritor:
+        for parte in partes:
+            escritor.write_table(pq.read_table(parte).select(esquema.names).replace_schema_metadata(None).cast(esquema))
+    os.replace(temporario, caminho)
+    return caminho
+
+
+# ---------- LEITURA ----------
+def listar_snapshots(tipo=None):
+    linhas = []
+    tipos = [tipo] if tipo else TIPOS_SNAPSHOT
+    for t in tipos:
+        pasta_tipo = os.path.join(PASTA_SNAPSHOTS, f'tipo={t}')
+        if not os.path.isdir(pasta_tipo):
+            continue
+        for pasta_mes in sorted(os.listdir(pasta_tipo)):
+            if not pasta_mes.startswith('mes='):
+                continue
+            for arquivo in sorted(os.listdir(os.path.join(pasta_tipo, pasta_mes))):
+                if not arquivo.endswith('.parquet'):
+                    continue
+                momento, _, rotulo = arquivo[:-len('.parquet')].partition('_')
+                linhas.append({
+                    'tipo': t,
+                    'mes': pasta_mes[len('mes='):],
+                    'momento': pd.to_datetime(momento, format='%Y%m%dT%H%M%S', errors='coerce'),
+                    'rotulo': rotulo,
+                    'caminho': os.path.join(pasta_tipo, pasta_mes, arquivo),
+                })
+    snapshots = pd.DataFrame(linhas, columns=['tipo', 'mes', 'momento', 'rotulo', 'caminho'])
+    return snapshots.sort_values('momento', ascending=False, ignore_index=True)
+
+
+def carregar_snapshot(caminho, colunas=None, filtros=None):
+    # Leitura colunar: só as colunas pedidas saem do disco; filtros no formato do pyarrow
+    # (ex.: [('Nome_Vendedor', '==', 'Fulano')]) descartam row groups antes de montar o frame.
+    return pd.read_parquet(caminho, engine='pyarrow', columns=list(colunas) if colunas else None,
+                           filters=filtros)
+
+
+def ler_snapshot_em_lotes(caminho, linhas_por_lote=100_000):
+    # Para o modo em lotes: a extração salva volta como entrada sem carregar o arquivo inteiro
+    import pyarrow.parquet as pq
+
+    for lote in pq.ParquetFile(caminho).iter_batches(batch_size=linhas_por_lote):
+        yield lote.to_pandas()
+
+
+# ---------- DIFERENÇA ENTRE SNAPSHOTS ----------
+def comparar_snapshots(antigo, novo, chave='Raiz_CNPJ', colunas=COLUNAS_DIFF):
+    # antigo/novo: caminho de um snapshot ou um DataFrame já carregado
+    def ler(origem):
+        if isinstance(origem, pd.DataFrame):
+            disponiveis = [c for c in colunas if c in origem.columns]
+            frame = origem[[chave] + disponiveis]
+        else:
+            import pyarrow.parquet as pq
+            existentes = set(pq.read_schema(origem).names)
+            frame = carregar_snapshot(origem, [chave] + [c for c in colunas if c in existentes])
+        return frame.drop_duplicates(subset=chave)
+
+    antes, depois = ler(antigo), ler(novo)
+    comuns = [c for c in colunas if c in antes.columns and c in depois.columns]
+    unido = antes[[chave] + comuns].merge(
+        depois[[chave] + comuns], on=chave, how='outer', suffixes=('_antes', '_depois'), indicator=True
+    )
+
+    lado = unido.pop('_merge').to_numpy()
+    alteradas = {}
+    for coluna in comuns:
+        a, d = unido[f'{coluna}_antes'], unido[f'{coluna}_depois']
+        alteradas[coluna] = ((a != d) & ~(a.isna() & d.isna())).to_numpy() & (lado == 'both')
+
+    vendedor = alteradas.get('Nome_Vendedor', np.zeros(len(unido), dtype=bool))
+    outras = np.zeros(len(unido), dtype=bool)
+    descricao = np.full(len(unido), '', dtype=object)
+    for coluna, mascara in alteradas.items():
+        descricao = np.where(mascara, descricao + coluna + ', ', descricao)
+        if coluna != 'Nome_Vendedor':
+            outras |= mascara
+    unido.insert(1, 'Mudanca', np.select(
+        [lado == 'left_only', lado == 'right_only', vendedor, outras],
+        ['Saiu', 'Entrou', 'Trocou de vendedor', 'Alterada'],
+        default=''
+    ))
+    unido.insert(2, 'Colunas_Alteradas', pd.Series(descricao, index=unido.index).str.rstrip(', '))
+    return unido[unido['Mudanca'] != ''].reset_index(drop=True)
+
+
+def resumir_diferencas(diferencas):
+    resumo = diferencas['Mudanca'].value_counts().rename_axis('Mudanca').reset_index(name='Contas')
+    if 'Nome_Vendedor_depois' in diferencas:
+        trocas = diferencas[diferencas['Mudanca'] == 'Trocou de vendedor']
+        por_vendedor = pd.concat([
+            trocas['Nome_Vendedor_antes'].value_counts().rename('Perdeu'),
+            trocas['Nome_Vendedor_depois'].value_counts().rename('Recebeu'),
+        ], axis=1).fillna(0).astype(int)
+        return resumo, por_vendedor.rename_axis('Nome_Vendedor').reset_index()
+    return resumo, pd.DataFrame(columns=['Nome_Vendedor', 'Perdeu', 'Recebeu'])
@@ -0,0 +1,72 @@
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# O módulo fica em sys.modules entre os reruns do Streamlit, então o pool e o
+# armazenamento de tarefas são compartilhados por todas as sessões do processo.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rotacao')
+_tarefas = {}
+_lock = threading.Lock()
+
+IDADE_MAXIMA_TAREFA = 6 * 60 * 60  # segundos
+
+
+def _atualizar(id_tarefa, **campos):
+    with _lock:
+        if id_tarefa in _tarefas:
+            _tarefas[id_tarefa].update(campos)
+
+
+def _executar(id_tarefa, funcao, args, kwargs):
+    def progresso(feito, total, mensagem=''):
+        fracao = min(max(feito / total, 0.0), 1.0) if total else 1.0
+        _atualizar(id_tarefa, progresso=fracao, mensagem=mensagem)
+
+    _atualizar(id_tarefa, status='executando', inicio=time.time())
+    try:
+        resultado = funcao(*args, progresso=progresso, **kwargs)
+    except Exception as e:
+        _atualizar(id_tarefa, status='erro', erro=str(e), detalhe=traceback.format_exc(), fim=time.time())
+    else:
+        _atualizar(id_tarefa, status='concluida', resultado=resultado, progresso=1.0, fim=time.time())
+
+
+# ---------- API ----------
+def submeter_tarefa(funcao, *args, descricao='', **kwargs):
+    # funcao recebe um callback progresso(feito, total, mensagem) como argumento nomeado
+    limpar_tarefas()
+    id_tarefa = uuid.uuid4().hex
+    with _lock:
+        _tarefas[id_tarefa] = {
+            'id': id_tarefa,
+            'descricao': descricao,
+            'status': 'pendente',
+            'progresso': 0.0,
+            'mensagem': 'Na fila...',
+            'resultado': None,
+            'erro': None,
+            'criada_em': time.time(),
+        }
+    _executor.submit(_executar, id_tarefa, funcao, args, kwargs)
+    return id_tarefa
+
+
+def consultar_tarefa(id_tarefa):
+    with _lock:
+        tarefa = _tarefas.get(id_tarefa)
+        return dict(tarefa) if tarefa else None
+
+
+def tarefa_em_andamento(id_tarefa):
+    tarefa = consultar_tarefa(id_tarefa)
+    return tarefa is not None and tarefa['status'] in ('pendente', 'executando')
+
+
+def limpar_tarefas(idade_maxima=IDADE_MAXIMA_TAREFA):
+    limite = time.time() - idade_maxima
+    with _lock:
+        for id_tarefa in [i for i, t in _tarefas.items()
+                          if t['status'] in ('concluida', 'erro') and t.get('fim', t['criada_em']) < limite]:
+            del _tarefas[id_tarefa]
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rotacao import atribuir_contas, montar_exclusoes
+
+CONTAS = 50000
+VENDEDORES = [f'Vendedor {i}' for i in range(80)]
+ANTIGOS = [f'Antigo {i}' for i in range(40)]  # no histórico, mas fora da lista atual
+# Segundos para atribuir as contas, com e sem balanceamento (~0,8 s aqui); folga para máquinas mais lentas
+TEMPO_MAXIMO = 1.5
+
+
+def cenario(seed=0):
+    # Exclusões da extração (Raiz_CNPJ) e do histórico completo (CSR por Conta_ID), com poucos
+    # vendedores bloqueados por conta: quase toda conta cai numa classe própria
+    rng = np.random.default_rng(seed)
+    nomes = VENDEDORES + ANTIGOS
+    cnpjs = np.array([f'{i:014d}' for i in range(CONTAS)], dtype=object)
+    exclusoes = montar_exclusoes(pd.DataFrame({
+        'Raiz_CNPJ': np.concatenate([cnpjs, rng.choice(cnpjs, CONTAS)]),
+        'Nome_Vendedor': rng.choice(nomes, 2 * CONTAS),
+    }))
+    contas_id = np.arange(CONTAS) * 3
+    pares = np.unique(np.c_[rng.choice(contas_id, 3 * CONTAS), rng.integers(1, len(nomes) + 1, 3 * CONTAS)], axis=0)
+    contas, inicio = np.unique(pares[:, 0], return_index=True)
+    exclusoes_historico = {
+        'contas': contas,
+        'inicio': np.append(inicio, len(pares)),
+        'vendedores': pares[:, 1],
+        'nomes': np.array([None] + nomes, dtype=object),
+    }
+    return cnpjs, exclusoes, contas_id, exclusoes_historico
+
+
+def test_atribuir_dezenas_de_milhares_de_contas():
+    cnpjs, exclusoes, contas_id, exclusoes_historico = cenario()
+    carga_atual = {v: i * 7 % 200 for i, v in enumerate(VENDEDORES)}
+    for carga in (None, carga_atual):
+        inicio = time.perf_counter()
+        destino = atribuir_contas(cnpjs, VENDEDORES, exclusoes, limite_por_vendedor=1000, seed=1,
+                                  carga_atual=carga, contas_id=contas_id, exclusoes_historico=exclusoes_historico)
+        segundos = time.perf_counter() - inicio
+        assert (destino >= 0).all()
+        assert segundos < TEMPO_MAXIMO, f"{segundos:.2f}s {'com' if carga else 'sem'} balanceamento"
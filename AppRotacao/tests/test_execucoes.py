@@ -0,0 +1,32 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import banco_local
+import execucoes
+from banco_local import inicializar_banco, registrar_rotacoes
+from execucoes import iniciar_execucao, finalizar_execucao, reverter_execucao, gerar_metricas
+
+
+def test_metricas_contam_so_rodadas_revertidas(tmp_path, monkeypatch):
+    # Banco e registros isolados; cada thread abre a própria conexão com o caminho novo
+    monkeypatch.setattr(banco_local, 'CAMINHO_BANCO', str(tmp_path / 'historico.db'))
+    monkeypatch.setattr(banco_local, '_conexoes', threading.local())
+    monkeypatch.setattr(execucoes, 'PASTA_REGISTROS', str(tmp_path))
+    monkeypatch.setattr(execucoes, 'ARQUIVO_EXECUCOES', str(tmp_path / 'execucoes_rotacao.jsonl'))
+    monkeypatch.setattr(execucoes, 'PASTA_METRICAS', str(tmp_path))
+    inicializar_banco()
+
+    ids = []
+    for conta_id in (1, 2):
+        execucao = iniciar_execucao('G1')
+        registrar_rotacoes([('Vendedor 1', conta_id, 'Distribuição', '2025-06-15')], lote_id=execucao['id'])
+        finalizar_execucao(execucao)
+        ids.append(execucao['id'])
+    reverter_execucao(ids[0])
+
+    linhas = gerar_metricas().splitlines()
+    assert 'rotacao_reversoes_total{grupo="G1"} 1' in linhas
+    assert 'rotacao_execucoes_total{grupo="G1",status="concluida"} 2' in linhas
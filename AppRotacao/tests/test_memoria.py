@@ -0,0 +1,87 @@
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rotacao import rotacionar_contas
+from relatorios import gerar_relatorios, relatorios_por_vendedor
+
+LINHAS = 10000
+VENDEDORES = [f'Vendedor {i}' for i in range(8)]
+DATA_ROTACAO = pd.Timestamp('2025-06-15')
+DATA_LIMITE = DATA_ROTACAO - pd.Timedelta(days=180)
+# Pico de memória rastreado, em múltiplos de memory_usage(deep=True) da base de entrada.
+# Montar os relatórios cabe em ~1x (os frames de saída); o xlsxwriter guarda a pasta de trabalho
+# inteira até fechar o arquivo, e é ele que domina o pico de gerar_relatorios (~12x nesta base).
+MULTIPLO_ROTACAO = 1.5
+MULTIPLO_MONTAGEM = 1.5
+MULTIPLO_RELATORIOS = 15
+
+
+def extracao_sintetica(linhas=LINHAS, seed=0):
+    # Base já enriquecida, com as colunas que a rotação e os relatórios leem
+    rng = np.random.default_rng(seed)
+
+    def datas(dias):
+        return DATA_ROTACAO - pd.to_timedelta(rng.integers(0, dias, linhas), unit='D')
+
+    entrada = pd.Series(DATA_ROTACAO - pd.Timedelta(days=60), index=range(linhas)).where(rng.random(linhas) < 0.5)
+    return pd.DataFrame({
+        'Conta_ID': np.arange(linhas),
+        'Razao_Social_Pessoas': [f'Empresa {i}' for i in range(linhas)],
+        'Raiz_CNPJ': [f'{i:014d}' for i in range(linhas)],
+        'Grupo_Econômico_ID': np.where(rng.random(linhas) < 0.1, 1.0, np.nan),
+        'Nome_Vendedor': rng.choice(VENDEDORES, linhas),
+        'Faturamento_6_Meses': np.where(rng.random(linhas) < 0.3, rng.random(linhas) * 1000, 0.0),
+        'Total_Pedidos': rng.integers(0, 5, linhas),
+        'Data_Ultima_Venda_Grupo_CNPJ': datas(900),
+        'Data_Abertura_Conta': datas(2000),
+        'Data_Entrou_Carteira': entrada,
+        'data_ultima_rotacao': entrada,
+        'Total_Contatos_Rotacao': rng.integers(0, 5, linhas),
+        'Data_Ultimo_Contato': datas(400),
+        'Total_Followups_Rotacao': rng.integers(0, 5, linhas),
+        'Data_Ultimo_Followup': datas(400),
+        'Total_Orcamentos_Rotacao': rng.integers(0, 5, linhas),
+        'Data_Ultimo_Orcamento': datas(400),
+    })
+
+
+def pico_de_memoria(funcao):
+    tracemalloc.start()
+    try:
+        funcao()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def test_rotacionar_contas_nao_copia_a_base():
+    df = extracao_sintetica()
+    tamanho = df.memory_usage(deep=True).sum()
+    pico = pico_de_memoria(lambda: rotacionar_contas(
+        df, VENDEDORES, {}, limite_por_vendedor=LINHAS, seed=1, registrar=False, data_rotacao=DATA_ROTACAO
+    ))
+    assert pico < MULTIPLO_ROTACAO * tamanho, f"pico {pico / tamanho:.2f}x a base"
+
+
+def test_montar_relatorios_nao_copia_a_base():
+    df = extracao_sintetica()
+    tamanho = df.memory_usage(deep=True).sum()
+    pico = pico_de_memoria(lambda: [
+        relatorio for _, relatorio in relatorios_por_vendedor(df, df, VENDEDORES, DATA_LIMITE, DATA_ROTACAO)
+    ])
+    assert pico < MULTIPLO_MONTAGEM * tamanho, f"pico {pico / tamanho:.2f}x a base"
+
+
+def test_gerar_relatorios_nao_copia_a_base(tmp_path):
+    df = extracao_sintetica()
+    tamanho = df.memory_usage(deep=True).sum()
+    pico = pico_de_memoria(lambda: gerar_relatorios(
+        df, df, DATA_LIMITE, DATA_ROTACAO, pasta_destino=str(tmp_path / 'relatorios')
+    ))
+    assert pico < MULTIPLO_RELATORIOS * tamanho, f"pico {pico / tamanho:.2f}x a base"